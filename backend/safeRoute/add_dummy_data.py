@@ -7,6 +7,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'safeRoute.settings')
 django.setup()
 
 from alerts.models import CrimeIncident
+from alerts import risk_areas
 
 # ULM Library coordinates (high risk)
 ULM_LIBRARY_LAT = 32.5293
@@ -65,4 +66,19 @@ incidents = [
 for incident in incidents:
     CrimeIncident.objects.create(**incident)
 
-print("Added dummy incidents successfully!") 
\ No newline at end of file
+print("Added dummy incidents successfully!")
+
+# Replace risk areas with the dummy set the map used to ship with
+risk_areas.clear_areas()
+risk_areas.add_areas([
+    # Current location (High Risk), 200 meters
+    {'latitude': 32.505, 'longitude': -92.1239, 'radius': 0.2, 'risk_category': 'A'},
+    # 25 meters north of current location, 25 meters radius
+    {'latitude': 32.505224, 'longitude': -92.1239, 'radius': 0.025, 'risk_category': 'A', 'crime_type': 'test_area'},
+    # ULM Library (High Risk)
+    {'latitude': ULM_LIBRARY_LAT, 'longitude': ULM_LIBRARY_LON, 'radius': 0.2, 'risk_category': 'A'},
+    # Schulze Dining (Low Risk)
+    {'latitude': SCHULZE_LAT, 'longitude': SCHULZE_LON, 'radius': 0.2, 'risk_category': 'C'},
+])
+
+print("Added dummy risk areas successfully!") 
\ No newline at end of file
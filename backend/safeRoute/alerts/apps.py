@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class AlertsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'alerts'
+
+    def ready(self):
+        if getattr(settings, 'METRICS_ENABLED', True):
+            from .metrics import install_query_timer
+            connection_created.connect(install_query_timer, dispatch_uid='alerts-query-timer')
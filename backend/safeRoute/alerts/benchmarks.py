@@ -0,0 +1,106 @@
+"""
+Benchmarks of the alerts hot paths against whatever data is in the database
+(see alerts/synthetic.py and the bench_suite command).
+
+Each benchmark runs `queries` requests at points drawn from the same
+clustered distribution as the synthetic data, so most of them land where the
+incidents and risk areas are, and returns latency_summary() of the timings
+in milliseconds. Views are called through django.test.Client, so the
+timings include URL routing, middleware and rendering but no network.
+"""
+import time
+import numpy as np
+from django.test import Client
+from .models import CrimeIncident
+from .utils import compute_risk_score
+
+# Side of the map viewport requested from map-risk-areas, in degrees
+VIEWPORT_DEG = 0.02
+PERCENTILES = (50, 95, 99)
+
+
+def latency_summary(samples_ms):
+    """Count, mean, percentiles and max of a list of timings in milliseconds."""
+    if not samples_ms:
+        return {'count': 0}
+    samples = np.asarray(samples_ms, dtype=float)
+    summary = {'count': len(samples), 'mean': round(float(samples.mean()), 3)}
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}'] = round(float(np.percentile(samples, percentile)), 3)
+    summary['max'] = round(float(samples.max()), 3)
+    return summary
+
+
+def _timed(calls):
+    """Run each call and time it. Returns (timings in ms, results)."""
+    timings = []
+    results = []
+    for call in calls:
+        start = time.perf_counter()
+        results.append(call())
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, results
+
+
+def _check_status(responses, expected):
+    errors = sum(1 for response in responses if response.status_code != expected)
+    return {'errors': errors}
+
+
+def bench_compute_risk_score(points, radius_km=1.0):
+    """compute_risk_score over the incidents loaded around each point, as the original views did."""
+    def call(lat, lon):
+        incidents = list(CrimeIncident.objects.around(lat, lon, radius_km))
+        return compute_risk_score(incidents, lat, lon, radius_km), len(incidents)
+
+    timings, results = _timed([lambda lat=lat, lon=lon: call(lat, lon) for lat, lon in points])
+    incidents = [count for _, count in results]
+    return {**latency_summary(timings), 'incidentsPerQuery': round(float(np.mean(incidents)), 1) if incidents else 0}
+
+
+def bench_map_risk_areas(client, points, viewport_deg=VIEWPORT_DEG):
+    """GET map-risk-areas for a viewport centered on each point."""
+    half = viewport_deg / 2
+    timings, responses = _timed([
+        lambda lat=lat, lon=lon: client.get('/api/map-risk-areas/', {
+            'sw_lat': lat - half, 'sw_lng': lon - half, 'ne_lat': lat + half, 'ne_lng': lon + half,
+        })
+        for lat, lon in points
+    ])
+    sizes = [len(response.content) for response in responses]
+    return {**latency_summary(timings), **_check_status(responses, 200),
+            'meanBytes': round(float(np.mean(sizes)), 1) if sizes else 0}
+
+
+def bench_risk_check(client, points, radius_km=0.2):
+    """GET risk/?mode=check, the request a moving client makes."""
+    timings, responses = _timed([
+        lambda lat=lat, lon=lon: client.get('/api/risk/', {'lat': lat, 'lon': lon, 'radius': radius_km, 'mode': 'check'})
+        for lat, lon in points
+    ])
+    return {**latency_summary(timings), **_check_status(responses, 200)}
+
+
+def bench_report_crime(client, city, count):
+    """POST report-crime with descriptions and locations drawn from the synthetic city."""
+    reports = [{'latitude': incident.latitude, 'longitude': incident.longitude, 'description': incident.description}
+               for incident in city.incidents(count)]
+    timings, responses = _timed([
+        lambda report=report: client.post('/api/report-crime/', report, content_type='application/json')
+        for report in reports
+    ])
+    return {**latency_summary(timings), **_check_status(responses, 201)}
+
+
+def run_all(city, queries=200, reports=50):
+    """Run every benchmark once. city supplies the query points and reports."""
+    latitudes, longitudes = city.points(queries)
+    points = list(zip(latitudes.tolist(), longitudes.tolist()))
+    client = Client()
+    return {
+        'compute_risk_score': bench_compute_risk_score(points),
+        'map_risk_areas': bench_map_risk_areas(client, points),
+        'risk_check': bench_risk_check(client, points),
+        # Last, since every report adds an incident and a risk area
+        'report_crime': bench_report_crime(client, city, reports),
+    }
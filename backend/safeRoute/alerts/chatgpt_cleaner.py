@@ -1,39 +1,102 @@
+import codecs
 import os
 import json
-import requests
-from bs4 import BeautifulSoup
+import logging
+import re
 import time
+import threading
+from datetime import datetime
+from pathlib import Path
+from .extraction_cache import ExtractionCache, cache_key
+from .html_text import iter_html_text
+from .metrics import timed
+from .utils import most_severe_keyword
 
-# Get Gemini API key from environment variable
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# requests is only imported when a URL is fetched or a remote extractor is
+# used, so importing this module (e.g. from a management command) stays
+# cheap and works without GEMINI_API_KEY.
 
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set. Please set it before running the application.")
+logger = logging.getLogger(__name__)
 
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+GEMINI_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+
+# Bump whenever the prompt or model changes so old cached results are not reused
+PROMPT_VERSION = "gemini-2.0-flash/v1"
+
+# Extraction results are cached on disk, keyed by a hash of the normalized
+# text and PROMPT_VERSION. Set EXTRACTION_CACHE_PATH to an empty string to disable.
+EXTRACTION_CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH", str(Path(__file__).resolve().parent.parent / "extraction_cache.sqlite3")
+)
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", 30 * 24 * 3600))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 100000))
+
+# Pages are streamed in PAGE_READ_CHUNK_BYTES pieces and cut off at MAX_PAGE_BYTES
+MAX_PAGE_BYTES = int(os.getenv("MAX_PAGE_BYTES", 5 * 1024 * 1024))
+PAGE_READ_CHUNK_BYTES = 64 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    "returns the shared extraction cache, or None if caching is disabled"
+    global _cache
+    if not EXTRACTION_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache(EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_MAX_ENTRIES)
+        return _cache
 
 def get_text_from_file(file_obj):
     "this reads and returns text from file"
     return file_obj.read().decode("utf-8")
 
-def get_text_from_url(url):
+def iter_text_from_file(file_obj):
+    "yields the text of a file a piece at a time"
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in iter(lambda: file_obj.read(PAGE_READ_CHUNK_BYTES), b""):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def iter_text_from_url(url, max_bytes=None):
     """
-    gets url and parses the HTML and returns text
+    Stream a page and yield its visible text piece by piece. Reading stops
+    after max_bytes (MAX_PAGE_BYTES by default), so memory use does not
+    depend on the page size.
     """
+    import requests
+
+    max_bytes = MAX_PAGE_BYTES if max_bytes is None else max_bytes
     try:
-        response = requests.get(url, timeout=10)  # Added 10 second timeout
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        for element in soup(["script", "style"]):
-            element.decompose()
-        return soup.get_text(separator=" ")
+        with requests.get(url, timeout=10, stream=True) as response:  # Added 10 second timeout
+            response.raise_for_status()
+
+            def capped_content():
+                received = 0
+                for chunk in response.iter_content(chunk_size=PAGE_READ_CHUNK_BYTES):
+                    chunk = chunk[:max_bytes - received]
+                    received += len(chunk)
+                    yield chunk
+                    if received >= max_bytes:
+                        logger.warning("Stopped reading %s after %s bytes", url, max_bytes)
+                        return
+
+            yield from iter_html_text(capped_content(), response.encoding)
     except requests.exceptions.Timeout:
         raise Exception("Request timed out while fetching URL")
     except requests.exceptions.RequestException as e:
         raise Exception(f"Error fetching URL: {str(e)}")
 
-def clean_and_extract(text, max_retries=3):
-    prompt = (
+def get_text_from_url(url, max_bytes=None):
+    """
+    gets url and parses the HTML and returns text
+    """
+    return "".join(iter_text_from_url(url, max_bytes)).strip()
+
+def build_prompt(text):
+    "the extraction prompt sent to the LLM for one report"
+    return (
         "You are an expert in data extraction and geospatial analysis. Analyze the following text and extract the following information: \n"
         "1. The first occurrence of latitude and longitude (if explicitly present). If they are not present, return null for each. \n"
         "2. The type of crime mentioned (e.g., theft, assault, etc.). \n"
@@ -48,39 +111,254 @@ def clean_and_extract(text, max_retries=3):
         "Return your answer in the format:\n"
         "{\n  \"latitude\": 45.123, \n  \"longitude\": -93.456, \n  \"crime_type\": \"theft\", \n  \"date\": \"2024-04-12T12:00:00Z\"}"
     )
-    
-    for attempt in range(max_retries):
+
+def extraction_error(details):
+    return {
+        "error": "failed to extract or parse data",
+        "details": details,
+        "latitude": None,
+        "longitude": None,
+        "crime_type": None,
+        "date": None
+    }
+
+class GeminiExtractor:
+    """
+    Sends the extraction prompt to a generateContent endpoint. Used for the
+    real Gemini API and for the local stub server, which speaks the same
+    protocol (see the extraction_stub_server command).
+    """
+    remote = True
+
+    def __init__(self, url, version=PROMPT_VERSION):
+        self.url = url
+        self.version = version
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def extract(self, text, max_retries=3):
+        prompt = build_prompt(text)
+        for attempt in range(max_retries):
+            try:
+                response = self._get_session().post(
+                    self.url,
+                    headers={"Content-Type": "application/json"},
+                    json={
+                        "contents": [
+                            {
+                                "parts": [{"text": prompt}]
+                            }
+                        ]
+                    },
+                    timeout=30
+                )
+                response.raise_for_status()
+                result = response.json()
+                extracted = result["candidates"][0]["content"]["parts"][0]["text"].strip()
+                # Clean up markdown code fences if present
+                if extracted.startswith("```"):
+                    extracted = extracted.split("\n", 1)[1]  # Remove first line
+                    extracted = extracted.rsplit("```", 1)[0]  # Remove last fence
+                    extracted = extracted.strip()
+                return json.loads(extracted)
+            except Exception as e:
+                if attempt == max_retries - 1:  # Last attempt
+                    return extraction_error(str(e))
+                time.sleep(2 ** attempt)  # Exponential backoff
+
+class RulesExtractor:
+    """Offline extractor that only uses the local regular expressions."""
+    remote = False
+    version = "rules/v1"
+
+    def extract(self, text, max_retries=3):
+        return extract_locally(text)
+
+def create_extractor(backend):
+    """
+    Build the extractor for an EXTRACTION_BACKEND value:
+    "gemini" (needs GEMINI_API_KEY), "rules" or "stub".
+    """
+    from django.conf import settings
+
+    if backend == "gemini":
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set. Please set it before running the application.")
+        return GeminiExtractor(f"{GEMINI_MODEL_URL}?key={api_key}")
+    if backend == "rules":
+        return RulesExtractor()
+    if backend == "stub":
+        url = getattr(settings, "EXTRACTION_STUB_URL", "http://127.0.0.1:8765/")
+        return GeminiExtractor(url, version=f"stub/{PROMPT_VERSION}")
+    raise ValueError(f"Unknown extraction backend '{backend}'. Use 'gemini', 'rules' or 'stub'.")
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+def get_extractor():
+    "returns the extractor selected by settings.EXTRACTION_BACKEND, created on first use"
+    global _extractor
+    from django.conf import settings
+
+    with _extractor_lock:
+        if _extractor is None:
+            _extractor = create_extractor(getattr(settings, "EXTRACTION_BACKEND", "gemini"))
+        return _extractor
+
+@timed('clean_and_extract')
+def clean_and_extract(text, max_retries=3, use_cache=True):
+    """
+    Extract coordinates, crime type and date from text with the configured
+    extractor backend. Successful remote results are cached, so the same
+    report is only sent once.
+    """
+    extractor = get_extractor()
+    cache = get_extraction_cache() if use_cache and extractor.remote else None
+    key = cache_key(text, extractor.version) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    data = extractor.extract(text, max_retries)
+    if cache and "error" not in data:
+        cache.set(key, data)
+    return data
+
+# Local rule-based extraction, tried before the remote LLM call
+
+# "32.5293° N, 92.0745° W"
+HEMISPHERE_COORDS_RE = re.compile(
+    r"(\d{1,2}(?:\.\d+)?)\s*°?\s*([NS])\b[\s,;/]+(\d{1,3}(?:\.\d+)?)\s*°?\s*([EW])\b", re.IGNORECASE
+)
+# "32.5293, -92.0745" (at least 3 decimals so ordinary numbers don't match)
+DECIMAL_COORDS_RE = re.compile(r"(?<![\d.])(-?\d{1,2}\.\d{3,})\s*,\s*(-?\d{1,3}\.\d{3,})(?!\d|\.\d)")
+ISO_DATE_RE = re.compile(
+    r"\b(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}(?::\d{2})?)(Z|[+-]\d{2}:?\d{2})?)?\b"
+)
+MONTHS = ["january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december"]
+# "April 12, 2024, at approximately 2:30 PM"
+WRITTEN_DATE_RE = re.compile(
+    r"\b(" + "|".join(m[:3] for m in MONTHS) + r")[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})"
+    r"(?:,?\s+(?:at\s+)?(?:approximately\s+|about\s+|around\s+)?(\d{1,2}):(\d{2})\s*([ap])\.?m\.?)?",
+    re.IGNORECASE,
+)
+# "04/12/2024"
+US_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+
+# Local results at or above this confidence skip the remote call
+LOCAL_CONFIDENCE_THRESHOLD = 0.8
+
+_path_stats = {"local": 0, "remote": 0, "remote_seconds": 0.0}
+_path_stats_lock = threading.Lock()
+
+def _find_coordinates(text):
+    match = HEMISPHERE_COORDS_RE.search(text)
+    if match:
+        lat, lat_hemi, lon, lon_hemi = match.groups()
+        lat = float(lat) * (-1 if lat_hemi.upper() == "S" else 1)
+        lon = float(lon) * (-1 if lon_hemi.upper() == "W" else 1)
+    else:
+        match = DECIMAL_COORDS_RE.search(text)
+        if not match:
+            return None, None
+        lat, lon = float(match.group(1)), float(match.group(2))
+
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None, None
+
+def _find_date(text):
+    match = ISO_DATE_RE.search(text)
+    if match:
+        day, clock, zone = match.groups()
+        if not clock:
+            return day
+        if len(clock) == 5:
+            clock += ":00"
+        return f"{day}T{clock}{zone or ''}"
+
+    match = WRITTEN_DATE_RE.search(text)
+    if match:
+        month, day, year, hour, minute, meridiem = match.groups()
+        month = [m[:3] for m in MONTHS].index(month[:3].lower()) + 1
         try:
-            response = requests.post(
-                GEMINI_API_URL,
-                headers={"Content-Type": "application/json"},
-                json={
-                    "contents": [
-                        {
-                            "parts": [{"text": prompt}]
-                        }
-                    ]
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            extracted = result["candidates"][0]["content"]["parts"][0]["text"].strip()
-            # Clean up markdown code fences if present
-            if extracted.startswith("```"):
-                extracted = extracted.split("\n", 1)[1]  # Remove first line
-                extracted = extracted.rsplit("```", 1)[0]  # Remove last fence
-                extracted = extracted.strip()
-            data = json.loads(extracted)
-            return data
-        except Exception as e:
-            if attempt == max_retries - 1:  # Last attempt
-                return {
-                    "error": "failed to extract or parse data",
-                    "details": str(e),
-                    "latitude": None,
-                    "longitude": None,
-                    "crime_type": None,
-                    "date": None
-                }
-            time.sleep(2 ** attempt)  # Exponential backoff
\ No newline at end of file
+            if hour is None:
+                return datetime(int(year), month, int(day)).date().isoformat()
+            hour = int(hour) % 12 + (12 if meridiem.lower() == "p" else 0)
+            return datetime(int(year), month, int(day), hour, int(minute)).isoformat()
+        except ValueError:
+            return None
+
+    match = US_DATE_RE.search(text)
+    if match:
+        month, day, year = (int(g) for g in match.groups())
+        try:
+            return datetime(year, month, day).date().isoformat()
+        except ValueError:
+            return None
+    return None
+
+def _find_crime_type(text):
+    # The most severe keyword wins, like determine_severity_from_data
+    return most_severe_keyword(text)
+
+def extract_locally(text):
+    """
+    Deterministic extraction of coordinates, crime type and date with
+    regular expressions. Returns the same keys as clean_and_extract plus a
+    0-1 "confidence": coordinates count 0.5, crime type 0.3 and date 0.2.
+    """
+    latitude, longitude = _find_coordinates(text)
+    crime_type = _find_crime_type(text)
+    date = _find_date(text)
+    confidence = (0.5 if latitude is not None else 0) + (0.3 if crime_type else 0) + (0.2 if date else 0)
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "crime_type": crime_type,
+        "date": date,
+        "confidence": round(confidence, 2),
+    }
+
+def extract(text, use_local=True, before_remote=None):
+    """
+    Extract crime data, using the local rules when they are confident
+    enough and falling back to clean_and_extract otherwise. The result's
+    "extraction_path" says which one answered ("local" or "remote").
+    before_remote, if given, is called right before the remote call
+    (e.g. to rate limit it).
+    """
+    # Without a remote backend the local result is the best there is, and
+    # a confident local result never needs the backend (or its API key)
+    if use_local or not get_extractor().remote:
+        local = extract_locally(text)
+        if local["confidence"] >= LOCAL_CONFIDENCE_THRESHOLD or not get_extractor().remote:
+            with _path_stats_lock:
+                _path_stats["local"] += 1
+            local["extraction_path"] = "local"
+            return local
+
+    if before_remote:
+        before_remote()
+    start = time.perf_counter()
+    data = dict(clean_and_extract(text))
+    with _path_stats_lock:
+        _path_stats["remote"] += 1
+        _path_stats["remote_seconds"] += time.perf_counter() - start
+    data["extraction_path"] = "remote"
+    return data
+
+def extraction_path_stats():
+    """How many extractions took each path, and the average remote latency."""
+    with _path_stats_lock:
+        stats = dict(_path_stats)
+    stats["avg_remote_seconds"] = stats["remote_seconds"] / stats["remote"] if stats["remote"] else None
+    return stats
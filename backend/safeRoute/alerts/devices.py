@@ -0,0 +1,87 @@
+"""
+Finding registered devices near a point.
+
+Devices store their last known location with a geohash in an indexed
+column. A radius query becomes a few index range scans over the geohash
+cells the circle can touch (see alerts.geohash), followed by an exact
+distance check on the candidates, so it never scans the whole table.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from . import geohash
+from .models import Device
+from .utils import calculate_distance
+
+# Cell lists are OR-ed into one query; keep each query's range count modest
+CELLS_PER_QUERY = 200
+
+
+def _location_cutoff():
+    """Locations older than DEVICE_LOCATION_MAX_AGE_HOURS are not used for alerts."""
+    max_age = getattr(settings, 'DEVICE_LOCATION_MAX_AGE_HOURS', 24)
+    return timezone.now() - timedelta(hours=max_age) if max_age else None
+
+
+def _candidates(cells):
+    queryset = Device.objects.all()
+    cutoff = _location_cutoff()
+    if cutoff is not None:
+        queryset = queryset.filter(location_updated_at__gte=cutoff)
+
+    cells = sorted(cells)
+    for start in range(0, len(cells), CELLS_PER_QUERY):
+        chunk = queryset.in_geohash_cells(cells[start:start + CELLS_PER_QUERY])
+        yield from chunk.only('id', 'push_token', 'latitude', 'longitude', 'geohash').iterator(chunk_size=2000)
+
+
+def devices_near(latitude, longitude, radius_km):
+    """(distance_km, device) for devices last seen within radius_km of the point, nearest first."""
+    matches = []
+    for device in _candidates(geohash.covering_cells(latitude, longitude, radius_km)):
+        distance = calculate_distance(latitude, longitude, device.latitude, device.longitude)
+        if distance <= radius_km:
+            matches.append((distance, device.id, device))
+    matches.sort(key=lambda item: (item[0], item[1]))
+    return [(distance, device) for distance, _, device in matches]
+
+
+def devices_near_points(points, radius_km):
+    """
+    Match many points at once: {device: [(distance_km, point index), ...]}
+    for every device within radius_km of at least one point. Candidate
+    devices for all points are fetched with shared queries.
+    """
+    cells_by_point = [geohash.covering_cells(lat, lon, radius_km) for lat, lon in points]
+    points_by_cell = {}
+    for index, cells in enumerate(cells_by_point):
+        for cell in cells:
+            points_by_cell.setdefault(cell, []).append(index)
+
+    prefix_lengths = {len(cell) for cell in points_by_cell}
+    matches = {}
+    seen_devices = set()
+    for device in _candidates(points_by_cell):
+        # Nested cells of different precisions can return a device twice
+        if device.id in seen_devices:
+            continue
+        seen_devices.add(device.id)
+        seen = set()
+        # The device's own hash starts with every covering cell it lies in
+        for length in prefix_lengths:
+            for index in points_by_cell.get(device.geohash[:length], ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                lat, lon = points[index]
+                distance = calculate_distance(lat, lon, device.latitude, device.longitude)
+                if distance <= radius_km:
+                    matches.setdefault(device, []).append((distance, index))
+    return matches
+
+
+def update_location(device, latitude, longitude):
+    """Record a device's current location."""
+    device.set_location(latitude, longitude)
+    device.save(update_fields=['latitude', 'longitude', 'geohash', 'location_updated_at', 'updated_at'])
+    return device
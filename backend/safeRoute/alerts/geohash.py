@@ -0,0 +1,106 @@
+"""
+Geohash encoding and radius coverage.
+
+A geohash is a base32 string where every extra character narrows the cell,
+so all points in a cell share its hash as a prefix. Stored in an indexed
+column this turns "what is near here" into a handful of index range scans:
+covering_cells picks the finest precision at which the circle's bounding
+box spans at most MAX_COVERING_CELLS cells and returns those cells. A 1 km
+alert radius reads about 9 km2 of precision-6 cells (about 1.2 x 0.6 km
+each) rather than 15 x 15 km of radius-sized ones.
+"""
+import math
+from .spatial_index import KM_PER_DEGREE
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Precision stored for devices: cells of roughly 4.9 m x 4.9 m
+STORED_PRECISION = 9
+# Upper bound on the cells (index range scans) used for one circle
+MAX_COVERING_CELLS = 48
+
+
+def encode(latitude, longitude, precision=STORED_PRECISION):
+    """Geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) of a cell at this precision, in degrees."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _pads(latitude, radius_km):
+    """(lat_pad, lon_pad) in degrees of the circle's bounding box."""
+    lat_pad = radius_km / KM_PER_DEGREE
+    lon_pad = lat_pad / max(math.cos(math.radians(min(abs(latitude) + lat_pad, 89.9))), 1e-6)
+    return lat_pad, min(lon_pad, 180.0)
+
+
+def _grid(latitude, longitude, radius_km, precision):
+    """(rows, columns, columns around the globe) of the cells covering the circle's bounding box."""
+    height, width = cell_size(precision)
+    lat_pad, lon_pad = _pads(latitude, radius_km)
+    south = max(latitude - lat_pad, -90.0)
+    north = min(latitude + lat_pad, 90.0)
+    first_row = math.floor((south + 90.0) / height)
+    last_row = min(math.floor((north + 90.0) / height), round(180.0 / height) - 1)
+    columns = round(360.0 / width)
+    first_col = math.floor((longitude - lon_pad + 180.0) / width)
+    last_col = math.floor((longitude + lon_pad + 180.0) / width)
+    if last_col - first_col + 1 >= columns:
+        first_col, last_col = 0, columns - 1
+    return range(first_row, last_row + 1), range(first_col, last_col + 1), columns
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohashes of the cells covering the bounding box of a circle of
+    radius_km around the point, at the finest precision that needs at
+    most MAX_COVERING_CELLS of them.
+    """
+    for precision in range(STORED_PRECISION, 1, -1):
+        rows, cols, columns = _grid(latitude, longitude, radius_km, precision)
+        if len(rows) * len(cols) <= MAX_COVERING_CELLS:
+            break
+    else:
+        precision = 1
+        rows, cols, columns = _grid(latitude, longitude, radius_km, precision)
+
+    height, width = cell_size(precision)
+    cells = set()
+    for row in rows:
+        for col in cols:
+            # Encode the cell's center; columns wrap around the antimeridian
+            center_lat = -90.0 + (row + 0.5) * height
+            center_lon = -180.0 + ((col % columns) + 0.5) * width
+            cells.add(encode(center_lat, center_lon, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """(lower, upper) bounds such that lower <= hash < upper for every hash starting with prefix."""
+    # '~' sorts after every base32 character
+    return prefix, prefix + '~'
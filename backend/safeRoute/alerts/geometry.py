@@ -0,0 +1,95 @@
+import math
+from functools import lru_cache
+
+# Geometry encodings MapRiskAreasAPIView can return
+GEOMETRY_ENCODINGS = ('points', 'polyline', 'flat', 'none')
+
+
+@lru_cache(maxsize=65536)
+def circle_points(lat, lng, radius_km):
+    """
+    Points approximating a circle, one every 10 degrees.
+    Cached by center and radius, so an area that changes simply gets a new
+    cache entry.
+    """
+    # Convert radius from kilometers to degrees
+    radius_deg = radius_km / 111.32
+
+    points = []
+    for i in range(0, 360, 10):
+        angle = i * (3.14159 / 180)  # Convert to radians
+        points.append((lat + (radius_deg * math.cos(angle)), lng + (radius_deg * math.sin(angle))))
+    return tuple(points)
+
+
+def encode_polyline(points, precision=5):
+    """Encode (lat, lng) pairs with Google's encoded polyline algorithm."""
+    factor = 10 ** precision
+    encoded = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat_e5 = int(round(lat * factor))
+        lng_e5 = int(round(lng * factor))
+        for delta in (lat_e5 - prev_lat, lng_e5 - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        prev_lat, prev_lng = lat_e5, lng_e5
+    return ''.join(encoded)
+
+
+def decode_polyline(encoded, precision=5):
+    """(lat, lng) pairs from a Google encoded polyline. Raises ValueError if it is malformed."""
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                if index >= len(encoded):
+                    raise ValueError("Truncated polyline")
+                byte = ord(encoded[index]) - 63
+                index += 1
+                if byte < 0 or byte > 0x3f:
+                    raise ValueError("Invalid polyline character")
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+@lru_cache(maxsize=65536)
+def _encoded(lat, lng, radius_km, encoding):
+    # Only immutable values are cached; they end up in many responses
+    points = circle_points(lat, lng, radius_km)
+    if encoding == 'polyline':
+        return encode_polyline(points)
+    if encoding == 'flat':
+        return tuple(round(value, 6) for point in points for value in point)
+    return points
+
+
+def encoded_circle(lat, lng, radius_km, encoding='points'):
+    """
+    Circle geometry ready to drop into a response:
+    - points: list of {'latitude', 'longitude'} dicts, new on every call
+    - polyline: Google encoded polyline string
+    - flat: (lat0, lng0, lat1, lng1, ...) rounded to 6 decimals
+    - none: None, clients draw the circle from center and radius
+    """
+    if encoding == 'none':
+        return None
+
+    encoded = _encoded(lat, lng, radius_km, encoding)
+    if encoding == 'points':
+        return [{'latitude': point_lat, 'longitude': point_lng} for point_lat, point_lng in encoded]
+    return encoded
@@ -0,0 +1,337 @@
+"""
+Precomputed risk heatmap tiles.
+
+Risk scores are evaluated on a fixed grid: every web mercator tile at
+TILE_ZOOM is split into TILE_CELLS x TILE_CELLS cells (about 60 m across
+around Monroe) and the score at each cell center is stored in a RiskTile.
+Coarser zoom levels down to MIN_TILE_ZOOM are max-pooled from their
+children, so serving any tile is a single row lookup.
+
+Scores decay with time, so the whole grid should be rebuilt periodically
+with the build_risk_tiles command. New incidents only recompute the cells
+within INFLUENCE_RADIUS_KM of the incident; schedule_update() does that on
+a background thread so reports don't wait for it.
+"""
+import logging
+import math
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from . import incident_buckets
+from .models import RiskTile
+from .risk_engine import KM_PER_DEGREE, haversine_km
+
+logger = logging.getLogger(__name__)
+
+TILE_ZOOM = 15
+MIN_TILE_ZOOM = 11
+TILE_CELLS = 16
+# Same radius compute_risk_score uses by default
+INFLUENCE_RADIUS_KM = 1.0
+
+
+def lat_lon_to_tile(lat, lon, z):
+    """Fractional web mercator tile coordinates for a point."""
+    n = 2 ** z
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_to_lat_lon(x, y, z):
+    """Inverse of lat_lon_to_tile. Works on numpy arrays too."""
+    n = 2 ** z
+    lon = np.asarray(x) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y) / n))))
+    return lat, lon
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a tile in degrees."""
+    north, west = tile_to_lat_lon(x, y, z)
+    south, east = tile_to_lat_lon(x + 1, y + 1, z)
+    return float(south), float(west), float(north), float(east)
+
+
+def cell_centers(x, y):
+    """Latitude and longitude of every cell center of a TILE_ZOOM tile."""
+    offsets = (np.arange(TILE_CELLS) + 0.5) / TILE_CELLS
+    cols, rows = np.meshgrid(offsets, offsets)
+    return tile_to_lat_lon(x + cols, y + rows, TILE_ZOOM)
+
+
+def tiles_for_bbox(south, west, north, east, z=TILE_ZOOM):
+    """All (x, y) tiles at zoom z that overlap the bounding box."""
+    min_x, min_y = lat_lon_to_tile(north, west, z)
+    max_x, max_y = lat_lon_to_tile(south, east, z)
+    last = 2 ** z - 1
+    return [
+        (x, y)
+        for x in range(max(int(min_x), 0), min(int(max_x), last) + 1)
+        for y in range(max(int(min_y), 0), min(int(max_y), last) + 1)
+    ]
+
+
+def pad_bbox(south, west, north, east, radius_km):
+    """Grow a bounding box by radius_km on every side."""
+    lat_pad = radius_km / KM_PER_DEGREE
+    lon_pad = lat_pad / max(math.cos(math.radians(max(abs(south), abs(north)) + lat_pad)), 1e-6)
+    return south - lat_pad, west - lon_pad, north + lat_pad, east + lon_pad
+
+
+def _load_engine(south, west, north, east):
+    """Risk engine over every incident (or bucket) that can influence the bounding box."""
+    return incident_buckets.load_engine(*pad_bbox(south, west, north, east, INFLUENCE_RADIUS_KM))
+
+
+def _decode(tile):
+    if tile is None:
+        return np.zeros((TILE_CELLS, TILE_CELLS), dtype=np.float32)
+    return np.frombuffer(bytes(tile.scores), dtype='<f4').reshape(TILE_CELLS, TILE_CELLS).copy()
+
+
+def _save_many(z, tiles):
+    """Insert or replace {(x, y): scores} tiles at zoom z in one statement per batch."""
+    RiskTile.objects.bulk_create(
+        [RiskTile(z=z, x=x, y=y, scores=scores.astype('<f4').tobytes()) for (x, y), scores in tiles.items()],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['z', 'x', 'y'],
+        update_fields=['scores', 'computed_at'],
+    )
+
+
+def _load_many(z, tiles, for_update=False):
+    """Stored {(x, y): RiskTile} for the given tiles at zoom z."""
+    if not tiles:
+        return {}
+    xs = [x for x, _ in tiles]
+    ys = [y for _, y in tiles]
+    wanted = set(tiles)
+    queryset = RiskTile.objects.filter(z=z, x__range=(min(xs), max(xs)), y__range=(min(ys), max(ys)))
+    if for_update:
+        queryset = queryset.select_for_update()
+    return {(t.x, t.y): t for t in queryset if (t.x, t.y) in wanted}
+
+
+def _lock_tiles(z, tiles):
+    """
+    Lock tiles for the rest of the transaction and return them like
+    _load_many. Missing tiles are created empty first: on SQLite that write
+    takes the database lock before anything is read, elsewhere every row
+    then exists for select_for_update to lock.
+    """
+    empty = _decode(None).tobytes()
+    RiskTile.objects.bulk_create([RiskTile(z=z, x=x, y=y, scores=empty) for x, y in tiles],
+                                 batch_size=500, ignore_conflicts=True)
+    return _load_many(z, tiles, for_update=True)
+
+
+def _rebuild_parents(tiles):
+    """Max-pool changed TILE_ZOOM tiles into every coarser zoom level."""
+    changed = set(tiles)
+    for z in range(TILE_ZOOM, MIN_TILE_ZOOM, -1):
+        parents = {(x // 2, y // 2) for x, y in changed}
+        children = _load_many(z, [
+            (2 * px + dx, 2 * py + dy) for px, py in parents for dx in (0, 1) for dy in (0, 1)
+        ])
+        pooled = {}
+        for px, py in parents:
+            grid = np.block([
+                [_decode(children.get((2 * px, 2 * py))), _decode(children.get((2 * px + 1, 2 * py)))],
+                [_decode(children.get((2 * px, 2 * py + 1))), _decode(children.get((2 * px + 1, 2 * py + 1)))],
+            ])
+            pooled[(px, py)] = grid.reshape(TILE_CELLS, 2, TILE_CELLS, 2).max(axis=(1, 3))
+        _save_many(z - 1, pooled)
+        changed = parents
+
+
+def build_tiles(south, west, north, east):
+    """Compute every TILE_ZOOM tile covering the bounding box from scratch."""
+    tiles = tiles_for_bbox(south, west, north, east)
+    if not tiles:
+        return 0
+
+    engine = _load_engine(south, west, north, east)
+    now = timezone.now()
+    computed = {}
+    for x, y in tiles:
+        lats, lons = cell_centers(x, y)
+        scores = engine.score_many(lats.ravel(), lons.ravel(), INFLUENCE_RADIUS_KM, now=now, grouped=True)
+        computed[(x, y)] = scores.reshape(TILE_CELLS, TILE_CELLS)
+
+    with transaction.atomic():
+        _save_many(TILE_ZOOM, computed)
+        _rebuild_parents(tiles)
+    return len(tiles)
+
+
+def update_for_points(points):
+    """
+    Recompute only the cells within INFLUENCE_RADIUS_KM of the given
+    (lat, lon) incident locations. Returns the number of cells recomputed.
+
+    The other cells of each tile are kept, so the tiles are locked before
+    they are read and scored: concurrent updates (other workers, the
+    backfill) apply one after the other instead of overwriting each
+    other's cells with stale copies.
+    """
+    points = list(points)
+    if not points:
+        return 0
+
+    inc_lats = np.array([lat for lat, _ in points])
+    inc_lons = np.array([lon for _, lon in points])
+    tiles = set()
+    for lat, lon in zip(inc_lats, inc_lons):
+        tiles.update(tiles_for_bbox(*pad_bbox(lat, lon, lat, lon, INFLUENCE_RADIUS_KM)))
+
+    # Cells each tile needs recomputed
+    affected = {}
+    for x, y in sorted(tiles):
+        south, west, north, east = pad_bbox(*tile_bounds(TILE_ZOOM, x, y), INFLUENCE_RADIUS_KM)
+        nearby = ((inc_lats >= south) & (inc_lats <= north) &
+                  (inc_lons >= west) & (inc_lons <= east))
+        if not nearby.any():
+            continue
+
+        lats, lons = cell_centers(x, y)
+        distances = haversine_km(lats[..., None], lons[..., None], inc_lats[nearby], inc_lons[nearby])
+        cells = (distances <= INFLUENCE_RADIUS_KM).any(axis=-1)
+        if cells.any():
+            affected[(x, y)] = (lats[cells], lons[cells], cells)
+    if not affected:
+        return 0
+
+    now = timezone.now()
+    changed = {}
+    recomputed = 0
+    with transaction.atomic():
+        existing = _lock_tiles(TILE_ZOOM, list(affected))
+        # Loaded under the lock, so it sees every incident committed before
+        # it, and only what can reach those tiles, so a spread-out batch
+        # doesn't load the whole city
+        engine = incident_buckets.load_engine_for_boxes([
+            pad_bbox(*tile_bounds(TILE_ZOOM, x, y), INFLUENCE_RADIUS_KM) for x, y in affected
+        ])
+        for (x, y), (lats, lons, cells) in affected.items():
+            scores = _decode(existing.get((x, y)))
+            scores[cells] = engine.score_many(lats, lons, INFLUENCE_RADIUS_KM, now=now, grouped=True)
+            changed[(x, y)] = scores
+            recomputed += int(cells.sum())
+        _save_many(TILE_ZOOM, changed)
+        _rebuild_parents(changed)
+    return recomputed
+
+
+def update_for_incidents(incidents):
+    """update_for_points for saved CrimeIncidents."""
+    return update_for_points([(incident.latitude, incident.longitude) for incident in incidents])
+
+
+def _update_logged(points):
+    try:
+        update_for_points(points)
+    except Exception:
+        logger.exception("Error updating risk tiles")
+
+
+class TileUpdater:
+    """
+    Background thread recomputing the cells around queued incident
+    locations. Locations queued while an update runs are handled together
+    in the next one, so a burst of reports loads the engine once.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._running = False
+        self._thread = None
+        self._condition = threading.Condition()
+
+    def submit(self, points):
+        with self._condition:
+            self._pending.extend(points)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='risk-tile-updater', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def flush(self, timeout=None):
+        """Wait until every queued location has been handled. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                points, self._pending = self._pending, []
+                self._running = True
+            try:
+                _update_logged(points)
+            finally:
+                close_old_connections()
+                with self._condition:
+                    self._running = False
+                    self._condition.notify_all()
+
+
+_updater = None
+_updater_lock = threading.Lock()
+
+
+def get_updater():
+    """The shared tile updater for this process."""
+    global _updater
+    with _updater_lock:
+        if _updater is None:
+            _updater = TileUpdater()
+        return _updater
+
+
+def schedule_update(incidents):
+    """
+    Recompute the cells around new incidents once the current transaction
+    commits: on the background updater, or right away if
+    RISK_TILE_BACKGROUND is off.
+    """
+    points = [(incident.latitude, incident.longitude) for incident in incidents]
+    if not points:
+        return
+    if getattr(settings, 'RISK_TILE_BACKGROUND', True):
+        transaction.on_commit(lambda: get_updater().submit(points))
+    else:
+        transaction.on_commit(lambda: _update_logged(points))
+
+
+def get_tile_scores(z, x, y):
+    """
+    Scores for a z/x/y tile as a TILE_CELLS x TILE_CELLS array, or None if
+    the zoom level is not served. Tiles that were never computed have no
+    risk. Zoom levels above TILE_ZOOM are cut out of their TILE_ZOOM
+    ancestor.
+    """
+    if z < MIN_TILE_ZOOM:
+        return None
+
+    if z <= TILE_ZOOM:
+        return _decode(RiskTile.objects.filter(z=z, x=x, y=y).first())
+
+    shift = z - TILE_ZOOM
+    ancestor = _decode(RiskTile.objects.filter(z=TILE_ZOOM, x=x >> shift, y=y >> shift).first())
+    span = 2 ** shift
+    if span > TILE_CELLS:
+        # Finer than one cell per tile: the whole tile sits inside one cell
+        row = (y % span) * TILE_CELLS // span
+        col = (x % span) * TILE_CELLS // span
+        return np.full((TILE_CELLS, TILE_CELLS), ancestor[row, col], dtype=np.float32)
+
+    size = TILE_CELLS // span
+    row = (y % span) * size
+    col = (x % span) * size
+    block = ancestor[row:row + size, col:col + size]
+    return np.repeat(np.repeat(block, span, axis=0), span, axis=1)
@@ -0,0 +1,101 @@
+"""
+Incremental HTML to text conversion.
+
+TextStripper is fed the page a piece at a time and only ever holds the
+text it has not handed out yet, so memory stays bounded no matter how
+long the page is. chunk_text splits the resulting stream into pieces
+small enough to extract separately.
+"""
+import codecs
+import re
+from html.parser import HTMLParser
+
+# Content of these tags is never visible text
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'head'}
+# Tags that start a new paragraph, so separate incidents stay separate
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset',
+    'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr',
+    'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+}
+WHITESPACE_RE = re.compile(r'\s+')
+PARAGRAPH_RE = re.compile(r' *\n\n\s*')
+
+
+class TextStripper(HTMLParser):
+    """HTML parser that keeps only visible text, collapsing whitespace."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._skip_depth = 0
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._parts.append('\n\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(WHITESPACE_RE.sub(' ', data))
+
+    def pop_text(self):
+        """Text produced since the last call."""
+        text = PARAGRAPH_RE.sub('\n\n', ''.join(self._parts))
+        self._parts = []
+        return text
+
+
+def iter_html_text(byte_chunks, encoding='utf-8'):
+    """Yield the visible text of an HTML document given as an iterable of bytes."""
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    stripper = TextStripper()
+    for chunk in byte_chunks:
+        stripper.feed(decoder.decode(chunk))
+        text = stripper.pop_text()
+        if text:
+            yield text
+    stripper.feed(decoder.decode(b'', final=True))
+    stripper.close()
+    text = stripper.pop_text()
+    if text:
+        yield text
+
+
+def _split_point(text, max_chars):
+    """Where to cut text that is longer than max_chars: paragraph, then sentence, then space."""
+    for separator in ('\n\n', '. ', ' '):
+        cut = text.rfind(separator, max_chars // 2, max_chars)
+        if cut != -1:
+            return cut + len(separator)
+    return max_chars
+
+
+def chunk_text(pieces, max_chars=4000):
+    """
+    Regroup an iterable of text pieces into chunks of at most max_chars,
+    preferring to split between paragraphs or sentences. Blank chunks are
+    skipped.
+    """
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) > max_chars:
+            cut = _split_point(buffer, max_chars)
+            chunk, buffer = buffer[:cut].strip(), buffer[cut:]
+            if chunk:
+                yield chunk
+    buffer = buffer.strip()
+    if buffer:
+        yield buffer
@@ -0,0 +1,439 @@
+"""
+Per-cell, per-day incident totals for risk scoring.
+
+Every incident is added to the IncidentBucket of its INCIDENT_BUCKET_DEG
+grid cell and UTC day when it is inserted. A bucket keeps the count, the
+coordinate sums (for its centroid), the severity sum and maximum, and the
+severity-weighted sum of report times. Scoring treats each bucket as its
+incidents gathered at the centroid:
+
+- time decay is linear in report time between 24 hours and 30 days and
+  constant outside, so the decayed severity sum of a bucket equals its
+  severity sum times the decay at its severity-weighted mean report time
+  whenever all of its incidents fall in the same stretch of the curve;
+- the strongest single incident is taken as the bucket's highest severity
+  at its latest report time.
+
+Both are exact for a bucket holding one incident, or incidents reported
+at the same spot. Scores fall off tenfold every ~33 m, so the default
+cells are ~3 m wide: only reports from practically the same address share
+a bucket, and scores stay within 0.01 of compute_risk_score (pinned by
+the tests on synthetic data).
+
+Once a day is more than 30 days old its decay is 0.1 forever, so
+compact() merges its buckets into one archive bucket per cell. Reports
+keep recurring at the same addresses and intersections, so the number of
+buckets near a point is bounded by the places incidents happen rather
+than by the length of the history.
+
+Deleting or editing an incident takes it back out of its bucket. The
+bucket's highest severity and latest report time are left as they were
+(an upper bound) until the next rebuild.
+
+Set INCIDENT_SCORING = 'exact' (or pass exact=True) to score the raw
+incidents instead, exactly like compute_risk_score.
+"""
+import math
+from collections import defaultdict
+from datetime import date, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .metrics import timed
+from .models import CrimeIncident, IncidentBucket
+from .risk_engine import MAX_PAIRS_PER_CHUNK, RiskEngine, KM_PER_DEGREE, haversine_km
+
+# Day of the bucket every cell's fully decayed incidents are merged into
+ARCHIVE_DAY = date(1970, 1, 1)
+# utils.time_decay reaches its floor after 720 hours
+DECAY_DAYS = 30
+
+
+def _bucket_deg():
+    return getattr(settings, 'INCIDENT_BUCKET_DEG', 0.00003)
+
+
+def _exact_default():
+    return getattr(settings, 'INCIDENT_SCORING', 'buckets') == 'exact'
+
+
+def cell_of(latitude, longitude):
+    """(cell_lat, cell_lon) of the grid cell holding a point."""
+    deg = _bucket_deg()
+    return math.floor(latitude / deg), math.floor(longitude / deg)
+
+
+def archive_cutoff(now=None):
+    """Days before this are fully decayed and belong in the archive bucket."""
+    now = now or timezone.now()
+    return now.astimezone(dt_timezone.utc).date() - timedelta(days=DECAY_DAYS)
+
+
+def _as_aware(reported_at):
+    if timezone.is_naive(reported_at):
+        return timezone.make_aware(reported_at)
+    return reported_at
+
+
+def _totals(incidents, now=None, archive=True):
+    """
+    {(cell_lat, cell_lon, day): totals} for a batch of incidents. Days
+    before the archive cutoff are keyed by ARCHIVE_DAY unless archive is
+    False.
+    """
+    cutoff = archive_cutoff(now) if archive else date.min
+    totals = {}
+    for incident in incidents:
+        reported_at = _as_aware(incident.reported_at)
+        day = reported_at.astimezone(dt_timezone.utc).date()
+        key = (*cell_of(incident.latitude, incident.longitude), ARCHIVE_DAY if day < cutoff else day)
+        severity = incident.severity or 1
+        bucket = totals.get(key)
+        if bucket is None:
+            bucket = totals[key] = {
+                'count': 0, 'latitude_sum': 0.0, 'longitude_sum': 0.0, 'severity_sum': 0,
+                'severity_max': 0, 'severity_time_sum': 0.0, 'last_reported_at': reported_at,
+            }
+        bucket['count'] += 1
+        bucket['latitude_sum'] += incident.latitude
+        bucket['longitude_sum'] += incident.longitude
+        bucket['severity_sum'] += severity
+        bucket['severity_max'] = max(bucket['severity_max'], severity)
+        bucket['severity_time_sum'] += severity * reported_at.timestamp()
+        bucket['last_reported_at'] = max(bucket['last_reported_at'], reported_at)
+    return totals
+
+
+def _merge(key, totals):
+    """Add totals to the bucket at key, creating it if needed."""
+    cell_lat, cell_lon, day = key
+    bucket = IncidentBucket.objects.filter(cell_lat=cell_lat, cell_lon=cell_lon, day=day)
+    changes = {
+        'count': F('count') + totals['count'],
+        'latitude_sum': F('latitude_sum') + totals['latitude_sum'],
+        'longitude_sum': F('longitude_sum') + totals['longitude_sum'],
+        'severity_sum': F('severity_sum') + totals['severity_sum'],
+        'severity_max': Greatest('severity_max', totals['severity_max']),
+        'severity_time_sum': F('severity_time_sum') + totals['severity_time_sum'],
+        'last_reported_at': Greatest('last_reported_at', totals['last_reported_at']),
+    }
+    if bucket.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            IncidentBucket.objects.create(cell_lat=cell_lat, cell_lon=cell_lon, day=day, **totals)
+    except IntegrityError:
+        # Another writer created it first
+        bucket.update(**changes)
+
+
+def _existing_keys(keys):
+    """The subset of (cell_lat, cell_lon, day) keys that already have a bucket, in one query."""
+    cell_lats = [key[0] for key in keys]
+    cell_lons = [key[1] for key in keys]
+    found = IncidentBucket.objects.filter(
+        cell_lat__range=(min(cell_lats), max(cell_lats)),
+        cell_lon__range=(min(cell_lons), max(cell_lons)),
+        day__in={key[2] for key in keys},
+    ).values_list('cell_lat', 'cell_lon', 'day')
+    return set(found) & set(keys)
+
+
+def add_incidents(incidents):
+    """Add newly inserted incidents to their buckets. Returns the number of buckets touched."""
+    totals = _totals(incidents)
+    if not totals:
+        return 0
+    with transaction.atomic():
+        existing = _existing_keys(list(totals))
+        new = [key for key in sorted(totals) if key not in existing]
+        try:
+            with transaction.atomic():
+                IncidentBucket.objects.bulk_create([
+                    IncidentBucket(cell_lat=cell_lat, cell_lon=cell_lon, day=day, **totals[(cell_lat, cell_lon, day)])
+                    for cell_lat, cell_lon, day in new
+                ], batch_size=1000)
+        except IntegrityError:
+            # Another writer created some of them first
+            existing.update(new)
+        for key in sorted(existing):
+            _merge(key, totals[key])
+    return len(totals)
+
+
+def remove_incidents(incidents):
+    """
+    Take deleted incidents (or the old values of edited ones) back out of
+    their buckets: the day bucket if it has not been compacted yet, the
+    cell's archive bucket otherwise. Buckets left empty are deleted.
+    Returns the number of buckets touched.
+    """
+    totals = _totals(incidents, archive=False)
+    if not totals:
+        return 0
+    cutoff = archive_cutoff()
+    with transaction.atomic():
+        touched = set()
+        for key in sorted(totals):
+            cell_lat, cell_lon, day = key
+            changes = {
+                name: F(name) - totals[key][name]
+                for name in ('count', 'latitude_sum', 'longitude_sum', 'severity_sum', 'severity_time_sum')
+            }
+            days = (day, ARCHIVE_DAY) if day < cutoff else (day,)
+            for bucket_day in days:
+                if IncidentBucket.objects.filter(cell_lat=cell_lat, cell_lon=cell_lon,
+                                                 day=bucket_day).update(**changes):
+                    touched.add((cell_lat, cell_lon, bucket_day))
+                    break
+        condition = Q()
+        for cell_lat, cell_lon, day in touched:
+            condition |= Q(cell_lat=cell_lat, cell_lon=cell_lon, day=day)
+        if touched:
+            IncidentBucket.objects.filter(condition, count__lte=0).delete()
+    return len(touched)
+
+
+def compact(now=None):
+    """
+    Merge every day bucket older than DECAY_DAYS into its cell's archive
+    bucket. Returns the number of day buckets merged.
+    """
+    cutoff = archive_cutoff(now)
+    with transaction.atomic():
+        old = IncidentBucket.objects.filter(day__lt=cutoff).exclude(day=ARCHIVE_DAY)
+        merged = defaultdict(list)
+        for bucket in old.select_for_update():
+            merged[(bucket.cell_lat, bucket.cell_lon, ARCHIVE_DAY)].append(bucket)
+
+        for key in sorted(merged):
+            buckets = merged[key]
+            _merge(key, {
+                'count': sum(b.count for b in buckets),
+                'latitude_sum': sum(b.latitude_sum for b in buckets),
+                'longitude_sum': sum(b.longitude_sum for b in buckets),
+                'severity_sum': sum(b.severity_sum for b in buckets),
+                'severity_max': max(b.severity_max for b in buckets),
+                'severity_time_sum': sum(b.severity_time_sum for b in buckets),
+                'last_reported_at': max(b.last_reported_at for b in buckets),
+            })
+        IncidentBucket.objects.filter(id__in=[b.id for buckets in merged.values() for b in buckets]).delete()
+    return sum(len(buckets) for buckets in merged.values())
+
+
+def rebuild(chunk_size=10000):
+    """Recompute every bucket from the incidents table. Returns the number of buckets."""
+    incidents = CrimeIncident.objects.only('latitude', 'longitude', 'reported_at', 'severity')
+    totals = _totals(incidents.iterator(chunk_size=chunk_size))
+    with transaction.atomic():
+        IncidentBucket.objects.all().delete()
+        IncidentBucket.objects.bulk_create([
+            IncidentBucket(cell_lat=cell_lat, cell_lon=cell_lon, day=day, **bucket)
+            for (cell_lat, cell_lon, day), bucket in totals.items()
+        ], batch_size=1000)
+    return len(totals)
+
+
+class BucketEngine(RiskEngine):
+    """
+    RiskEngine over IncidentBuckets instead of raw incidents. The inherited
+    columns hold each bucket's centroid, latest report time and highest
+    severity (used for the strongest-incident term); the severity sum and
+    mean report time give the total term.
+    """
+
+    def __init__(self, latitudes, longitudes, last_timestamps, severity_maxes, mean_timestamps, severity_sums):
+        super().__init__(latitudes, longitudes, last_timestamps, severity_maxes)
+        order = np.argsort(np.asarray(latitudes, dtype=np.float64), kind='stable')
+        self.mean_timestamps = np.asarray(mean_timestamps, dtype=np.float64)[order]
+        self.severity_sums = np.asarray(severity_sums, dtype=np.float64)[order]
+
+    @classmethod
+    def from_buckets(cls, buckets):
+        return cls.from_rows([
+            (b.count, b.latitude_sum, b.longitude_sum, b.severity_sum, b.severity_max,
+             b.severity_time_sum, b.last_reported_at)
+            for b in buckets
+        ])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (count, latitude_sum, longitude_sum, severity_sum, severity_max, severity_time_sum, last_reported_at) rows."""
+        rows = [row for row in rows if row[0]]
+        if not rows:
+            return cls([], [], [], [], [], [])
+        counts, latitude_sums, longitude_sums, severity_sums, severity_maxes, time_sums = (
+            np.array([row[i] for row in rows], dtype=np.float64) for i in range(6)
+        )
+        severity_sums = np.where(severity_sums > 0, severity_sums, counts)
+        return cls(
+            latitude_sums / counts,
+            longitude_sums / counts,
+            [_as_aware(row[6]).timestamp() for row in rows],
+            np.maximum(severity_maxes, 1),
+            time_sums / severity_sums,
+            severity_sums,
+        )
+
+    def _score_group(self, user_lats, user_lons, radius_km, now_ts):
+        candidates = self._candidates(user_lats, user_lons, radius_km)
+        if len(candidates) == 0:
+            return np.zeros(len(user_lats))
+
+        step = max(1, MAX_PAIRS_PER_CHUNK // len(candidates))
+        if len(user_lats) > step:
+            return np.concatenate([
+                self._score_group(user_lats[i:i + step], user_lons[i:i + step], radius_km, now_ts)
+                for i in range(0, len(user_lats), step)
+            ])
+
+        distance = haversine_km(
+            user_lats[:, None], user_lons[:, None],
+            self.latitudes[candidates], self.longitudes[candidates],
+        )
+        distance_factor = np.where(distance <= radius_km, np.power(0.001, (distance * 1000) / 100), 0.0)
+        peak = distance_factor * (
+            self.time_factors(self.timestamps[candidates], now_ts) * self.severities[candidates] / 5.0
+        )
+        total = distance_factor * (
+            self.time_factors(self.mean_timestamps[candidates], now_ts) * self.severity_sums[candidates] / 5.0
+        )
+        final_score = (0.7 * peak.max(axis=1) + 0.3 * (total.sum(axis=1) / 3)) * 10.0
+        return np.clip(final_score, 0.0, 10.0)
+
+
+def load_engine(south, west, north, east, exact=None):
+    """
+    Engine over everything reported inside the bounding box: its buckets,
+    or with exact=True (default: INCIDENT_SCORING == 'exact') the raw
+    incidents.
+    """
+    return load_engine_for_boxes([(south, west, north, east)], exact)
+
+
+# Fields BucketEngine.from_rows reads
+BUCKET_ROW_FIELDS = ('count', 'latitude_sum', 'longitude_sum', 'severity_sum', 'severity_max',
+                     'severity_time_sum', 'last_reported_at')
+# Conditions per query; keeps statements well inside SQLite's expression limits
+TERMS_PER_QUERY = 200
+# Grid the bucket query is planned on (about 33 m)
+QUERY_GRID_DEG = 0.0003
+
+
+def _incident_engine(rows):
+    """RiskEngine over (latitude, longitude, reported_at, severity) rows."""
+    return RiskEngine(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [_as_aware(row[2]).timestamp() for row in rows],
+        [row[3] or 1 for row in rows],
+    )
+
+
+def _cell_ranges(boxes, scale=1):
+    """
+    {row: [(west, east), ...]} covering the boxes on a grid whose cells are
+    scale x scale bucket cells, with overlapping ranges in a row merged.
+    """
+    rows = defaultdict(list)
+    for south, west, north, east in boxes:
+        south_row, west_col = (cell // scale for cell in cell_of(south, west))
+        north_row, east_col = (cell // scale for cell in cell_of(north, east))
+        for row in range(south_row, north_row + 1):
+            rows[row].append((west_col, east_col))
+
+    merged = {}
+    for row, ranges in rows.items():
+        ranges.sort()
+        cells = [list(ranges[0])]
+        for west_col, east_col in ranges[1:]:
+            if west_col <= cells[-1][1] + 1:
+                cells[-1][1] = max(cells[-1][1], east_col)
+            else:
+                cells.append([west_col, east_col])
+        merged[row] = cells
+    return merged
+
+
+def _cell_bands(boxes):
+    """
+    (south, north, west, east) bucket cell ranges covering the boxes.
+    Bucket cells are only a few metres wide, so the boxes are first covered
+    on the coarser QUERY_GRID_DEG grid, and runs of its rows with the same
+    column ranges become one band. The bands cover a little more than the
+    boxes; scoring only counts what is within the radius anyway.
+    """
+    scale = max(1, round(QUERY_GRID_DEG / _bucket_deg()))
+    bands = []
+    open_bands = {}
+    previous = None
+    for row, ranges in sorted(_cell_ranges(boxes, scale).items()):
+        if previous is None or row != previous + 1:
+            open_bands = {}
+        next_open = {}
+        for west_col, east_col in ranges:
+            band = open_bands.get((west_col, east_col))
+            if band is None:
+                band = [row, row, west_col, east_col]
+                bands.append(band)
+            band[1] = row
+            next_open[(west_col, east_col)] = band
+        open_bands = next_open
+        previous = row
+    return [
+        (south * scale, north * scale + scale - 1, west * scale, east * scale + scale - 1)
+        for south, north, west, east in bands
+    ]
+
+
+def load_engine_for_boxes(boxes, exact=None):
+    """
+    Like load_engine, for everything inside any of the (south, west, north,
+    east) boxes. Used to load a corridor along a route.
+
+    Buckets are fetched a band of cells at a time (cell_lat and cell_lon
+    in ranges), which the unique (cell_lat, cell_lon, day) index answers.
+    Raw incidents can only be narrowed by latitude in the index, so exact
+    mode reads whole latitude bands.
+    """
+    if exact is None:
+        exact = _exact_default()
+    if exact:
+        # Boxes can overlap across queries, so rows are collected by id
+        rows = {}
+        for start in range(0, len(boxes), TERMS_PER_QUERY):
+            condition = Q()
+            for south, west, north, east in boxes[start:start + TERMS_PER_QUERY]:
+                condition |= Q(latitude__range=(south, north), longitude__range=(west, east))
+            rows.update(
+                (row[0], row[1:]) for row in CrimeIncident.objects.filter(condition).values_list(
+                    'id', 'latitude', 'longitude', 'reported_at', 'severity'
+                )
+            )
+        return _incident_engine(list(rows.values()))
+
+    bands = _cell_bands(boxes)
+    rows = []
+    for start in range(0, len(bands), TERMS_PER_QUERY):
+        chunk = bands[start:start + TERMS_PER_QUERY]
+        # Written as SQL directly: building hundreds of Q lookups costs more than the query
+        condition = RawSQL(
+            " OR ".join(["(cell_lat BETWEEN %s AND %s AND cell_lon BETWEEN %s AND %s)"] * len(chunk)),
+            [value for band in chunk for value in band],
+            output_field=BooleanField(),
+        )
+        rows.extend(IncidentBucket.objects.filter(condition).values_list(*BUCKET_ROW_FIELDS))
+    return BucketEngine.from_rows(rows)
+
+
+@timed('incident_buckets.risk_score')
+def risk_score(lat, lon, radius_km=1.0, current_crime_type=None, exact=None):
+    """compute_risk_score for one point, from the buckets (or raw incidents) around it."""
+    lat_pad = radius_km / KM_PER_DEGREE
+    lon_pad = lat_pad / max(math.cos(math.radians(min(abs(lat) + lat_pad, 89.9))), 1e-6)
+    engine = load_engine(lat - lat_pad, lon - lon_pad, lat + lat_pad, lon + lon_pad, exact)
+    return engine.score(lat, lon, radius_km, current_crime_type)
@@ -0,0 +1,231 @@
+"""
+Crime statistics from incremental summary counts.
+
+Every inserted incident adds one to the IncidentStat row of its
+STATISTICS_CELL_DEG cell, UTC day, crime type and severity (and deleting
+it subtracts one), and bumps the shared 'incident_stats' DataVersion. A statistics request sums the rows of
+the cells around the area with one grouped query, so its cost depends on
+the size of the area and the number of days, not on the number of
+incidents. Results are cached by version, day and cell range.
+
+Time windows are whole UTC days counted back from today ('week' is today
+and the six days before it), so a response only changes when an incident
+is added or the day rolls over.
+"""
+import math
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from .models import CrimeIncident, DataVersion, IncidentStat
+from .spatial_index import KM_PER_DEGREE
+
+VERSION_NAME = 'incident_stats'
+# (name, days); None is everything on record
+WINDOWS = (('day', 1), ('week', 7), ('month', 30), ('year', 365), ('all', None))
+DAILY_DAYS = 30
+
+# Centers of the cities the app offers on its statistics screen
+CITIES = {
+    'New Orleans': (29.9511, -90.0715),
+    'Baton Rouge': (30.4515, -91.1871),
+    'Shreveport': (32.5252, -93.7502),
+    'Lafayette': (30.2241, -92.0198),
+    'Lake Charles': (30.2266, -93.2174),
+    'Monroe': (32.5093, -92.1193),
+    'Alexandria': (31.3113, -92.4451),
+    'Houma': (29.5958, -90.7195),
+    'Bossier City': (32.5160, -93.7321),
+    'Kenner': (29.9941, -90.2417),
+}
+
+
+def _cell_deg():
+    return getattr(settings, 'STATISTICS_CELL_DEG', 0.01)
+
+
+def city_radius_km():
+    return getattr(settings, 'STATISTICS_CITY_RADIUS_KM', 15.0)
+
+
+def find_city(name):
+    """(canonical name, (lat, lon)) for a city name in any case, or None."""
+    for city, center in CITIES.items():
+        if city.lower() == (name or '').strip().lower():
+            return city, center
+    return None
+
+
+def cell_of(latitude, longitude):
+    deg = _cell_deg()
+    return math.floor(latitude / deg), math.floor(longitude / deg)
+
+
+def current_version():
+    return DataVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 0
+
+
+def _bump_version():
+    """Increment the statistics version. Must be called inside a transaction."""
+    updated = DataVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+    if not updated:
+        DataVersion.objects.get_or_create(name=VERSION_NAME)
+        DataVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+
+
+def _counts(incidents):
+    """{(cell_lat, cell_lon, day, crime_type, severity): count} for a batch of incidents."""
+    counts = {}
+    for incident in incidents:
+        reported_at = incident.reported_at
+        if timezone.is_naive(reported_at):
+            reported_at = timezone.make_aware(reported_at)
+        key = (
+            *cell_of(incident.latitude, incident.longitude),
+            reported_at.astimezone(dt_timezone.utc).date(),
+            incident.crime_type or 'unknown',
+            incident.severity or 1,
+        )
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _stat_filter(key):
+    cell_lat, cell_lon, day, crime_type, severity = key
+    return IncidentStat.objects.filter(cell_lat=cell_lat, cell_lon=cell_lon, day=day,
+                                       crime_type=crime_type, severity=severity)
+
+
+def add_incidents(incidents):
+    """Count newly inserted (and classified) incidents. Returns the number of rows touched."""
+    counts = _counts(incidents)
+    if not counts:
+        return 0
+    with transaction.atomic():
+        keys = list(counts)
+        cell_lats = [key[0] for key in keys]
+        cell_lons = [key[1] for key in keys]
+        existing = set(IncidentStat.objects.filter(
+            cell_lat__range=(min(cell_lats), max(cell_lats)),
+            cell_lon__range=(min(cell_lons), max(cell_lons)),
+            day__in={key[2] for key in keys},
+        ).values_list('cell_lat', 'cell_lon', 'day', 'crime_type', 'severity')) & set(keys)
+
+        new = [key for key in sorted(counts) if key not in existing]
+        try:
+            with transaction.atomic():
+                IncidentStat.objects.bulk_create([
+                    IncidentStat(cell_lat=key[0], cell_lon=key[1], day=key[2], crime_type=key[3],
+                                 severity=key[4], count=counts[key])
+                    for key in new
+                ], batch_size=1000)
+        except IntegrityError:
+            # Another writer created some of them first; add to each row in turn
+            for key in new:
+                if not _stat_filter(key).update(count=F('count') + counts[key]):
+                    IncidentStat.objects.create(cell_lat=key[0], cell_lon=key[1], day=key[2],
+                                                crime_type=key[3], severity=key[4], count=counts[key])
+        for key in sorted(existing):
+            _stat_filter(key).update(count=F('count') + counts[key])
+        _bump_version()
+    return len(counts)
+
+
+def remove_incidents(incidents):
+    """Uncount deleted incidents (or the old values of edited ones). Returns the number of rows touched."""
+    counts = _counts(incidents)
+    if not counts:
+        return 0
+    with transaction.atomic():
+        for key in sorted(counts):
+            _stat_filter(key).update(count=F('count') - counts[key])
+            _stat_filter(key).filter(count__lte=0).delete()
+        _bump_version()
+    return len(counts)
+
+
+def rebuild(chunk_size=10000):
+    """Recount every incident. Returns the number of rows."""
+    incidents = CrimeIncident.objects.only('latitude', 'longitude', 'reported_at', 'severity', 'crime_type')
+    counts = _counts(incidents.iterator(chunk_size=chunk_size))
+    with transaction.atomic():
+        IncidentStat.objects.all().delete()
+        IncidentStat.objects.bulk_create([
+            IncidentStat(cell_lat=key[0], cell_lon=key[1], day=key[2], crime_type=key[3],
+                         severity=key[4], count=count)
+            for key, count in counts.items()
+        ], batch_size=1000)
+        _bump_version()
+    return len(counts)
+
+
+def area_cells(lat, lon, radius_km):
+    """(south, west, north, east) cell range of the square around a circle."""
+    lat_pad = radius_km / KM_PER_DEGREE
+    lon_pad = lat_pad / max(math.cos(math.radians(min(abs(lat) + lat_pad, 89.9))), 1e-6)
+    south, west = cell_of(lat - lat_pad, lon - lon_pad)
+    north, east = cell_of(lat + lat_pad, lon + lon_pad)
+    return south, west, north, east
+
+
+def summary(cells, today=None):
+    """
+    Incident counts for a (south, west, north, east) cell range: totals,
+    by crime type and by severity for every window in WINDOWS, and a daily
+    series for the last DAILY_DAYS days.
+    """
+    today = today or timezone.now().astimezone(dt_timezone.utc).date()
+    south, west, north, east = cells
+    stats = IncidentStat.objects.filter(cell_lat__range=(south, north), cell_lon__range=(west, east))
+
+    # Prefixed so 'day' doesn't clash with the field
+    windows = {
+        f'window_{name}': Sum('count', filter=Q(day__gt=today - timedelta(days=days), day__lte=today))
+        if days else Sum('count')
+        for name, days in WINDOWS
+    }
+    names = [name for name, _ in WINDOWS]
+    totals = dict.fromkeys(names, 0)
+    by_type = {}
+    by_severity = {}
+    for row in stats.values('crime_type', 'severity').annotate(**windows).order_by():
+        for name in names:
+            count = row[f'window_{name}'] or 0
+            totals[name] += count
+            by_type.setdefault(row['crime_type'], dict.fromkeys(names, 0))[name] += count
+            by_severity.setdefault(str(row['severity']), dict.fromkeys(names, 0))[name] += count
+
+    first_day = today - timedelta(days=DAILY_DAYS - 1)
+    per_day = dict(
+        stats.filter(day__range=(first_day, today)).values('day').annotate(total=Sum('count'))
+        .order_by().values_list('day', 'total')
+    )
+    daily = [
+        {'date': (first_day + timedelta(days=offset)).isoformat(),
+         'count': per_day.get(first_day + timedelta(days=offset), 0)}
+        for offset in range(DAILY_DAYS)
+    ]
+
+    return {
+        'date': today.isoformat(),
+        'windows': {name: days for name, days in WINDOWS},
+        'totals': totals,
+        'byCrimeType': dict(sorted(by_type.items(), key=lambda item: -item[1]['all'])),
+        'bySeverity': dict(sorted(by_severity.items())),
+        'daily': daily,
+    }
+
+
+def cached_summary(cells):
+    """(version, summary, cache hit) for a cell range."""
+    version = current_version()
+    today = timezone.now().astimezone(dt_timezone.utc).date()
+    key = f"incident-stats:{version}:{today}:" + ":".join(str(cell) for cell in cells)
+    value = cache.get(key)
+    if value is not None:
+        return version, value, True
+    value = summary(cells, today)
+    cache.set(key, value, getattr(settings, 'STATISTICS_CACHE_TIMEOUT', 3600))
+    return version, value, False
@@ -0,0 +1,55 @@
+import logging
+from django.db import transaction
+from . import heatmap, incident_buckets, incident_stats, notifications, risk_areas
+from .models import CrimeIncident
+from .utils import crime_type_from_description, risk_level_from_severity
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def ingest_incidents(incidents, chunk_size=CHUNK_SIZE, notify=True):
+    """
+    Save unsaved CrimeIncident objects in bulk and update everything derived
+    from them once for the whole batch: the incident buckets and statistics,
+    one risk area per incident (single version bump), the heatmap cells
+    around them (in the background) and alerts to nearby devices, unless
+    notify is False (for imports whose report times are unknown).
+    Returns (created incidents, risk area dicts) in input order.
+    """
+    incidents = list(incidents)
+    if not incidents:
+        return [], []
+
+    # bulk_create skips save(), so classify here
+    for incident in incidents:
+        incident.classify()
+
+    with transaction.atomic():
+        created = []
+        for start in range(0, len(incidents), chunk_size):
+            created.extend(CrimeIncident.objects.bulk_create(incidents[start:start + chunk_size]))
+        # bulk_create skips save() here too
+        incident_buckets.add_incidents(created)
+        incident_stats.add_incidents(created)
+
+        # One risk area per report, added with a single version bump
+        areas = risk_areas.add_areas([{
+            'latitude': incident.latitude,
+            'longitude': incident.longitude,
+            'risk_category': risk_level_from_severity(incident.severity),
+            'crime_type': crime_type_from_description(incident.description),
+        } for incident in created])
+
+    # Recomputed in the background once the batch is committed
+    heatmap.schedule_update(created)
+
+    # Alert devices near severe incidents; sending happens in the background
+    if notify:
+        try:
+            notifications.notify_incidents(created)
+        except Exception as e:
+            logger.error("Error queueing alerts: %s", e, exc_info=True)
+
+    return created, areas
@@ -0,0 +1,212 @@
+"""
+Load generator that replays the map screen's request pattern.
+
+Each virtual user walks a street grid at walking speed. Like map.tsx, the
+location watcher fires after DISTANCE_THRESHOLD_M of movement but at most
+every CHECK_INTERVAL_S, and every update is a risk?mode=check request. The
+visible region (VIEWPORT_DEG wide, like ULM_REGION) is refetched from
+map-risk-areas when the user walks near its edge and the map recenters, and
+when the user pans the map. Now and then the user posts a report the way
+report.tsx does.
+
+Users run in threads with one HTTP session each and wait for every response
+before the next request, like the app's isSending guard. time_scale > 1
+compresses the waits, so one user offers the load of time_scale users.
+"""
+import math
+import threading
+import time
+import numpy as np
+import requests
+from .benchmarks import latency_summary
+from .spatial_index import KM_PER_DEGREE
+
+# From frontend/app/(tabs)/map.tsx
+DISTANCE_THRESHOLD_M = 10
+CHECK_INTERVAL_S = 5
+VIEWPORT_DEG = 0.01
+CHECK_RADIUS_KM = 0.2
+# Recenter when the user leaves the middle of the viewport
+RECENTER_FRACTION = 0.8
+BLOCK_M = 100
+GPS_JITTER_M = 3
+# (description, severity) as report.tsx sends them
+REPORTS = (
+    ("Sexual Harassment: Unwanted sexual behavior", 1),
+    ("Assault: Physical attack or threat", 4),
+    ("Robbery: Theft with force or threat", 4),
+    ("Burglary: Breaking and entering", 1),
+    ("Theft: Stealing without force", 3),
+    ("Vandalism: Property damage", 3),
+)
+ENDPOINTS = ('risk', 'map-risk-areas', 'report-crime')
+
+
+class Walker:
+    """A pedestrian on a street grid of BLOCK_M blocks, turning at random corners."""
+
+    def __init__(self, rng, latitude, longitude, speed):
+        self.rng = rng
+        self.speed = speed
+        self.km_per_lon_degree = KM_PER_DEGREE * math.cos(math.radians(latitude))
+        # Position in meters from the start, which is on a corner
+        self.origin = (latitude, longitude)
+        self.x = self.y = 0.0
+        self.direction = rng.integers(4)
+        self.to_corner = BLOCK_M
+
+    def advance(self, seconds):
+        remaining = self.speed * seconds
+        while remaining > 0:
+            step = min(remaining, self.to_corner)
+            dx, dy = ((1, 0), (0, 1), (-1, 0), (0, -1))[self.direction]
+            self.x += dx * step
+            self.y += dy * step
+            remaining -= step
+            self.to_corner -= step
+            if self.to_corner <= 0:
+                # Mostly straight on, sometimes left or right, rarely back
+                self.direction = (self.direction + self.rng.choice(4, p=(0.6, 0.18, 0.04, 0.18))) % 4
+                self.to_corner = BLOCK_M
+
+    def position(self):
+        """(lat, lon) with GPS noise."""
+        x, y = np.array([self.x, self.y]) + self.rng.normal(0, GPS_JITTER_M, size=2)
+        return (self.origin[0] + y / 1000 / KM_PER_DEGREE,
+                self.origin[1] + x / 1000 / self.km_per_lon_degree)
+
+
+class Recorder:
+    """Thread-safe (latency ms, status, bytes) samples per endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {endpoint: [] for endpoint in ENDPOINTS}
+        self.lag = []
+
+    def add(self, endpoint, latency_ms, status_code, size):
+        with self.lock:
+            self.samples[endpoint].append((latency_ms, status_code, size))
+
+    def summary(self, seconds):
+        endpoints = {}
+        for endpoint, samples in self.samples.items():
+            ok = [latency for latency, status_code, _ in samples if status_code and status_code < 400]
+            endpoints[endpoint] = {
+                **latency_summary([latency for latency, _, _ in samples]),
+                'errors': len(samples) - len(ok),
+                'throughput': round(len(samples) / seconds, 2),
+                'meanBytes': round(float(np.mean([size for _, _, size in samples])), 1) if samples else 0,
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'seconds': round(seconds, 2),
+            'requests': total,
+            'throughput': round(total / seconds, 2),
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            # How far behind schedule users were when a request was due
+            'lag': latency_summary(self.lag),
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base_url, start_point, rng, recorder, deadline, time_scale=1.0,
+                 pan_interval=60.0, reports_per_hour=0.2, timeout=30.0):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.rng = rng
+        self.recorder = recorder
+        self.deadline = deadline
+        self.time_scale = time_scale
+        self.pan_interval = pan_interval
+        self.report_interval = 3600 / reports_per_hour if reports_per_hour > 0 else math.inf
+        self.timeout = timeout
+        self.walker = Walker(rng, *start_point, speed=rng.uniform(1.1, 1.7))
+        self.region = start_point
+        self.session = requests.Session()
+
+    def _request(self, endpoint, method='get', **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}/{endpoint}/", timeout=self.timeout, **kwargs)
+            status_code, size = response.status_code, len(response.content)
+        except requests.RequestException:
+            status_code, size = None, 0
+        self.recorder.add(endpoint, (time.perf_counter() - start) * 1000, status_code, size)
+
+    def check_risk(self, lat, lon):
+        self._request('risk', params={'lat': lat, 'lon': lon, 'radius': CHECK_RADIUS_KM, 'mode': 'check'})
+
+    def fetch_region(self):
+        lat, lon = self.region
+        half = VIEWPORT_DEG / 2
+        self._request('map-risk-areas', params={'ne_lat': lat + half, 'ne_lng': lon + half,
+                                                'sw_lat': lat - half, 'sw_lng': lon - half})
+
+    def report(self, lat, lon):
+        description, severity = REPORTS[self.rng.integers(len(REPORTS))]
+        self._request('report-crime', method='post', json={
+            'latitude': lat, 'longitude': lon, 'description': description, 'severity': severity,
+            'reported_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        })
+
+    def _wait_until(self, started, sim_seconds):
+        due = started + sim_seconds / self.time_scale
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.recorder.lag.append(-delay * 1000)
+        return time.perf_counter() < self.deadline
+
+    def run(self):
+        started = time.perf_counter()
+        # Opening the map: load the region and check where the user is
+        self.fetch_region()
+        self.check_risk(*self.walker.position())
+
+        update_every = max(CHECK_INTERVAL_S, DISTANCE_THRESHOLD_M / self.walker.speed)
+        now = 0.0
+        next_update = update_every
+        next_pan = self.rng.exponential(self.pan_interval)
+        next_report = self.rng.exponential(self.report_interval) if math.isfinite(self.report_interval) else math.inf
+        while True:
+            event_at = min(next_update, next_pan, next_report)
+            self.walker.advance(event_at - now)
+            now = event_at
+            if not self._wait_until(started, now):
+                break
+            lat, lon = self.walker.position()
+            if now == next_update:
+                next_update += update_every
+                self.check_risk(lat, lon)
+                edge = VIEWPORT_DEG / 2 * RECENTER_FRACTION
+                if abs(lat - self.region[0]) > edge or abs(lon - self.region[1]) > edge:
+                    self.region = (lat, lon)
+                    self.fetch_region()
+            elif now == next_pan:
+                next_pan += self.rng.exponential(self.pan_interval)
+                offset = self.rng.uniform(-VIEWPORT_DEG / 2, VIEWPORT_DEG / 2, size=2)
+                self.region = (self.region[0] + offset[0], self.region[1] + offset[1])
+                self.fetch_region()
+            else:
+                next_report += self.rng.exponential(self.report_interval)
+                self.report(lat, lon)
+        self.session.close()
+
+
+def run_load(base_url, start_points, seconds, seed=42, **user_options):
+    """Walk one user from each start point for `seconds`. Returns Recorder.summary()."""
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + seconds
+    users = [
+        VirtualUser(base_url, point, np.random.default_rng([seed, number]), recorder, deadline, **user_options)
+        for number, point in enumerate(start_points)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    return recorder.summary(time.perf_counter() - started)
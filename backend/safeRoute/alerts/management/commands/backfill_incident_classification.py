@@ -0,0 +1,73 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from alerts import heatmap, incident_buckets, incident_stats
+from alerts.models import CrimeIncident, RiskTile
+from alerts.utils import classify_incident
+
+
+class Command(BaseCommand):
+    help = ("Fill severity and crime_type for existing crime incidents from their "
+            "descriptions, as CrimeIncident.save() now does for new ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--all', action='store_true',
+                            help="Reclassify every incident, replacing severities and crime types already set")
+        parser.add_argument('--reclassify-ones', action='store_true',
+                            help="Also reclassify incidents with severity 1, taking it for the old column "
+                                 "default; by default a 1 is kept as set by the reporter")
+
+    def handle(self, *args, **options):
+        queryset = CrimeIncident.objects.order_by('id')
+        unset_severities = Q(severity__isnull=True)
+        # Severity used to default to 1, so a 1 may mean it was never set
+        if options['reclassify_ones']:
+            unset_severities |= Q(severity=1)
+        if not options['all']:
+            queryset = queryset.filter(Q(crime_type='unknown') | unset_severities)
+
+        batch_size = max(1, options['batch_size'])
+        start = time.perf_counter()
+        checked = updated = 0
+        last_id = 0
+        changed_points = []
+        while True:
+            # Walk by primary key so updated rows don't shift the batches
+            batch = list(queryset.filter(id__gt=last_id).only(
+                'id', 'latitude', 'longitude', 'description', 'severity', 'crime_type')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            checked += len(batch)
+
+            changed = []
+            for incident in batch:
+                severity, crime_type = classify_incident(incident.description)
+                unset = incident.severity is None or (incident.severity == 1 and options['reclassify_ones'])
+                if options['all'] or unset:
+                    new_severity = severity
+                else:
+                    new_severity = incident.severity
+                if options['all'] or incident.crime_type == 'unknown':
+                    new_crime_type = crime_type
+                else:
+                    new_crime_type = incident.crime_type
+                if (new_severity, new_crime_type) != (incident.severity, incident.crime_type):
+                    incident.severity, incident.crime_type = new_severity, new_crime_type
+                    changed.append(incident)
+                    changed_points.append((incident.latitude, incident.longitude))
+
+            with transaction.atomic():
+                CrimeIncident.objects.bulk_update(changed, ['severity', 'crime_type'])
+            updated += len(changed)
+
+        self.stdout.write(f"Checked {checked} incidents, updated {updated} in {time.perf_counter() - start:.1f}s")
+        if updated:
+            # Statistics are counted by crime type and severity, buckets by severity
+            self.stdout.write(f"Recounted {incident_stats.rebuild()} statistics rows")
+            self.stdout.write(f"Rebuilt {incident_buckets.rebuild()} incident buckets")
+            # Tiles score by severity too; only refresh them if any have been built
+            if RiskTile.objects.exists():
+                self.stdout.write(f"Recomputed {heatmap.update_for_points(changed_points)} heatmap cells")
@@ -0,0 +1,104 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from alerts.models import CrimeIncident
+from alerts.utils import calculate_distance
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Benchmark CrimeIncident.objects.near() on a synthetic table against a "
+            "full table scan. Rows are inserted in a transaction that is rolled back "
+            "unless --keep is given; set SAFEROUTE_DB_PATH to use a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--radius', type=float, default=1.0, help="Query radius in km")
+        parser.add_argument('--days', type=int, default=30, help="Time window for the 'since' queries")
+        parser.add_argument('--span', type=float, default=2.0,
+                            help="Size of the region the rows are spread over, in degrees")
+        parser.add_argument('--scan-queries', type=int, default=3,
+                            help="Queries to time with a full scan (slow on big tables)")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic rows")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Rolled back synthetic rows")
+
+    def _insert(self, options, rng):
+        now = timezone.now()
+        span = options['span']
+        base_lat, base_lon = 32.5293, -92.0745
+        start = time.perf_counter()
+        remaining = options['rows']
+        while remaining > 0:
+            size = min(remaining, 10000)
+            CrimeIncident.objects.bulk_create([CrimeIncident(
+                latitude=base_lat + (rng.random() - 0.5) * span,
+                longitude=base_lon + (rng.random() - 0.5) * span,
+                description='',
+                severity=rng.randint(1, 5),
+                crime_type='theft',
+                reported_at=now - timedelta(hours=rng.random() * 24 * 365),
+            ) for _ in range(size)], batch_size=size)
+            remaining -= size
+        self.stdout.write(f"Inserted {options['rows']} rows in {time.perf_counter() - start:.1f}s")
+
+    def _time(self, label, queries, run):
+        timings = []
+        hits = 0
+        for query in queries:
+            start = time.perf_counter()
+            hits += run(*query)
+            timings.append((time.perf_counter() - start) * 1000)
+        if timings:
+            self.stdout.write(
+                f"{label:<28} median {statistics.median(timings):>9.2f} ms   "
+                f"max {max(timings):>9.2f} ms   {hits / len(timings):>7.1f} hits/query"
+            )
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        self._insert(options, rng)
+        table = CrimeIncident._meta.db_table
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {table}")
+
+        span = options['span']
+        radius = options['radius']
+        since = timezone.now() - timedelta(days=options['days'])
+        queries = [(32.5293 + (rng.random() - 0.5) * span * 0.9, -92.0745 + (rng.random() - 0.5) * span * 0.9)
+                   for _ in range(options['queries'])]
+
+        queryset = CrimeIncident.objects.around(*queries[0], radius, since).only('latitude', 'longitude')
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+            cursor.execute(explain + sql, params)
+            self.stdout.write("Query plan: " + " | ".join(str(row[-1]) for row in cursor.fetchall()))
+
+        self._time("near()", queries,
+                   lambda lat, lon: len(CrimeIncident.objects.near(lat, lon, radius)))
+        self._time(f"near(since={options['days']}d)", queries,
+                   lambda lat, lon: len(CrimeIncident.objects.near(lat, lon, radius, since=since)))
+
+        def full_scan(lat, lon):
+            rows = CrimeIncident.objects.filter(reported_at__gte=since).values_list('latitude', 'longitude')
+            return sum(1 for row_lat, row_lon in rows.iterator(chunk_size=10000)
+                       if calculate_distance(lat, lon, row_lat, row_lon) <= radius)
+        self._time(f"full scan (since={options['days']}d)", queries[:options['scan_queries']], full_scan)
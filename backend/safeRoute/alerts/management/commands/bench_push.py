@@ -0,0 +1,135 @@
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from alerts.notifications import PushDispatcher, build_message
+
+
+class FakeExpoHandler(BaseHTTPRequestHandler):
+    """
+    Imitates Expo's push endpoint: accepts a message or a list of messages
+    and answers with one ticket each, after `latency` seconds. A `failure_rate`
+    fraction of requests get a 503 so retries are exercised, and tokens
+    containing 'invalid' get a DeviceNotRegistered ticket.
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    failure_rate = 0.0
+    random = random.Random(0)
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        messages = payload if isinstance(payload, list) else [payload]
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            fail = self.random.random() < self.failure_rate
+        if fail:
+            self._send(503, {'errors': [{'code': 'UNAVAILABLE', 'message': 'Try again'}]})
+            return
+        if len(messages) > 100:
+            self._send(400, {'errors': [{'code': 'PUSH_TOO_MANY_NOTIFICATIONS'}]})
+            return
+
+        tickets = []
+        for message in messages:
+            if 'invalid' in message.get('to', ''):
+                tickets.append({'status': 'error', 'message': 'not registered',
+                                'details': {'error': 'DeviceNotRegistered'}})
+            else:
+                tickets.append({'status': 'ok', 'id': f"ticket-{random.getrandbits(32):08x}"})
+        self._send(200, {'data': tickets})
+
+    def _send(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_expo_server(latency=0.0, failure_rate=0.0, port=0):
+    """Start the fake push server in a background thread. Returns (server, url)."""
+    handler = type('Handler', (FakeExpoHandler,), {'latency': latency, 'failure_rate': failure_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/--/api/v2/push/send"
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the push dispatcher against a local fake Expo server "
+            "(or --url) and report throughput in messages/second.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Seconds the fake server takes per request")
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help="Fraction of requests the fake server answers with 503")
+        parser.add_argument('--invalid-rate', type=float, default=0.0,
+                            help="Fraction of tokens the fake server reports as DeviceNotRegistered")
+        parser.add_argument('--url', type=str, help="Push endpoint to use instead of the fake server")
+        parser.add_argument('--serve', action='store_true',
+                            help="Only run the fake server (on --port) until interrupted")
+        parser.add_argument('--port', type=int, default=8766)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            server, url = start_fake_expo_server(options['latency'], options['failure_rate'], options['port'])
+            self.stdout.write(f"Fake Expo push server listening on {url}")
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                server.shutdown()
+            return
+
+        rng = random.Random(42)
+        messages = [
+            build_message(
+                f"ExponentPushToken[{'invalid' if rng.random() < options['invalid_rate'] else 'device'}-{i}]",
+                "Safety alert", "A severe incident was reported near you", {'incidentId': i},
+            )
+            for i in range(options['messages'])
+        ]
+
+        self.stdout.write(f"{'workers':>7} {'batch':>6} {'seconds':>8} {'msg/s':>9} {'sent':>7} "
+                          f"{'failed':>7} {'batches':>8} {'retries':>8}")
+        for workers in options['workers']:
+            server = None
+            url = options['url']
+            if not url:
+                server, url = start_fake_expo_server(options['latency'], options['failure_rate'])
+
+            dispatcher = PushDispatcher(url=url, batch_size=options['batch_size'], workers=workers, backoff=0.05)
+            dispatcher.start()
+            start = time.perf_counter()
+            dispatcher.submit(messages)
+            dispatcher.flush()
+            elapsed = time.perf_counter() - start
+            dispatcher.stop()
+            if server:
+                server.shutdown()
+                server.server_close()
+
+            stats = dispatcher.stats()
+            self.stdout.write(
+                f"{workers:>7} {dispatcher.batch_size:>6} {elapsed:>8.2f} {len(messages) / elapsed:>9.0f} "
+                f"{stats['sent']:>7} {stats['failed']:>7} {stats['batches']:>8} {stats['retries']:>8}"
+            )
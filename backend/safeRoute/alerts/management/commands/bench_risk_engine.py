@@ -0,0 +1,65 @@
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from alerts.risk_engine import RiskEngine
+from alerts.utils import compute_risk_score
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized risk engine against compute_risk_score."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incidents', type=int, default=100000, help="Number of synthetic incidents")
+        parser.add_argument('--queries', type=int, default=1000, help="Number of query points for the batch run")
+        parser.add_argument('--check', type=int, default=20,
+                            help="Query points to compare against compute_risk_score")
+        parser.add_argument('--span', type=float, default=0.2, help="Size of the incident region in degrees")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        span = options['span']
+        base_lat, base_lon = 32.5293, -92.0745
+
+        incidents = [SimpleNamespace(
+            latitude=base_lat + (rng.random() - 0.5) * span,
+            longitude=base_lon + (rng.random() - 0.5) * span,
+            reported_at=now - timedelta(hours=rng.random() * 24 * 60),
+            severity=rng.randint(1, 5),
+            description='',
+        ) for _ in range(options['incidents'])]
+        points = [(base_lat + (rng.random() - 0.5) * span, base_lon + (rng.random() - 0.5) * span)
+                  for _ in range(options['queries'])]
+
+        start = time.perf_counter()
+        engine = RiskEngine.from_incidents(incidents)
+        self.stdout.write(f"Built engine for {len(engine)} incidents in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        start = time.perf_counter()
+        engine.score(*points[0], now=now)
+        self.stdout.write(f"Single point: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        scores = engine.score_many([p[0] for p in points], [p[1] for p in points], now=now)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(points)} points: {elapsed * 1000:.1f} ms ({elapsed / len(points) * 1e6:.1f} us/point)")
+
+        # compute_risk_score reads timezone.now() itself, so score each
+        # point with a matching 'now' right before calling it
+        checked = points[:options['check']]
+        max_diff = 0.0
+        elapsed = 0.0
+        for lat, lon in checked:
+            actual = engine.score(lat, lon, now=timezone.now())
+            start = time.perf_counter()
+            expected = compute_risk_score(incidents, lat, lon)
+            elapsed += time.perf_counter() - start
+            max_diff = max(max_diff, abs(expected - actual))
+        self.stdout.write(
+            f"compute_risk_score: {elapsed / max(len(checked), 1) * 1000:.1f} ms/point, "
+            f"max abs difference {max_diff:.2e}"
+        )
@@ -0,0 +1,71 @@
+import math
+import random
+import time
+from django.core.management.base import BaseCommand
+from alerts.spatial_index import GridIndex
+
+# Area density used for every size, so a fixed viewport sees about
+# the same number of areas no matter how many exist in total
+AREAS_PER_SQUARE_DEGREE = 10000
+VIEWPORT_DEG = 0.01
+
+
+class Command(BaseCommand):
+    help = "Benchmark viewport queries against the risk area spatial index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                            help="Number of risk areas to index for each run")
+        parser.add_argument('--queries', type=int, default=1000, help="Viewport queries per size")
+        parser.add_argument('--linear-limit', type=int, default=100000,
+                            help="Largest size to also time with a linear scan")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'areas':>10} {'build s':>9} {'index us/q':>11} {'linear us/q':>12} {'hits/q':>7}")
+
+        for size in options['sizes']:
+            span = math.sqrt(size / AREAS_PER_SQUARE_DEGREE)
+            base_lat, base_lng = 32.5 - span / 2, -92.1 - span / 2
+
+            areas = [{
+                'center': {
+                    'latitude': base_lat + rng.random() * span,
+                    'longitude': base_lng + rng.random() * span,
+                },
+                'radius': 0.2,
+                'riskLevel': rng.choice('ABCD'),
+                'crimeType': 'unknown',
+            } for _ in range(size)]
+
+            index = GridIndex()
+            start = time.perf_counter()
+            for area in areas:
+                index.insert(area)
+            build_time = time.perf_counter() - start
+
+            viewports = []
+            for _ in range(options['queries']):
+                sw_lat = base_lat + rng.random() * max(span - VIEWPORT_DEG, 0)
+                sw_lng = base_lng + rng.random() * max(span - VIEWPORT_DEG, 0)
+                viewports.append((sw_lat, sw_lng, sw_lat + VIEWPORT_DEG, sw_lng + VIEWPORT_DEG))
+
+            hits = 0
+            start = time.perf_counter()
+            for viewport in viewports:
+                hits += len(index.query_bbox(*viewport))
+            index_us = (time.perf_counter() - start) / len(viewports) * 1e6
+
+            linear = "-"
+            if size <= options['linear_limit']:
+                start = time.perf_counter()
+                for sw_lat, sw_lng, ne_lat, ne_lng in viewports:
+                    [a for a in areas
+                     if sw_lat <= a['center']['latitude'] <= ne_lat
+                     and sw_lng <= a['center']['longitude'] <= ne_lng]
+                linear = f"{(time.perf_counter() - start) / len(viewports) * 1e6:.1f}"
+
+            self.stdout.write(
+                f"{size:>10} {build_time:>9.2f} {index_us:>11.1f} {linear:>12} {hits / len(viewports):>7.1f}"
+            )
@@ -0,0 +1,120 @@
+import json
+import os
+import platform
+import subprocess
+import time
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from alerts import benchmarks, synthetic
+from alerts.management.commands.bench_push import start_fake_expo_server
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with synthetic data at each --scales incident count and time "
+            "compute_risk_score, map-risk-areas, risk?mode=check and report-crime. Deletes every "
+            "incident, risk area and device first, so it only runs with --scratch; set "
+            "SAFEROUTE_DB_PATH to a scratch database. Push alerts go to a local fake Expo server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Incident counts to benchmark")
+        parser.add_argument('--area-ratio', type=float, default=0.1, help="Risk areas per incident")
+        parser.add_argument('--device-ratio', type=float, default=0.01, help="Devices per incident")
+        parser.add_argument('--queries', type=int, default=200, help="Requests per read benchmark")
+        parser.add_argument('--reports', type=int, default=50, help="Crime reports to post")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', type=str, help="Write the results as JSON to this file")
+        parser.add_argument('--compare', type=str, metavar='FILE',
+                            help="Earlier --output file to compare p95 latencies with")
+        parser.add_argument('--scratch', action='store_true',
+                            help="Confirm the database may be emptied; SAFEROUTE_DB_PATH must point at a scratch file")
+
+    def handle(self, *args, **options):
+        if not options['scratch']:
+            raise CommandError(f"bench_suite deletes every incident, risk area and device in "
+                               f"{settings.DATABASES['default']['NAME']}; pass --scratch to confirm")
+        # Never the development database, even with --scratch
+        if not os.getenv('SAFEROUTE_DB_PATH') or \
+                os.path.abspath(settings.DATABASES['default']['NAME']) == os.path.abspath(settings.BASE_DIR / 'db.sqlite3'):
+            raise CommandError("bench_suite --scratch needs SAFEROUTE_DB_PATH set to a scratch database file "
+                               "(run `manage.py migrate` on it first)")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        server, settings.EXPO_PUSH_URL = start_fake_expo_server()
+        try:
+            scales = [self._run_scale(scale, options) for scale in sorted(options['scales'])]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        results = {
+            'generatedAt': timezone.now().isoformat(),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'queries': options['queries'],
+            'reports': options['reports'],
+            'seed': options['seed'],
+            'scales': scales,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if baseline:
+            self._compare(baseline, results)
+
+    def _run_scale(self, scale, options):
+        synthetic.clear()
+        cache.clear()
+        city = synthetic.SyntheticCity(seed=options['seed'])
+        areas = int(scale * options['area_ratio'])
+        devices = int(scale * options['device_ratio'])
+        start = time.perf_counter()
+        synthetic.populate(city, incidents=scale, areas=areas, devices=devices)
+        populate_seconds = time.perf_counter() - start
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        # Query points and reports come from the same hotspots as the data
+        queries = synthetic.SyntheticCity(seed=options['seed'], sample_seed=options['seed'] + 1)
+        results = benchmarks.run_all(queries, options['queries'], options['reports'])
+
+        self.stdout.write(f"{scale} incidents, {areas} risk areas, {devices} devices "
+                          f"(generated in {populate_seconds:.1f}s)")
+        for name, summary in results.items():
+            self.stdout.write(
+                f"  {name:<20} p50 {summary.get('p50', 0):>8.2f} ms   p95 {summary.get('p95', 0):>8.2f} ms   "
+                f"p99 {summary.get('p99', 0):>8.2f} ms   errors {summary.get('errors', 0)}"
+            )
+        return {'incidents': scale, 'riskAreas': areas, 'devices': devices,
+                'populateSeconds': round(populate_seconds, 2), 'results': results}
+
+    def _compare(self, baseline, results):
+        self.stdout.write(f"p95 compared with {baseline.get('commit')} ({baseline.get('generatedAt')})")
+        before = {scale['incidents']: scale['results'] for scale in baseline.get('scales', [])}
+        for scale in results['scales']:
+            if scale['incidents'] not in before:
+                continue
+            for name, summary in scale['results'].items():
+                old = before[scale['incidents']].get(name, {}).get('p95')
+                if old and summary.get('p95') is not None:
+                    self.stdout.write(f"  {scale['incidents']:>9} {name:<20} {old:>8.2f} -> {summary['p95']:>8.2f} ms "
+                                      f"({summary['p95'] / old:.2f}x)")
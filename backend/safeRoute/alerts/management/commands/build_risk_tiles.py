@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from alerts import heatmap
+from alerts.models import CrimeIncident
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed risk heatmap tiles. Run periodically so time decay stays current."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bbox', type=float, nargs=4, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                            help="Region to build. Defaults to the extent of all incidents.")
+
+    def handle(self, *args, **options):
+        if options['bbox']:
+            south, west, north, east = options['bbox']
+        else:
+            extent = CrimeIncident.objects.aggregate(
+                south=Min('latitude'), west=Min('longitude'),
+                north=Max('latitude'), east=Max('longitude'),
+            )
+            if extent['south'] is None:
+                self.stdout.write("No incidents, nothing to build.")
+                return
+            # Cover everything the outermost incidents can influence
+            south, west, north, east = heatmap.pad_bbox(
+                extent['south'], extent['west'], extent['north'], extent['east'],
+                heatmap.INFLUENCE_RADIUS_KM,
+            )
+
+        start = time.perf_counter()
+        count = heatmap.build_tiles(south, west, north, east)
+        self.stdout.write(f"Built {count} tiles at zoom {heatmap.TILE_ZOOM} in {time.perf_counter() - start:.1f}s")
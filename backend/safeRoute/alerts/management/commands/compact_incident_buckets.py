@@ -0,0 +1,54 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from alerts import incident_buckets
+from alerts.models import CrimeIncident, IncidentBucket
+
+
+class Command(BaseCommand):
+    help = ("Merge incident buckets older than 30 days into one archive bucket per cell. "
+            "Run daily so the number of buckets scoring reads stays flat.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recompute every bucket from the incidents table first (e.g. after a backfill)")
+        parser.add_argument('--compare', type=int, default=0, metavar='N',
+                            help="Score N random incident locations from buckets and exactly, and report the difference")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            start = time.perf_counter()
+            count = incident_buckets.rebuild()
+            self.stdout.write(f"Rebuilt {count} buckets in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        merged = incident_buckets.compact()
+        self.stdout.write(
+            f"Archived {merged} day buckets in {time.perf_counter() - start:.1f}s, "
+            f"{IncidentBucket.objects.count()} buckets for {CrimeIncident.objects.count()} incidents"
+        )
+
+        if options['compare']:
+            self._compare(options['compare'], random.Random(options['seed']))
+
+    def _compare(self, count, rng):
+        ids = list(CrimeIncident.objects.values_list('id', flat=True))
+        points = CrimeIncident.objects.filter(id__in=rng.sample(ids, min(count, len(ids)))).values_list(
+            'latitude', 'longitude'
+        )
+        timings = {True: 0.0, False: 0.0}
+        max_diff = 0.0
+        for lat, lon in points:
+            scores = {}
+            for exact in (True, False):
+                start = time.perf_counter()
+                scores[exact] = incident_buckets.risk_score(lat, lon, exact=exact)
+                timings[exact] += time.perf_counter() - start
+            max_diff = max(max_diff, abs(scores[True] - scores[False]))
+        checked = max(len(points), 1)
+        self.stdout.write(
+            f"{len(points)} points at {timezone.now():%Y-%m-%d %H:%M}: exact {timings[True] / checked * 1000:.1f} ms, "
+            f"buckets {timings[False] / checked * 1000:.1f} ms, max abs difference {max_diff:.3f}"
+        )
@@ -0,0 +1,65 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from alerts.chatgpt_cleaner import extract_locally
+
+
+def report_text_from_prompt(prompt):
+    """Pull the report back out of a prompt built by build_prompt."""
+    parts = prompt.split('"""')
+    return parts[1].strip() if len(parts) >= 3 else prompt
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers generateContent requests like Gemini, using the local rules."""
+    latency = 0.0
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            prompt = body['contents'][0]['parts'][0]['text']
+        except (ValueError, KeyError, IndexError) as e:
+            self._send(400, {'error': {'message': f"Bad request: {e}"}})
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        data = extract_locally(report_text_from_prompt(prompt))
+        data.pop('confidence', None)
+        # Gemini usually wraps its JSON in a code fence, so the stub does too
+        text = "```json\n" + json.dumps(data) + "\n```"
+        self._send(200, {'candidates': [{'content': {'parts': [{'text': text}]}}]})
+
+    def _send(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Run a local stand-in for the Gemini generateContent API so extraction "
+            "can be exercised offline. Use with EXTRACTION_BACKEND=stub.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Seconds to wait before each response, to imitate the real API")
+
+    def handle(self, *args, **options):
+        handler = type('Handler', (StubHandler,), {'latency': options['latency']})
+        server = ThreadingHTTPServer((options['host'], options['port']), handler)
+        self.stdout.write(f"Extraction stub listening on http://{options['host']}:{options['port']}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from alerts import synthetic
+
+
+class Command(BaseCommand):
+    help = ("Insert synthetic incidents, risk areas and devices clustered around a city "
+            "(see alerts/synthetic.py). Set SAFEROUTE_DB_PATH to use a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incidents', type=int, default=100000)
+        parser.add_argument('--risk-areas', type=int, default=10000)
+        parser.add_argument('--devices', type=int, default=1000)
+        parser.add_argument('--hotspots', type=int, default=50)
+        parser.add_argument('--span-km', type=float, default=20.0, help="Size of the city, in km")
+        parser.add_argument('--days', type=int, default=365, help="Days of history to spread reports over")
+        parser.add_argument('--center', type=float, nargs=2, metavar=('LAT', 'LON'), default=synthetic.DEFAULT_CENTER)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete every incident, risk area and device first")
+        parser.add_argument('--no-derived', action='store_true',
+                            help="Skip rebuilding the incident buckets and statistics")
+
+    def handle(self, *args, **options):
+        if min(options['incidents'], options['risk_areas'], options['devices']) < 0 or options['chunk_size'] < 1:
+            raise CommandError("Counts must not be negative and --chunk-size must be positive")
+
+        if options['clear']:
+            synthetic.clear()
+            self.stdout.write("Cleared incidents, risk areas and devices")
+
+        city = synthetic.SyntheticCity(center=tuple(options['center']), span_km=options['span_km'],
+                                       hotspots=options['hotspots'], days=options['days'], seed=options['seed'])
+        start = time.perf_counter()
+        last = {}
+
+        def progress(kind, done, total):
+            # Report about every 10% and at the end
+            step = max(total // 10, 1)
+            if done == total or done // step != last.get(kind, 0) // step:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{kind:<11} {done:>10}/{total:<10} {elapsed:>8.1f}s")
+            last[kind] = done
+
+        synthetic.populate(city, incidents=options['incidents'], areas=options['risk_areas'],
+                           devices=options['devices'], chunk_size=options['chunk_size'],
+                           derived=not options['no_derived'], progress=progress)
+        elapsed = time.perf_counter() - start
+        rows = options['incidents'] + options['risk_areas'] + options['devices']
+        self.stdout.write(f"Inserted {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,113 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from alerts import loadtest, synthetic
+from alerts.management.commands.bench_push import start_fake_expo_server
+from alerts.models import RiskArea
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ("Simulate users walking with the map screen open against a local server and report "
+            "throughput and p50/p95/p99 latency per endpoint for each --users count. Starts one "
+            "runserver process on the current database (fill it with generate_synthetic_data) "
+            "unless --url is given; push alerts go to a local fake Expo server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[10, 50, 100])
+        parser.add_argument('--seconds', type=float, default=60.0, help="Duration of each step")
+        parser.add_argument('--time-scale', type=float, default=1.0,
+                            help="Speed up each user's clock, so a user offers the load of this many users")
+        parser.add_argument('--pan-interval', type=float, default=60.0,
+                            help="Mean seconds between map pans per user")
+        parser.add_argument('--reports-per-hour', type=float, default=0.2,
+                            help="Crime reports per user per hour")
+        parser.add_argument('--slo-ms', type=float, default=200.0,
+                            help="A step is sustained if every endpoint's p95 is below this and nothing failed")
+        parser.add_argument('--url', type=str, help="API base URL of a running server, e.g. http://127.0.0.1:8000/api")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', type=str, help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if not RiskArea.objects.exists() and not options['url']:
+            self.stderr.write("No risk areas in the database; run generate_synthetic_data first for realistic responses")
+
+        fake_expo, expo_url = start_fake_expo_server()
+        server = None
+        base_url = options['url']
+        try:
+            if not base_url:
+                server, base_url = self._start_server(expo_url)
+            steps = [self._step(base_url, users, options) for users in options['users']]
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+            fake_expo.shutdown()
+            fake_expo.server_close()
+
+        sustained = [step['users'] for step in steps if step['sustained']]
+        self.stdout.write(f"Sustained up to {max(sustained)} users" if sustained else "No step was sustained")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'url': base_url, 'options': {key: options[key] for key in (
+                    'seconds', 'time_scale', 'pan_interval', 'reports_per_hour', 'slo_ms', 'seed')},
+                    'steps': steps}, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def _start_server(self, expo_url):
+        port = _free_port()
+        env = {**os.environ, 'EXPO_PUSH_URL': expo_url}
+        server = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}/api"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("runserver exited during startup")
+            try:
+                requests.get(f"{base_url}/risk/", params={'lat': 0, 'lon': 0, 'mode': 'check'}, timeout=1)
+                self.stdout.write(f"Started runserver on port {port}")
+                return server, base_url
+            except requests.RequestException:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("runserver did not start within 30 seconds")
+
+    def _step(self, base_url, users, options):
+        # Users start where the synthetic incidents are
+        city = synthetic.SyntheticCity(seed=options['seed'], sample_seed=options['seed'] + users)
+        latitudes, longitudes = city.points(users)
+        summary = loadtest.run_load(
+            base_url, list(zip(latitudes.tolist(), longitudes.tolist())), options['seconds'], seed=options['seed'],
+            time_scale=options['time_scale'], pan_interval=options['pan_interval'],
+            reports_per_hour=options['reports_per_hour'],
+        )
+        endpoints = summary['endpoints']
+        sustained = summary['errors'] == 0 and all(
+            endpoint.get('p95', 0) < options['slo_ms'] for endpoint in endpoints.values()
+        )
+
+        self.stdout.write(f"{users} users x{options['time_scale']:g}: {summary['requests']} requests, "
+                          f"{summary['throughput']:.1f} req/s, {summary['errors']} errors, "
+                          f"p95 lag {summary['lag'].get('p95', 0):.0f} ms{'' if sustained else ', NOT sustained'}")
+        for name, endpoint in endpoints.items():
+            self.stdout.write(
+                f"  {name:<15} {endpoint['count']:>7} req {endpoint['throughput']:>8.2f} req/s   "
+                f"p50 {endpoint.get('p50', 0):>8.2f}   p95 {endpoint.get('p95', 0):>8.2f}   "
+                f"p99 {endpoint.get('p99', 0):>8.2f} ms   errors {endpoint['errors']}"
+            )
+        return {'users': users, 'timeScale': options['time_scale'], 'sustained': sustained, **summary}
@@ -0,0 +1,54 @@
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+DEFAULT_COMMANDS = ['check', 'help process_crime', 'process_crime --help']
+
+
+class Command(BaseCommand):
+    help = ("Measure how long manage.py commands take to start, each run in a fresh "
+            "interpreter, and which modules they import.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('commands', nargs='*', default=DEFAULT_COMMANDS,
+                            help="manage.py commands to time, quoted if they take arguments")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per command")
+        parser.add_argument('--modules', nargs='*', default=['requests', 'bs4'],
+                            help="Report whether these modules were imported by each command")
+
+    def _run(self, args, env=None):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, *args], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        return time.perf_counter() - start, completed
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'command':<32} {'min ms':>8} {'median ms':>10} {'max ms':>8}  imported")
+        for command in options['commands']:
+            args = ['manage.py', *shlex.split(command)]
+            timings = []
+            for _ in range(max(1, options['repeat'])):
+                elapsed, completed = self._run(args)
+                if completed.returncode != 0:
+                    self.stderr.write(f"{command} failed:\n{completed.stderr.strip()}")
+                    break
+                timings.append(elapsed * 1000)
+            if not timings:
+                continue
+
+            # -X importtime lists every module imported during the run
+            _, traced = self._run(['-X', 'importtime', *args])
+            imported = {line.rsplit('|', 1)[-1].strip() for line in traced.stderr.splitlines()
+                        if line.startswith('import time:')}
+            heavy = [name for name in options['modules'] if name in imported]
+
+            self.stdout.write(
+                f"{command:<32} {min(timings):>8.0f} {statistics.median(timings):>10.0f} "
+                f"{max(timings):>8.0f}  {', '.join(heavy) or '-'}"
+            )
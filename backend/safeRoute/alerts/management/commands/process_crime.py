@@ -1,39 +1,251 @@
+import glob
 import os
 import json
-from django.core.management.base import BaseCommand
-from alerts.chatgpt_cleaner import get_text_from_file, get_text_from_url, clean_and_extract
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from alerts.chatgpt_cleaner import (
+    get_text_from_file, get_text_from_url, iter_text_from_file, iter_text_from_url, extract, extraction_path_stats, get_extraction_cache, get_extractor
+)
+from alerts.html_text import chunk_text
+from alerts.ingest import CHUNK_SIZE, ingest_incidents
+from alerts.models import CrimeIncident
+from alerts.utils import determine_severity_from_data
 
-class Command(BaseCommand):
-    help = "Process a crime report from file or url using chatgpt for data cleaning and extraction."
-    
-    def add_arguments(self, parser):
-        parser.add_argument('source', type=str, help="Path to a file or URL of the crime report")
-        parser.add_argument('--url', action='store_true', help="Specify if the source is a URL")
-        
-    def handle(self, *args, **options):
-        source = options['source']
-        is_url = options.get('url', False)
-        
-        if is_url:
-            try:
-                text = get_text_from_url(source)
-            except Exception as e:
-                self.stderr.write(f"Error fetching URL: {e}")
-                return
+
+class RateLimiter:
+    """Spaces calls out evenly so at most `per_second` start each second, across threads."""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second and per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def expand_sources(sources, force_url=False):
+    """
+    Turn files, directories, glob patterns and URLs into (kind, source)
+    pairs, each source once even if several arguments match it.
+    """
+    expanded = []
+    for source in sources:
+        if force_url or source.startswith(('http://', 'https://')):
+            expanded.append(('url', source))
+        elif os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                path = os.path.join(source, name)
+                if os.path.isfile(path):
+                    expanded.append(('file', path))
+        elif glob.has_magic(source):
+            expanded.extend(('file', path) for path in sorted(glob.glob(source)) if os.path.isfile(path))
         else:
-            if not os.path.exists(source):
-                self.stderr.write(f"Error: File '{source}' does not exist.")
-                return
-            
-            try:
+            expanded.append(('file', source))
+
+    unique = []
+    seen = set()
+    for kind, source in expanded:
+        key = (kind, os.path.normpath(source) if kind == 'file' else source)
+        if key not in seen:
+            seen.add(key)
+            unique.append((kind, source))
+    return unique
+
+
+def extract_result(source, text, limiter, use_local):
+    try:
+        return {'source': source, **extract(text, use_local=use_local, before_remote=limiter.wait)}
+    except ValueError as e:
+        # No usable remote backend for a report the local rules could not handle
+        return {'source': source, 'error': str(e)}
+
+
+def process_source(kind, source, limiter, use_local=True, chunk_size=0):
+    """
+    Fetch or read one source and extract its crime data. Returns a list of
+    results: one for the whole document, or with chunk_size one per chunk
+    of at most chunk_size characters (sources labelled "source#n"), so a
+    page listing several incidents yields several results.
+    """
+    if kind == 'file' and not os.path.exists(source):
+        return [{'source': source, 'error': f"File '{source}' does not exist."}]
+    error_prefix = "Error fetching URL" if kind == 'url' else "Error reading file"
+    if kind == 'url':
+        limiter.wait()
+
+    if not chunk_size:
+        try:
+            if kind == 'url':
+                text = get_text_from_url(source)
+            else:
                 with open(source, "rb") as f:
                     text = get_text_from_file(f)
-            except Exception as e:
-                self.stderr.write(f"Error reading file: {e}")
-                return 
-        
-        extracted_data = clean_and_extract(text)
-        output_json = json.dumps(extracted_data, indent=2)
-        
-        self.stdout.write("Extracted data: ")
-        self.stdout.write(output_json) 
\ No newline at end of file
+        except Exception as e:
+            return [{'source': source, 'error': f"{error_prefix}: {e}"}]
+        return [extract_result(source, text, limiter, use_local)]
+
+    # Text is streamed into chunks, so only one chunk is held at a time
+    results = []
+    try:
+        if kind == 'url':
+            pieces = iter_text_from_url(source)
+            for number, chunk in enumerate(chunk_text(pieces, chunk_size), start=1):
+                results.append(extract_result(f"{source}#{number}", chunk, limiter, use_local))
+        else:
+            with open(source, "rb") as f:
+                for number, chunk in enumerate(chunk_text(iter_text_from_file(f), chunk_size), start=1):
+                    results.append(extract_result(f"{source}#{number}", chunk, limiter, use_local))
+    except Exception as e:
+        results.append({'source': source, 'error': f"{error_prefix}: {e}"})
+    return results
+
+
+def report_time(result):
+    """The aware datetime of an extraction result's 'date', or None if it has none."""
+    reported_at = None
+    if result.get('date'):
+        reported_at = parse_datetime(result['date'])
+        if reported_at is None and parse_date(result['date']):
+            reported_at = parse_datetime(f"{result['date']}T00:00:00")
+    if reported_at is not None and timezone.is_naive(reported_at):
+        reported_at = timezone.make_aware(reported_at)
+    return reported_at
+
+
+def incident_from_result(result):
+    """Build an unsaved CrimeIncident from an extraction result, or None if it has no location."""
+    if result.get('error') or result.get('latitude') is None or result.get('longitude') is None:
+        return None
+
+    crime_type = result.get('crime_type') or 'unknown'
+    return CrimeIncident(
+        latitude=float(result['latitude']),
+        longitude=float(result['longitude']),
+        description=f"{crime_type}: extracted from {result['source']}",
+        severity=determine_severity_from_data(crime_type),
+        reported_at=report_time(result) or timezone.now(),
+    )
+
+
+class Command(BaseCommand):
+    help = ("Process crime reports from files, directories, glob patterns or URLs "
+            "using the LLM extractor for data cleaning and extraction.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', type=str,
+                            help="Paths, directories, glob patterns or URLs of crime reports")
+        parser.add_argument('--url', action='store_true', help="Treat every source as a URL")
+        parser.add_argument('--concurrency', type=int, default=4, help="Sources processed in parallel")
+        parser.add_argument('--rate-limit', type=float, default=0,
+                            help="Maximum fetches/extractions started per second (0 = unlimited)")
+        parser.add_argument('--output', type=str, help="Append results to this file as NDJSON as they complete")
+        parser.add_argument('--save', action='store_true',
+                            help="Create CrimeIncident rows for results that have coordinates "
+                                 "(undated ones are stamped now and send no alerts)")
+        parser.add_argument('--no-local', action='store_true',
+                            help="Always use the LLM instead of trying the local rule-based extractor first")
+        parser.add_argument('--chunk-size', type=int, default=0,
+                            help="Split each document into chunks of about this many characters and "
+                                 "extract each separately, for pages listing several incidents (0 = whole document)")
+
+    def handle(self, *args, **options):
+        sources = expand_sources(options['sources'], options.get('url', False))
+        if not sources:
+            self.stderr.write("Error: no sources matched.")
+            return
+
+        # Fail up front on a misconfigured backend rather than once per source
+        try:
+            get_extractor()
+        except ValueError as e:
+            if options['no_local']:
+                raise CommandError(str(e))
+            self.stderr.write(f"Warning: {e} Only confident local extractions will succeed.")
+
+        # A single source keeps the original human readable output
+        if len(sources) == 1 and not options['output'] and not options['save']:
+            results = process_source(*sources[0], RateLimiter(options['rate_limit']),
+                                     not options['no_local'], options['chunk_size'])
+            for result in results:
+                if set(result) == {'source', 'error'}:
+                    self.stderr.write(f"Error: {result['error']}")
+                    continue
+                source = result.pop('source', None)
+                self.stdout.write(f"Extracted data ({source}): " if options['chunk_size'] else "Extracted data: ")
+                self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        limiter = RateLimiter(options['rate_limit'])
+        output = open(options['output'], 'a') if options['output'] else None
+        processed = failed = saved = 0
+        # Saved a batch at a time, so derived data is updated once per batch.
+        # Undated reports are stamped with the import time, so they are saved
+        # without alerts rather than announced as new incidents.
+        dated, undated = [], []
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+                futures = [
+                    executor.submit(process_source, kind, source, limiter, not options['no_local'], options['chunk_size'])
+                    for kind, source in sources
+                ]
+                results = (result for future in as_completed(futures) for result in future.result())
+                for result in results:
+                    processed += 1
+                    line = json.dumps(result)
+                    if output:
+                        output.write(line + "\n")
+                        output.flush()
+                    else:
+                        self.stdout.write(line)
+
+                    if result.get('error'):
+                        failed += 1
+                        self.stderr.write(f"{result['source']}: {result['error']}")
+                        continue
+
+                    if options['save']:
+                        incident = incident_from_result(result)
+                        if incident is not None:
+                            (dated if report_time(result) else undated).append(incident)
+                        for pending, notify in ((dated, True), (undated, False)):
+                            if len(pending) >= CHUNK_SIZE:
+                                saved += len(ingest_incidents(pending, notify=notify)[0])
+                                pending.clear()
+            for pending, notify in ((dated, True), (undated, False)):
+                if pending:
+                    saved += len(ingest_incidents(pending, notify=notify)[0])
+        finally:
+            if output:
+                output.close()
+
+        self.stderr.write(
+            f"Processed {len(sources)} sources in {time.perf_counter() - start:.1f}s "
+            f"({processed} results, {failed} failed, {saved} saved)"
+        )
+        paths = extraction_path_stats()
+        avg_remote = paths['avg_remote_seconds']
+        self.stderr.write(
+            f"Extraction paths: {paths['local']} local, {paths['remote']} remote"
+            + (f" (avg {avg_remote:.2f}s per remote call, ~{paths['local'] * avg_remote:.1f}s avoided)"
+               if avg_remote else "")
+        )
+        cache = get_extraction_cache()
+        if cache:
+            stats = cache.stats()
+            self.stderr.write(
+                f"Extraction cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries)"
+            )
@@ -0,0 +1,13 @@
+import time
+from django.core.management.base import BaseCommand
+from alerts import incident_stats
+
+
+class Command(BaseCommand):
+    help = ("Recount the crime statistics summary from every incident, e.g. after "
+            "importing or reclassifying incidents outside ingest_incidents().")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rows = incident_stats.rebuild()
+        self.stdout.write(f"Rebuilt {rows} statistics rows in {time.perf_counter() - start:.1f}s")
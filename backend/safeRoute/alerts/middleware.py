@@ -0,0 +1,64 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Record latency, response size, status and query count of every request
+    by URL name (see alerts/metrics.py). Requests that match no URL are
+    grouped under 'unmatched'.
+
+    Sync and async capable, so under ASGI the risk area stream is not
+    adapted onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self._observe_error(request, start, token)
+            raise
+        return self._observe(request, response, start, token)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            self._observe_error(request, start, token)
+            raise
+        return self._observe(request, response, start, token)
+
+    def _observe(self, request, response, start, token):
+        # Streaming bodies are produced later; only their headers are timed here
+        size = None if response.streaming else len(response.content)
+        metrics.observe_response(self._view(request), request.method, response.status_code,
+                                 time.perf_counter() - start, size, metrics.end_request(token))
+        return response
+
+    def _observe_error(self, request, start, token):
+        metrics.observe_response(self._view(request), request.method, 500, time.perf_counter() - start,
+                                 queries=metrics.end_request(token))
+
+    @staticmethod
+    def _view(request):
+        match = getattr(request, 'resolver_match', None)
+        return match.url_name or match.view_name if match else 'unmatched'
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrimeIncident',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('description', models.TextField()),
+                ('reported_at', models.DateTimeField(auto_now_add=True)),
+                ('severity', models.IntegerField(default=1)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('push_token', models.CharField(max_length=255, unique=True)),
+                ('device_id', models.CharField(max_length=255)),
+                ('platform', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RiskArea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('risk_score', models.FloatField()),
+                ('risk_category', models.CharField(max_length=1)),
+                ('crime_type', models.CharField(default='unknown', max_length=50)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
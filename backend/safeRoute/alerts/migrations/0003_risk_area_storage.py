@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0002_risktile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='riskarea',
+            name='radius',
+            field=models.FloatField(default=0.2),
+        ),
+        migrations.AlterField(
+            model_name='riskarea',
+            name='risk_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name='riskarea',
+            index=models.Index(fields=['latitude', 'longitude'], name='riskarea_lat_lon_idx'),
+        ),
+    ]
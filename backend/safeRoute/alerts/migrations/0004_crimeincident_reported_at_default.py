@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0003_risk_area_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='crimeincident',
+            name='reported_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
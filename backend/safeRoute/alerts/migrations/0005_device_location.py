@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0004_crimeincident_reported_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
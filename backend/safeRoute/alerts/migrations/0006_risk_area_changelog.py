@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0005_device_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskAreaChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('op', models.CharField(choices=[('add', 'Add'), ('remove', 'Remove'), ('reset', 'Reset')], max_length=6)),
+                ('area_id', models.IntegerField(blank=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('radius', models.FloatField(default=0.0)),
+                ('area', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0006_risk_area_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crimeincident',
+            name='crime_type',
+            field=models.CharField(db_index=True, default='unknown', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='crimeincident',
+            name='severity',
+            field=models.IntegerField(db_index=True, default=1),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0007_incident_classification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='crimeincident',
+            index=models.Index(fields=['latitude', 'longitude', 'reported_at'], name='incident_lat_lon_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crimeincident',
+            index=models.Index(fields=['reported_at'], name='incident_reported_at_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0008_incident_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_lat', models.IntegerField()),
+                ('cell_lon', models.IntegerField()),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0.0)),
+                ('longitude_sum', models.FloatField(default=0.0)),
+                ('severity_sum', models.IntegerField(default=0)),
+                ('severity_max', models.IntegerField(default=0)),
+                ('severity_time_sum', models.FloatField(default=0.0)),
+                ('last_reported_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='incident_bucket_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='incidentbucket',
+            constraint=models.UniqueConstraint(fields=('cell_lat', 'cell_lon', 'day'), name='unique_incident_bucket'),
+        ),
+    ]
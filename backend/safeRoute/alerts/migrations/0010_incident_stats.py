@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-17 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0009_incident_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell_lat', models.IntegerField()),
+                ('cell_lon', models.IntegerField()),
+                ('day', models.DateField()),
+                ('crime_type', models.CharField(max_length=50)),
+                ('severity', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='incidentstat',
+            constraint=models.UniqueConstraint(fields=('cell_lat', 'cell_lon', 'day', 'crime_type', 'severity'), name='unique_incident_stat'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0010_incident_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='crimeincident',
+            name='severity',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def rebuild_buckets(apps, schema_editor):
+    # Buckets are keyed by grid cell, and the default cell size shrank to ~3 m
+    from alerts.incident_buckets import _totals
+
+    CrimeIncident = apps.get_model('alerts', 'CrimeIncident')
+    IncidentBucket = apps.get_model('alerts', 'IncidentBucket')
+    incidents = CrimeIncident.objects.only('latitude', 'longitude', 'reported_at', 'severity')
+    totals = _totals(incidents.iterator(chunk_size=10000))
+    IncidentBucket.objects.all().delete()
+    IncidentBucket.objects.bulk_create([
+        IncidentBucket(cell_lat=cell_lat, cell_lon=cell_lon, day=day, **bucket)
+        for (cell_lat, cell_lon, day), bucket in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0011_incident_severity_nullable'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_buckets, migrations.RunPython.noop),
+    ]
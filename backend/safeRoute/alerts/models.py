@@ -1,32 +1,329 @@
-from django.db import models
+import math
+from django.db import models, transaction
+from django.utils import timezone
+from . import geohash
+from .spatial_index import KM_PER_DEGREE
+from .utils import calculate_distance, classify_incident
+
+# Fields the incident buckets and statistics are computed from
+SUMMARY_FIELDS = ('latitude', 'longitude', 'reported_at', 'severity', 'crime_type')
+
+class CrimeIncidentQuerySet(models.QuerySet):
+    def in_bbox(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        """Incidents inside the bounding box."""
+        return self.filter(latitude__range=(sw_lat, ne_lat), longitude__range=(sw_lng, ne_lng))
+
+    def around(self, lat, lon, radius_km, since=None):
+        """
+        Incidents in the bounding box of a radius_km circle, reported at or
+        after `since` if given. Filters in SQL only, using the
+        latitude/longitude/reported_at index; near() adds the exact check.
+        """
+        lat_pad = radius_km / KM_PER_DEGREE
+        lon_pad = lat_pad / max(math.cos(math.radians(min(abs(lat) + lat_pad, 89.9))), 1e-6)
+        queryset = self.in_bbox(lat - lat_pad, lon - lon_pad, lat + lat_pad, lon + lon_pad)
+        if since is not None:
+            queryset = queryset.filter(reported_at__gte=since)
+        return queryset
+
+    def near(self, lat, lon, radius_km, since=None):
+        """(distance_km, incident) for incidents within radius_km of the point, nearest first."""
+        matches = []
+        for incident in self.around(lat, lon, radius_km, since):
+            distance = calculate_distance(lat, lon, incident.latitude, incident.longitude)
+            if distance <= radius_km:
+                matches.append((distance, incident.id, incident))
+        matches.sort(key=lambda item: (item[0], item[1]))
+        return [(distance, incident) for distance, _, incident in matches]
+
+    def delete(self):
+        """Delete the incidents and take them back out of the buckets and statistics."""
+        # Imported here, both modules import this one
+        from . import heatmap, incident_buckets, incident_stats
+        with transaction.atomic(using=self.db):
+            if not self.query.where:
+                # Everything is going; recounting the empty table is cheapest
+                deleted = super().delete()
+                incident_buckets.rebuild()
+                incident_stats.rebuild()
+                return deleted
+            removed = list(self.only(*SUMMARY_FIELDS))
+            deleted = super().delete()
+            incident_buckets.remove_incidents(removed)
+            incident_stats.remove_incidents(removed)
+            heatmap.schedule_update(removed)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class CrimeIncident(models.Model):
     latitude = models.FloatField()
     longitude = models.FloatField()
     description = models.TextField()
-    reported_at = models.DateTimeField(auto_now_add=True)
-    severity = models.IntegerField(default = 1)
+    reported_at = models.DateTimeField(default=timezone.now)
+    # 1-5; left empty, it is set from the description on save
+    severity = models.IntegerField(null=True, blank=True, db_index=True)
+    # Normalized code, e.g. 'robbery'; set from the description on save
+    crime_type = models.CharField(max_length=50, default='unknown', db_index=True)
+    
+    objects = CrimeIncidentQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Bounding box first, then the time window, without touching the table
+            models.Index(fields=['latitude', 'longitude', 'reported_at'], name='incident_lat_lon_time_idx'),
+            models.Index(fields=['reported_at'], name='incident_reported_at_idx'),
+        ]
+    
+    def classify(self):
+        """
+        Fill severity and crime_type from the description when they are not
+        set, so scoring never has to read the free text. Called by save();
+        call it yourself before bulk_create.
+        """
+        severity, crime_type = classify_incident(self.description)
+        if not self.severity:
+            self.severity = severity
+        if not self.crime_type or self.crime_type == 'unknown':
+            self.crime_type = crime_type
+        return self
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the buckets and statistics hold for this row, to tell edits apart
+        instance._summary = instance._summary_values()
+        return instance
+    
+    def _summary_values(self):
+        deferred = self.get_deferred_fields()
+        if deferred & set(SUMMARY_FIELDS):
+            return None
+        return tuple(getattr(self, name) for name in SUMMARY_FIELDS)
+    
+    def save(self, *args, **kwargs):
+        self.classify()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'description' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'severity', 'crime_type'}
+        adding = self._state.adding
+        # Imported here, both modules import this one
+        from . import heatmap, incident_buckets, incident_stats
+        # A new row is written before any bucket is read, so the transaction
+        # takes the write lock up front
+        with transaction.atomic():
+            old = None if adding else getattr(self, '_summary', None)
+            if not adding and old is None:
+                old = CrimeIncident.objects.filter(pk=self.pk).values_list(*SUMMARY_FIELDS).first()
+            super().save(*args, **kwargs)
+            new = self._summary_values()
+            if adding:
+                incident_buckets.add_incidents([self])
+                incident_stats.add_incidents([self])
+            elif old is not None and new is not None:
+                update_fields = kwargs.get('update_fields')
+                if update_fields is not None:
+                    # Only these were written
+                    new = tuple(value if name in update_fields else previous
+                                for name, value, previous in zip(SUMMARY_FIELDS, new, old))
+                if new != old:
+                    before = CrimeIncident(**dict(zip(SUMMARY_FIELDS, old)))
+                    after = CrimeIncident(**dict(zip(SUMMARY_FIELDS, new)))
+                    incident_buckets.remove_incidents([before])
+                    incident_stats.remove_incidents([before])
+                    incident_buckets.add_incidents([after])
+                    incident_stats.add_incidents([after])
+                    heatmap.schedule_update([before, after])
+            self._summary = new
+    
+    def delete(self, *args, **kwargs):
+        # Imported here, both modules import this one
+        from . import heatmap, incident_buckets, incident_stats
+        with transaction.atomic():
+            deferred = self.get_deferred_fields() & set(SUMMARY_FIELDS)
+            if deferred:
+                self.refresh_from_db(fields=deferred)
+            deleted = super().delete(*args, **kwargs)
+            incident_buckets.remove_incidents([self])
+            incident_stats.remove_incidents([self])
+            heatmap.schedule_update([self])
+        return deleted
     
     def __str__(self):
         return f"Crime at ({self.latitude}, {self.longitude})-{self.description}"
+
+class IncidentBucket(models.Model):
+    """
+    Running totals of the incidents reported in one grid cell on one (UTC)
+    day, kept up to date as incidents are inserted so scoring can read a
+    few buckets instead of every incident (see alerts.incident_buckets).
+    Days old enough that time decay no longer changes are merged into one
+    archive bucket per cell, dated ARCHIVE_DAY.
+    """
+    cell_lat = models.IntegerField()
+    cell_lon = models.IntegerField()
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0.0)
+    longitude_sum = models.FloatField(default=0.0)
+    severity_sum = models.IntegerField(default=0)
+    severity_max = models.IntegerField(default=0)
+    # Sum of severity * unix timestamp, for the severity-weighted mean report time
+    severity_time_sum = models.FloatField(default=0.0)
+    last_reported_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell_lat', 'cell_lon', 'day'], name='unique_incident_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='incident_bucket_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"Bucket ({self.cell_lat}, {self.cell_lon}) {self.day}: {self.count}"
+
+class IncidentStat(models.Model):
+    """
+    Number of incidents of one crime type and severity reported in one
+    statistics cell (STATISTICS_CELL_DEG) on one UTC day. Kept up to date as
+    incidents are inserted so /api/statistics/ only sums a few rows (see
+    alerts.incident_stats).
+    """
+    cell_lat = models.IntegerField()
+    cell_lon = models.IntegerField()
+    day = models.DateField()
+    crime_type = models.CharField(max_length=50)
+    severity = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell_lat', 'cell_lon', 'day', 'crime_type', 'severity'],
+                                    name='unique_incident_stat'),
+        ]
+
+    def __str__(self):
+        return f"Stat ({self.cell_lat}, {self.cell_lon}) {self.day} {self.crime_type}/{self.severity}: {self.count}"
   
+class RiskAreaQuerySet(models.QuerySet):
+    def in_bbox(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        """Areas whose center lies inside the bounding box."""
+        return self.filter(latitude__range=(sw_lat, ne_lat), longitude__range=(sw_lng, ne_lng))
+
 class RiskArea(models.Model):
     latitude = models.FloatField()
     longitude = models.FloatField()
-    risk_score = models.FloatField()
+    radius = models.FloatField(default = 0.2)  # kilometers
+    risk_score = models.FloatField(default = 0.0)
     risk_category = models.CharField(max_length = 1)
     crime_type = models.CharField(max_length = 50, default='unknown')
     computed_at = models.DateTimeField(auto_now = True)
     
+    objects = RiskAreaQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='riskarea_lat_lon_idx'),
+        ]
+    
+    def to_dict(self):
+        """Shape used by the risk area API responses."""
+        return {
+            'id': self.id,
+            'center': {'latitude': self.latitude, 'longitude': self.longitude},
+            'radius': self.radius,
+            'riskLevel': self.risk_category,
+            'crimeType': self.crime_type
+        }
+    
     def __str__(self):
         return f"RiskArea at ({self.latitude}, {self.longitude}): {self.risk_category}"
 
+class DataVersion(models.Model):
+    """
+    Monotonically increasing counter for a named data set. Bumped on every
+    change so each worker process can tell when its cached copy is stale.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class RiskAreaChange(models.Model):
+    """
+    Changelog of the risk area set, one row per added or removed area, so
+    clients can fetch only what changed since the version they have. A
+    'reset' row (no area) means every earlier area was removed.
+    """
+    ADD = 'add'
+    REMOVE = 'remove'
+    RESET = 'reset'
+    OP_CHOICES = [(ADD, 'Add'), (REMOVE, 'Remove'), (RESET, 'Reset')]
+
+    version = models.BigIntegerField(db_index=True)
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    area_id = models.IntegerField(null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    radius = models.FloatField(default=0.0)
+    # RiskArea.to_dict() at the time of the change (areas are never edited)
+    area = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"v{self.version} {self.op} {self.area_id}"
+
+class DeviceQuerySet(models.QuerySet):
+    def in_geohash_cells(self, cells):
+        """Devices whose geohash starts with any of the given cell hashes (index range scans)."""
+        condition = models.Q()
+        for cell in cells:
+            lower, upper = geohash.prefix_range(cell)
+            condition |= models.Q(geohash__gte=lower, geohash__lt=upper)
+        return self.filter(condition) if cells else self.none()
+
 class Device(models.Model):
     push_token = models.CharField(max_length=255, unique=True)
     device_id = models.CharField(max_length=255)
     platform = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Last known location, indexed through its geohash (see alerts.devices)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True)
+    location_updated_at = models.DateTimeField(null=True, blank=True)
+
+    objects = DeviceQuerySet.as_manager()
+
+    def set_location(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = geohash.encode(latitude, longitude)
+        self.location_updated_at = timezone.now()
 
     def __str__(self):
         return f"{self.platform} device ({self.device_id})"
+
+class RiskTile(models.Model):
+    """
+    Precomputed grid of risk scores for one z/x/y map tile.
+    scores holds TILE_CELLS x TILE_CELLS float32 values, row-major from the
+    north-west corner (see alerts.heatmap).
+    """
+    z = models.IntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    scores = models.BinaryField()
+    computed_at = models.DateTimeField(auto_now = True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['z', 'x', 'y'], name='unique_risk_tile'),
+        ]
+
+    def __str__(self):
+        return f"RiskTile {self.z}/{self.x}/{self.y}"
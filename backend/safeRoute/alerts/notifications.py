@@ -0,0 +1,312 @@
+"""
+Expo push notification dispatcher.
+
+Messages are queued and sent by background worker threads in Expo's batch
+format (a JSON list of up to 100 messages per request) over a pooled HTTP
+session, so request handlers never wait on the push service. Each batch is
+retried with exponential backoff when the request fails, is rate limited
+(429) or hits a server error.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EXPO_PUSH_URL = 'https://exp.host/--/api/v2/push/send'
+# Expo rejects requests with more than 100 messages
+MAX_BATCH_SIZE = 100
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def build_message(push_token, title, body, data=None):
+    """An Expo push message for one device."""
+    return {
+        'to': push_token,
+        'sound': 'default',
+        'title': title,
+        'body': body,
+        'data': data or {},
+    }
+
+
+class PushDispatcher:
+    """
+    Queue of push messages drained by worker threads.
+
+    Workers take up to batch_size messages at a time, waiting at most
+    `linger` seconds for a batch to fill, and send each batch with up to
+    max_retries retries. Tokens Expo reports as DeviceNotRegistered are
+    collected in invalid_tokens until take_invalid_tokens() is called.
+    """
+
+    def __init__(self, url=None, batch_size=MAX_BATCH_SIZE, workers=2, max_retries=3,
+                 backoff=0.5, timeout=10, linger=0.05, max_queue=100000):
+        self.url = url or getattr(settings, 'EXPO_PUSH_URL', EXPO_PUSH_URL)
+        self.batch_size = min(max(batch_size, 1), MAX_BATCH_SIZE)
+        self.workers = max(workers, 1)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.linger = linger
+        self.invalid_tokens = set()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._session = None
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'sent': 0, 'failed': 0, 'batches': 0, 'retries': 0, 'dropped': 0,
+                       'invalid_tokens': 0}
+
+    def _get_session(self):
+        # Imported here so importing this module stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({
+            'Accept': 'application/json',
+            'Accept-encoding': 'gzip, deflate',
+            'Content-Type': 'application/json',
+        })
+        access_token = os.getenv('EXPO_ACCESS_TOKEN')
+        if access_token:
+            session.headers['Authorization'] = f'Bearer {access_token}'
+        return session
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            if self._session is None:
+                self._session = self._get_session()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'push-dispatcher-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, messages):
+        """Queue messages for delivery. Returns how many were accepted."""
+        accepted = 0
+        for message in messages:
+            try:
+                self._queue.put_nowait(message)
+                accepted += 1
+            except queue.Full:
+                with self._lock:
+                    self._stats['dropped'] += 1
+        with self._lock:
+            self._stats['queued'] += accepted
+        if accepted < len(messages):
+            logger.warning("Push queue full, dropped %s messages", len(messages) - accepted)
+        return accepted
+
+    def flush(self):
+        """Block until every queued message has been sent or given up on."""
+        self._queue.join()
+
+    def stop(self):
+        """Send what is queued, then stop the workers."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'pending': self._queue.qsize()}
+
+    def take_invalid_tokens(self):
+        """The DeviceNotRegistered tokens seen since the last call."""
+        with self._lock:
+            tokens, self.invalid_tokens = self.invalid_tokens, set()
+        return tokens
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                # Put the stop signal back for after this batch
+                self._queue.task_done()
+                self._queue.put(None)
+                break
+            batch.append(message)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self._queue.task_done()
+                return
+            try:
+                self.send_batch(batch)
+            except Exception as e:
+                logger.error("Unexpected error sending push batch: %s", e)
+                with self._lock:
+                    self._stats['failed'] += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def send_batch(self, batch):
+        """Send one batch, retrying it as a whole. Returns True if Expo accepted it."""
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._session.post(self.url, json=batch, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+                error = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                response, error = None, str(e)
+
+            if attempt == self.max_retries:
+                logger.error("Giving up on push batch of %s after %s attempts: %s", len(batch), attempt + 1, error)
+                with self._lock:
+                    self._stats['failed'] += len(batch)
+                    self._stats['batches'] += 1
+                return False
+            with self._lock:
+                self._stats['retries'] += 1
+            time.sleep(self.backoff * 2 ** attempt)
+
+        if response.status_code != 200:
+            logger.error("Push batch rejected with HTTP %s: %s", response.status_code, response.text[:200])
+            with self._lock:
+                self._stats['failed'] += len(batch)
+                self._stats['batches'] += 1
+            return False
+
+        try:
+            tickets = response.json().get('data', [])
+        except ValueError:
+            tickets = []
+        ok = failed = 0
+        invalid = []
+        for message, ticket in zip(batch, tickets):
+            if ticket.get('status') == 'ok':
+                ok += 1
+                continue
+            failed += 1
+            if (ticket.get('details') or {}).get('error') == 'DeviceNotRegistered':
+                invalid.append(message['to'])
+        # Messages without a ticket are counted as sent; Expo returns one per message
+        ok += max(len(batch) - len(tickets), 0)
+        with self._lock:
+            self._stats['sent'] += ok
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._stats['invalid_tokens'] += len(invalid)
+            self.invalid_tokens.update(invalid)
+        return True
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """The shared dispatcher for this process, started on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = PushDispatcher(workers=getattr(settings, 'PUSH_WORKERS', 2)).start()
+        return _dispatcher
+
+
+def remove_invalid_devices():
+    """
+    Delete the devices whose tokens Expo has reported as DeviceNotRegistered.
+    Workers only collect the tokens; they are removed here, from the thread
+    that sends the next alerts, so workers never touch the database.
+    Returns how many devices were deleted.
+    """
+    from .models import Device
+
+    dispatcher = _dispatcher
+    tokens = dispatcher.take_invalid_tokens() if dispatcher is not None else ()
+    if not tokens:
+        return 0
+    deleted, _ = Device.objects.filter(push_token__in=tokens).delete()
+    logger.info("Removed %s devices with unregistered push tokens", deleted)
+    return deleted
+
+
+def notify_tokens(push_tokens, title, body, data=None):
+    """Queue the same notification for every push token. Returns how many were queued."""
+    remove_invalid_devices()
+    messages = [build_message(token, title, body, data) for token in push_tokens]
+    if not messages:
+        return 0
+    return get_dispatcher().submit(messages)
+
+
+def send_push_notification(device_token, title, body):
+    """
+    Queue a push notification for a specific device. Returns True once the
+    message is queued; delivery happens in the background.
+    """
+    return notify_tokens([device_token], title, body) == 1
+
+
+def notify_incidents(incidents, radius_km=None, min_severity=None, max_age_hours=None):
+    """
+    Alert every device last seen within radius_km (ALERT_RADIUS_KM) of an
+    incident with at least min_severity (ALERT_MIN_SEVERITY) reported in
+    the last max_age_hours (ALERT_MAX_AGE_HOURS, 0 = any age), so imported
+    and backfilled history doesn't alert anyone. Each device gets one
+    message per call, about its most severe nearby incident.
+    Returns how many messages were queued.
+    """
+    from .devices import devices_near_points
+
+    remove_invalid_devices()
+    radius_km = radius_km if radius_km is not None else getattr(settings, 'ALERT_RADIUS_KM', 1.0)
+    min_severity = min_severity if min_severity is not None else getattr(settings, 'ALERT_MIN_SEVERITY', 3)
+    max_age_hours = max_age_hours if max_age_hours is not None else getattr(settings, 'ALERT_MAX_AGE_HOURS', 24)
+    severe = [incident for incident in incidents if (incident.severity or 0) >= min_severity]
+    if max_age_hours:
+        oldest = timezone.now() - timedelta(hours=max_age_hours)
+        severe = [incident for incident in severe if incident.reported_at >= oldest]
+    if not severe:
+        return 0
+
+    matches = devices_near_points([(incident.latitude, incident.longitude) for incident in severe], radius_km)
+    messages = []
+    for device, nearby in matches.items():
+        distance, index = max(nearby, key=lambda item: (severe[item[1]].severity, -item[0]))
+        incident = severe[index]
+        crime_type = incident.crime_type.replace('_', ' ')
+        messages.append(build_message(
+            device.push_token,
+            "Safety alert",
+            f"A {crime_type} was reported {round(distance * 1000)} m from your location",
+            {'incidentId': incident.id, 'latitude': incident.latitude, 'longitude': incident.longitude,
+             'severity': incident.severity},
+        ))
+
+    if messages:
+        get_dispatcher().submit(messages)
+        logger.info("Queued %s alerts for %s incidents", len(messages), len(severe))
+    return len(messages)
@@ -0,0 +1,109 @@
+"""
+Cache for the read-only risk area endpoints, on Django's cache framework.
+
+Keys are built from the risk area version and the request location snapped
+outward to a RESPONSE_CACHE_QUANTUM_DEG grid, so nearby requests share an
+entry and any change to the area set (a new version) makes every old entry
+unreachable. Entries hold the serialized areas for the snapped region;
+each request then keeps only what its exact viewport or radius covers, so
+results are the same as without the cache.
+"""
+import math
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from . import risk_areas
+from .utils import calculate_distance
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _quantum():
+    return getattr(settings, 'RESPONSE_CACHE_QUANTUM_DEG', 0.01)
+
+
+def _timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def _record(name, hit):
+    with _stats_lock:
+        counts = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        counts['hits' if hit else 'misses'] += 1
+
+
+def cache_stats():
+    """Hits, misses and hit rate per cached endpoint in this process."""
+    with _stats_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in stats.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def _version():
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        return risk_areas.get_versioned_index()[1]
+    return risk_areas.current_version()
+
+
+def _get_or_build(name, key_parts, build):
+    """Cached value for the current version, building it with build() on a miss. Returns (version, value, hit)."""
+    version = _version()
+    key = f"risk-response:{name}:{version}:" + ":".join(str(part) for part in key_parts)
+    value = cache.get(key)
+    if value is not None:
+        _record(name, True)
+        return version, value, True
+
+    _record(name, False)
+    built_version, value = build()
+    # Stored under the version it was actually built from
+    cache.set(f"risk-response:{name}:{built_version}:" + ":".join(str(part) for part in key_parts),
+              value, _timeout())
+    return built_version, value, False
+
+
+def bbox_areas(sw_lat, sw_lng, ne_lat, ne_lng, serialize, variant=''):
+    """
+    (version, serialized areas in the box, cache hit). serialize turns an
+    area dict into its response form; variant must identify it (e.g. the
+    geometry encoding) since it is part of the cached value.
+    """
+    quantum = _quantum()
+    cells = (math.floor(sw_lat / quantum), math.floor(sw_lng / quantum),
+             math.ceil(ne_lat / quantum), math.ceil(ne_lng / quantum))
+
+    def build():
+        version, areas = risk_areas.versioned_bbox(*(cell * quantum for cell in cells))
+        return version, [(area['center']['latitude'], area['center']['longitude'], serialize(area)) for area in areas]
+
+    version, entries, hit = _get_or_build('map-risk-areas', (variant, *cells), build)
+    areas = [area for lat, lng, area in entries if sw_lat <= lat <= ne_lat and sw_lng <= lng <= ne_lng]
+    return version, areas, hit
+
+
+def radius_matches(lat, lng, radius_km):
+    """(version, query_radius results, cache hit), matching risk_areas.query_radius exactly."""
+    quantum = _quantum()
+    row, col = math.floor(lat / quantum), math.floor(lng / quantum)
+    center_lat, center_lng = (row + 0.5) * quantum, (col + 0.5) * quantum
+
+    def build():
+        # Everything reachable from anywhere in the cell
+        corner_km = calculate_distance(center_lat, center_lng, row * quantum, col * quantum)
+        corner_km = max(corner_km, calculate_distance(center_lat, center_lng, (row + 1) * quantum, col * quantum))
+        version, matches = risk_areas.versioned_radius(center_lat, center_lng, radius_km + corner_km)
+        return version, [area for _, area in matches]
+
+    version, candidates, hit = _get_or_build('risk', (row, col, radius_km), build)
+    matches = []
+    for area in candidates:
+        center = area['center']
+        distance = calculate_distance(lat, lng, center['latitude'], center['longitude'])
+        if distance <= radius_km + area.get('radius', 0.0):
+            matches.append((distance, area['id'], area))
+    matches.sort(key=lambda item: (item[0], item[1]))
+    return version, [(distance, area) for distance, _, area in matches], hit
@@ -0,0 +1,309 @@
+"""
+Database-backed risk areas with a per-process read-through cache.
+
+RiskArea rows are the source of truth. Each worker keeps a GridIndex copy
+and a version number; every mutation bumps the shared DataVersion row in
+the same transaction, and workers re-check that row at most once every
+RISK_AREA_VERSION_CHECK_SECONDS before deciding whether to reload.
+Setting RISK_AREA_CACHE = False skips the cache and answers every query
+with a bounding-box query against the indexed latitude/longitude columns.
+
+Every mutation also writes RiskAreaChange rows under the new version, so
+changes_since can answer delta requests from clients that already hold
+an older version.
+"""
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import DataVersion, RiskArea, RiskAreaChange
+from .spatial_index import GridIndex, KM_PER_DEGREE
+from .utils import calculate_distance
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAME = 'risk_areas'
+DEFAULT_RADIUS_KM = 0.2
+
+_lock = threading.Lock()
+_cache = {'index': None, 'version': None, 'checked_at': 0.0}
+# Called with the new version after this process commits a change
+_listeners = []
+
+
+def add_listener(callback):
+    """Register callback(version) to run after every risk area change made by this process."""
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def _check_interval():
+    return getattr(settings, 'RISK_AREA_VERSION_CHECK_SECONDS', 1.0)
+
+
+def current_version():
+    """Version of the risk area set as stored in the database."""
+    return DataVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 0
+
+
+def _bump_version():
+    """Increment the shared version. Must be called inside a transaction."""
+    updated = DataVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+    if not updated:
+        DataVersion.objects.get_or_create(name=VERSION_NAME)
+        DataVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+    return current_version()
+
+
+def _load_index():
+    index = GridIndex()
+    for area in RiskArea.objects.all().order_by('id').iterator(chunk_size=5000):
+        index.insert(area.to_dict())
+    return index
+
+
+def get_versioned_index():
+    """
+    (index, version): the cached GridIndex of every risk area and the
+    version it reflects, reloaded when another process has changed the set
+    since it was built.
+    """
+    now = time.monotonic()
+    with _lock:
+        if _cache['index'] is not None and now - _cache['checked_at'] < _check_interval():
+            return _cache['index'], _cache['version']
+
+        version = current_version()
+        if _cache['index'] is None or _cache['version'] != version:
+            _cache['index'] = _load_index()
+            _cache['version'] = version
+        _cache['checked_at'] = time.monotonic()
+        return _cache['index'], _cache['version']
+
+
+def get_index():
+    """Cached GridIndex of every risk area (see get_versioned_index)."""
+    return get_versioned_index()[0]
+
+
+def versioned_bbox(sw_lat, sw_lng, ne_lat, ne_lng):
+    """
+    (version, areas in the box). The areas are never older than the
+    version, so a client that remembers the version can safely ask for
+    what changed after it.
+    """
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        index, version = get_versioned_index()
+        with _lock:
+            return version, index.query_bbox(sw_lat, sw_lng, ne_lat, ne_lng)
+    version = current_version()
+    return version, query_bbox(sw_lat, sw_lng, ne_lat, ne_lng)
+
+
+def versioned_radius(lat, lng, radius_km):
+    """(version, query_radius results), with the same guarantee as versioned_bbox."""
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        index, version = get_versioned_index()
+        with _lock:
+            return version, index.query_radius(lat, lng, radius_km)
+    version = current_version()
+    return version, query_radius(lat, lng, radius_km)
+
+
+def query_bbox(sw_lat, sw_lng, ne_lat, ne_lng):
+    """Areas whose center is inside the bounding box, oldest first."""
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        return get_index().query_bbox(sw_lat, sw_lng, ne_lat, ne_lng)
+    return [area.to_dict() for area in RiskArea.objects.in_bbox(sw_lat, sw_lng, ne_lat, ne_lng).order_by('id')]
+
+
+def query_radius(lat, lng, radius_km):
+    """(distance_km, area) pairs for areas reaching within radius_km, nearest first."""
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        return get_index().query_radius(lat, lng, radius_km)
+
+    # Pad by the largest radius that exists so overlapping areas are found
+    max_radius = RiskArea.objects.order_by('-radius').values_list('radius', flat=True).first() or 0.0
+    lat_pad = (radius_km + max_radius) / KM_PER_DEGREE
+    lng_pad = lat_pad / max(math.cos(math.radians(min(abs(lat) + lat_pad, 89.9))), 1e-6)
+    matches = []
+    for area in RiskArea.objects.in_bbox(lat - lat_pad, lng - lng_pad, lat + lat_pad, lng + lng_pad):
+        distance = calculate_distance(lat, lng, area.latitude, area.longitude)
+        if distance <= radius_km + area.radius:
+            matches.append((distance, area.id, area.to_dict()))
+    matches.sort(key=lambda item: (item[0], item[1]))
+    return [(distance, area) for distance, _, area in matches]
+
+
+def all_areas():
+    """Every risk area, oldest first."""
+    if getattr(settings, 'RISK_AREA_CACHE', True):
+        return list(get_index())
+    return [area.to_dict() for area in RiskArea.objects.order_by('id')]
+
+
+def _apply_locally(new_version, change):
+    """
+    Apply this process's own change to the cached index if the cache was
+    up to date just before it; otherwise drop the cache so it reloads.
+    Then tell the listeners.
+    """
+    with _lock:
+        if _cache['index'] is not None and _cache['version'] == new_version - 1:
+            change(_cache['index'])
+            _cache['version'] = new_version
+        else:
+            _cache['index'] = None
+
+    for callback in list(_listeners):
+        try:
+            callback(new_version)
+        except Exception:
+            logger.exception("Risk area listener failed")
+
+
+def add_areas(areas):
+    """
+    Create risk areas from dicts with latitude, longitude, risk_category and
+    optionally crime_type, radius and risk_score. One version bump covers
+    the whole batch. Returns the API dicts of the new areas.
+    """
+    objs = [RiskArea(
+        latitude=area['latitude'],
+        longitude=area['longitude'],
+        radius=area.get('radius', DEFAULT_RADIUS_KM),
+        risk_score=area.get('risk_score', 0.0),
+        risk_category=area['risk_category'],
+        crime_type=area.get('crime_type', 'unknown'),
+    ) for area in areas]
+    if not objs:
+        return []
+
+    with transaction.atomic():
+        # SQLite and PostgreSQL set the new ids on bulk inserts
+        created = RiskArea.objects.bulk_create(objs)
+        version = _bump_version()
+        new_areas = [area.to_dict() for area in created]
+        RiskAreaChange.objects.bulk_create([RiskAreaChange(
+            version=version,
+            op=RiskAreaChange.ADD,
+            area_id=area.id,
+            latitude=area.latitude,
+            longitude=area.longitude,
+            radius=area.radius,
+            area=area_dict,
+        ) for area, area_dict in zip(created, new_areas)], batch_size=1000)
+        _prune_changes(version)
+
+    def insert_all(index):
+        for area in new_areas:
+            index.insert(dict(area))
+
+    transaction.on_commit(lambda: _apply_locally(version, insert_all))
+    return new_areas
+
+
+def add_area(latitude, longitude, risk_category, crime_type='unknown', radius=DEFAULT_RADIUS_KM, risk_score=0.0):
+    """Create a single risk area and return its API dict."""
+    return add_areas([{
+        'latitude': latitude,
+        'longitude': longitude,
+        'risk_category': risk_category,
+        'crime_type': crime_type,
+        'radius': radius,
+        'risk_score': risk_score,
+    }])[0]
+
+
+def remove_area(area_id):
+    """Delete one risk area. Returns False if it did not exist."""
+    with transaction.atomic():
+        area = RiskArea.objects.filter(id=area_id).first()
+        if area is None:
+            return False
+        area.delete()
+        version = _bump_version()
+        RiskAreaChange.objects.create(
+            version=version,
+            op=RiskAreaChange.REMOVE,
+            area_id=area_id,
+            latitude=area.latitude,
+            longitude=area.longitude,
+            radius=area.radius,
+        )
+        _prune_changes(version)
+
+    transaction.on_commit(lambda: _apply_locally(version, lambda index: index.remove(area_id)))
+    return True
+
+
+def clear_areas():
+    """Delete every risk area. Returns how many were removed."""
+    with transaction.atomic():
+        deleted, _ = RiskArea.objects.all().delete()
+        version = _bump_version()
+        # Nothing before a reset is needed to catch up any more
+        RiskAreaChange.objects.all().delete()
+        RiskAreaChange.objects.create(version=version, op=RiskAreaChange.RESET)
+
+    transaction.on_commit(lambda: _apply_locally(version, lambda index: index.clear()))
+    return deleted
+
+
+def _changelog_versions():
+    return getattr(settings, 'RISK_AREA_CHANGELOG_VERSIONS', 10000)
+
+
+def _prune_changes(version):
+    """Drop changes more than RISK_AREA_CHANGELOG_VERSIONS versions old, every 100 versions."""
+    if version % 100 == 0:
+        RiskAreaChange.objects.filter(version__lte=version - _changelog_versions()).delete()
+
+
+def changes_since(since, sw_lat=None, sw_lng=None, ne_lat=None, ne_lng=None, point=None):
+    """
+    What changed after version `since`, limited to a bounding box or to a
+    (lat, lng, radius_km) point query like query_radius. Returns a dict
+    with the current version and either 'added' areas and 'removed' ids,
+    or 'reset': True when the client must reload everything (the set was
+    cleared, or `since` is older than the changelog or newer than the data).
+    """
+    version = current_version()
+    if since == version:
+        return {'version': version, 'reset': False, 'added': [], 'removed': []}
+    oldest = RiskAreaChange.objects.order_by('version').values_list('version', flat=True).first()
+    if since > version or oldest is None or since < oldest - 1:
+        return {'version': version, 'reset': True}
+
+    changes = RiskAreaChange.objects.filter(version__gt=since, version__lte=version)
+    if changes.filter(op=RiskAreaChange.RESET).exists():
+        return {'version': version, 'reset': True}
+    if point is not None:
+        lat, lng, radius_km = point
+        max_radius = changes.order_by('-radius').values_list('radius', flat=True).first() or 0.0
+        lat_pad = (radius_km + max_radius) / KM_PER_DEGREE
+        lng_pad = lat_pad / max(math.cos(math.radians(min(abs(lat) + lat_pad, 89.9))), 1e-6)
+        sw_lat, sw_lng, ne_lat, ne_lng = lat - lat_pad, lng - lng_pad, lat + lat_pad, lng + lng_pad
+    if sw_lat is not None:
+        changes = changes.filter(latitude__range=(sw_lat, ne_lat), longitude__range=(sw_lng, ne_lng))
+
+    added = {}
+    removed = []
+    for change in changes.order_by('version', 'id'):
+        if point is not None:
+            distance = calculate_distance(lat, lng, change.latitude, change.longitude)
+            if distance > radius_km + change.radius:
+                continue
+        if change.op == RiskAreaChange.ADD:
+            added[change.area_id] = change.area
+        elif added.pop(change.area_id, None) is None:
+            # Only report removals of areas the client could already have
+            removed.append(change.area_id)
+    return {'version': version, 'reset': False, 'added': list(added.values()), 'removed': removed}
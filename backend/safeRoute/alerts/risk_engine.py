@@ -0,0 +1,148 @@
+import numpy as np
+from django.utils import timezone
+from .utils import SEVERE_CRIME_TYPES
+
+EARTH_RADIUS_KM = 6371
+# Kilometers per degree of latitude on the same sphere calculate_distance uses
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized utils.calculate_distance; arguments broadcast like numpy arrays."""
+    dlat = np.radians(np.subtract(lat2, lat1))
+    dlon = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+
+# Upper bound on query points x incidents evaluated in one broadcast
+MAX_PAIRS_PER_CHUNK = 1_000_000
+
+
+class RiskEngine:
+    """
+    Vectorized version of utils.compute_risk_score.
+
+    Incidents are stored as columnar arrays (latitude, longitude, unix
+    timestamp, severity) sorted by latitude, so each query only looks at the
+    latitude band that can possibly be within radius_km, and time decay is
+    evaluated once per batch instead of once per incident. Scores match
+    compute_risk_score up to floating point rounding.
+    """
+
+    def __init__(self, latitudes, longitudes, timestamps, severities):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        order = np.argsort(latitudes, kind='stable')
+        self.latitudes = latitudes[order]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[order]
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+        self.severities = np.asarray(severities, dtype=np.float64)[order]
+
+    @classmethod
+    def from_incidents(cls, incidents):
+        """Build an engine from CrimeIncident instances (or anything shaped like them)."""
+        latitudes, longitudes, timestamps, severities = [], [], [], []
+        for incident in incidents:
+            reported_at = incident.reported_at
+            if timezone.is_naive(reported_at):
+                reported_at = timezone.make_aware(reported_at)
+            latitudes.append(incident.latitude)
+            longitudes.append(incident.longitude)
+            timestamps.append(reported_at.timestamp())
+            severities.append(incident.severity or 1)
+        return cls(latitudes, longitudes, timestamps, severities)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @staticmethod
+    def time_factors(timestamps, now_ts):
+        """Vectorized utils.time_decay, using a single 'now' for every incident."""
+        delta_hours = (now_ts - timestamps) / 3600
+        linear = 1.0 - (0.9 * (delta_hours - 24) / (720 - 24))
+        return np.where(delta_hours <= 24, 1.0, np.where(delta_hours >= 720, 0.1, linear))
+
+    def score(self, user_lat, user_lon, radius_km=1.0, current_crime_type=None, now=None):
+        """Risk score (0-10) for a single location."""
+        return float(self.score_many([user_lat], [user_lon], radius_km, current_crime_type, now)[0])
+
+    def score_many(self, user_lats, user_lons, radius_km=1.0, current_crime_type=None, now=None, grouped=False):
+        """
+        Risk scores (0-10) for many locations in one pass.
+        Returns a numpy array aligned with the input points.
+
+        By default each point only looks at its own neighbourhood. Pass
+        grouped=True when the points are close together (e.g. the cells of
+        one map tile or a short stretch of route) to score them all in one
+        broadcast against the incidents near the group.
+        """
+        user_lats = np.asarray(user_lats, dtype=np.float64)
+        user_lons = np.asarray(user_lons, dtype=np.float64)
+        scores = np.zeros(len(user_lats))
+
+        if current_crime_type and current_crime_type.lower() in SEVERE_CRIME_TYPES:
+            scores[:] = 10.0
+            return scores
+        if len(self) == 0 or len(user_lats) == 0:
+            return scores
+
+        now_ts = (now or timezone.now()).timestamp()
+        if grouped:
+            return self._score_group(user_lats, user_lons, radius_km, now_ts)
+
+        for i in range(len(user_lats)):
+            scores[i] = self._score_group(user_lats[i:i + 1], user_lons[i:i + 1], radius_km, now_ts)[0]
+        return scores
+
+    def _candidates(self, user_lats, user_lons, radius_km):
+        """Indices of incidents that can be within radius_km of any of the points."""
+        # Great-circle distance is never shorter than the latitude difference.
+        # Incidents are sorted by latitude, so the band is a contiguous slice.
+        lat_band = radius_km / KM_PER_DEGREE * (1 + 1e-9) + 1e-9
+        lo = np.searchsorted(self.latitudes, user_lats.min() - lat_band, side='left')
+        hi = np.searchsorted(self.latitudes, user_lats.max() + lat_band, side='right')
+        candidates = np.arange(lo, hi)
+
+        # Drop incidents that are too far east/west before doing any trig.
+        # Within the band d >= 2R*cos(max_lat)*sin(dlon/2), which bounds dlon.
+        max_lat = max(abs(user_lats.min()), abs(user_lats.max())) + lat_band
+        if len(candidates) and max_lat < 89:
+            ratio = radius_km / (2 * EARTH_RADIUS_KM * np.cos(np.radians(max_lat)))
+            if ratio < 1:
+                lon_band = np.degrees(2 * np.arcsin(ratio)) * (1 + 1e-9) + 1e-9
+                longitudes = self.longitudes[lo:hi]
+                mask = (longitudes >= user_lons.min() - lon_band) & (longitudes <= user_lons.max() + lon_band)
+                candidates = candidates[mask]
+        return candidates
+
+    def _score_group(self, user_lats, user_lons, radius_km, now_ts):
+        candidates = self._candidates(user_lats, user_lons, radius_km)
+        if len(candidates) == 0:
+            return np.zeros(len(user_lats))
+
+        # Keep each broadcast to a bounded number of point/incident pairs
+        step = max(1, MAX_PAIRS_PER_CHUNK // len(candidates))
+        if len(user_lats) > step:
+            return np.concatenate([
+                self._score_group(user_lats[i:i + step], user_lons[i:i + step], radius_km, now_ts)
+                for i in range(0, len(user_lats), step)
+            ])
+
+        distance = haversine_km(
+            user_lats[:, None], user_lons[:, None],
+            self.latitudes[candidates], self.longitudes[candidates],
+        )
+
+        # Same distance, time and severity factors as compute_risk_score
+        time_factor = self.time_factors(self.timestamps[candidates], now_ts)
+        severity_factor = self.severities[candidates] / 5.0
+        incident_scores = np.where(
+            distance <= radius_km,
+            np.power(0.001, (distance * 1000) / 100) * (time_factor * severity_factor),
+            0.0,
+        )
+
+        max_score = incident_scores.max(axis=1)
+        total_score = incident_scores.sum(axis=1)
+        final_score = (0.7 * max_score + 0.3 * (total_score / 3)) * 10.0
+        return np.clip(final_score, 0.0, 10.0)
@@ -0,0 +1,194 @@
+"""
+Safety scores for whole routes.
+
+Each route polyline is densified to a sample every `spacing` meters and
+every sample is scored with compute_risk_score semantics. Incidents (or
+incident buckets) are loaded once for all routes, from a corridor of boxes
+padded by the scoring radius around each stretch of route, and consecutive
+samples are scored together against the incidents near them.
+
+Integrated risk is the risk summed along the route (trapezoid rule over
+the samples), in risk x kilometers, so longer exposure counts for more;
+routes are ranked by it, then by their peak.
+"""
+import math
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from . import incident_buckets
+from .geometry import decode_polyline
+from .heatmap import pad_bbox
+from .risk_engine import haversine_km
+
+DEFAULT_SPACING_M = 25
+MIN_SPACING_M = 5
+# Consecutive samples scored together, about a kilometer at the default spacing
+SAMPLES_PER_GROUP = 40
+# Samples per corridor box; smaller boxes hug diagonal routes more tightly
+SAMPLES_PER_BOX = 10
+# An incident this far away scales its score by 0.001 ** 3 = 1e-9, below
+# the precision of the response, so nothing further out is loaded or scored
+NEGLIGIBLE_RISK_KM = 0.3
+RANK_KEYS = ('integrated', 'peak', 'mean')
+
+
+def _max_routes():
+    return getattr(settings, 'ROUTE_MAX_ALTERNATIVES', 10)
+
+
+def _max_samples():
+    return getattr(settings, 'ROUTE_MAX_SAMPLES', 20000)
+
+
+def parse_points(route):
+    """
+    (lat, lng) vertices of one route given as an encoded polyline string,
+    or as a dict with 'polyline' or 'points' ([lat, lng] pairs or
+    {'latitude', 'longitude'} dicts). Raises ValueError.
+    """
+    if isinstance(route, dict):
+        route = route.get('polyline', route.get('points'))
+    if isinstance(route, str):
+        points = decode_polyline(route)
+    elif isinstance(route, list):
+        points = []
+        for point in route:
+            if isinstance(point, dict):
+                point = (point.get('latitude'), point.get('longitude'))
+            if not isinstance(point, (list, tuple)) or len(point) != 2:
+                raise ValueError("Each point must be [lat, lng] or {'latitude', 'longitude'}")
+            try:
+                points.append((float(point[0]), float(point[1])))
+            except (TypeError, ValueError):
+                raise ValueError("Coordinates must be numeric")
+    else:
+        raise ValueError("Each route needs a 'polyline' string or a 'points' list")
+
+    if len(points) < 2:
+        raise ValueError("A route needs at least two points")
+    for lat, lng in points:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or math.isnan(lat) or math.isnan(lng):
+            raise ValueError("Coordinates out of range")
+    return points
+
+
+def densify(points, spacing_km):
+    """
+    Sample a polyline every spacing_km (and at every vertex). Returns
+    (latitudes, longitudes, distance along the route in km, index of the
+    vertex each sample's segment starts at).
+    """
+    lats = np.array([lat for lat, _ in points])
+    lngs = np.array([lng for _, lng in points])
+    lengths = haversine_km(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+    steps = np.maximum(np.ceil(lengths / spacing_km).astype(int), 1)
+
+    segment = np.repeat(np.arange(len(lengths)), steps)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = offsets / steps[segment]
+    # Linear interpolation in degrees is fine at sample spacings of meters
+    sample_lats = np.append(lats[segment] + (lats[segment + 1] - lats[segment]) * fraction, lats[-1])
+    sample_lngs = np.append(lngs[segment] + (lngs[segment + 1] - lngs[segment]) * fraction, lngs[-1])
+    starts = np.concatenate([[0.0], np.cumsum(lengths)])
+    distances = np.append(starts[segment] + lengths[segment] * fraction, starts[-1])
+    return sample_lats, sample_lngs, distances, np.append(segment, len(lengths) - 1)
+
+
+def _groups(count, size=SAMPLES_PER_GROUP):
+    return [slice(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _corridor(sampled, radius_km):
+    """Bounding boxes, padded by radius_km, of each short run of samples of every route."""
+    boxes = []
+    for lats, lngs, _, _ in sampled:
+        for group in _groups(len(lats), SAMPLES_PER_BOX):
+            boxes.append(pad_bbox(lats[group].min(), lngs[group].min(), lats[group].max(), lngs[group].max(), radius_km))
+    return boxes
+
+
+def _summary(lats, lngs, distances, segments, scores, vertex_count, include_segments):
+    # Trapezoid rule between consecutive samples
+    steps = np.diff(distances)
+    step_risk = (scores[:-1] + scores[1:]) / 2 * steps
+    length_km = float(distances[-1])
+    integrated = float(step_risk.sum())
+    peak = int(np.argmax(scores))
+
+    summary = {
+        'length': round(length_km * 1000, 1),
+        'samples': len(scores),
+        'integratedRisk': round(integrated, 4),
+        'meanRisk': round(integrated / length_km, 4) if length_km > 0 else round(float(scores[0]), 4),
+        'peakRisk': round(float(scores[peak]), 4),
+        'peak': {
+            'latitude': round(float(lats[peak]), 6),
+            'longitude': round(float(lngs[peak]), 6),
+            'distance': round(float(distances[peak]) * 1000, 1),
+        },
+    }
+    if include_segments:
+        # Per input segment (vertex i to i + 1): its samples plus the next vertex
+        segment_count = vertex_count - 1
+        lengths = np.bincount(segments[:-1], weights=steps, minlength=segment_count)
+        risk = np.bincount(segments[:-1], weights=step_risk, minlength=segment_count)
+        peaks = np.zeros(segment_count)
+        np.maximum.at(peaks, segments[:-1], np.maximum(scores[:-1], scores[1:]))
+        summary['segments'] = [{
+            'start': index,
+            'end': index + 1,
+            'length': round(float(lengths[index]) * 1000, 1),
+            'meanRisk': round(float(risk[index] / lengths[index]), 4) if lengths[index] > 0 else 0.0,
+            'peakRisk': round(float(peaks[index]), 4),
+        } for index in range(segment_count)]
+    return summary
+
+
+def score_routes(routes, spacing_m=DEFAULT_SPACING_M, radius_km=1.0, rank_by='integrated',
+                 include_segments=True, exact=None, now=None):
+    """
+    Score and rank alternative routes. routes is a list of (id, [(lat, lng),
+    ...]) pairs. Returns a dict with one summary per route, in input order,
+    and 'ranking', the route ids safest first. Raises ValueError for
+    requests that are too large.
+    """
+    if not routes:
+        raise ValueError("No routes given")
+    if len(routes) > _max_routes():
+        raise ValueError(f"At most {_max_routes()} routes per request")
+    if rank_by not in RANK_KEYS:
+        raise ValueError(f"rank_by must be one of {', '.join(RANK_KEYS)}")
+    spacing_m = float(spacing_m)
+    if not math.isfinite(spacing_m):
+        raise ValueError("spacing must be a number of metres")
+    spacing_m = max(spacing_m, MIN_SPACING_M)
+    if not 0 < radius_km <= 5:
+        raise ValueError("radius must be between 0 and 5 km")
+
+    sampled = [densify(points, spacing_m / 1000) for _, points in routes]
+    total = sum(len(lats) for lats, _, _, _ in sampled)
+    if total > _max_samples():
+        raise ValueError(f"Routes need {total} samples at {spacing_m:g} m spacing, the limit is {_max_samples()}")
+
+    reach_km = min(radius_km, NEGLIGIBLE_RISK_KM)
+    engine = incident_buckets.load_engine_for_boxes(_corridor(sampled, reach_km), exact)
+    now = now or timezone.now()
+    summaries = []
+    for (route_id, points), (lats, lngs, distances, segments) in zip(routes, sampled):
+        scores = np.concatenate([
+            engine.score_many(lats[group], lngs[group], reach_km, now=now, grouped=True)
+            for group in _groups(len(lats))
+        ])
+        summaries.append({'id': route_id, **_summary(lats, lngs, distances, segments, scores, len(points), include_segments)})
+
+    key = {'integrated': 'integratedRisk', 'peak': 'peakRisk', 'mean': 'meanRisk'}[rank_by]
+    ranked = sorted(summaries, key=lambda summary: (summary[key], summary['peakRisk'], summary['length']))
+    for rank, summary in enumerate(ranked, 1):
+        summary['rank'] = rank
+    return {
+        'spacing': spacing_m,
+        'radius': radius_km,
+        'rankBy': rank_by,
+        'routes': summaries,
+        'ranking': [summary['id'] for summary in ranked],
+    }
@@ -1,14 +1,14 @@
 from rest_framework import serializers
 from .models import CrimeIncident
-from django.utils import timezone
 
 class CrimeIncidentSerializer(serializers.ModelSerializer):
     class Meta:
         model = CrimeIncident
         fields = ['latitude', 'longitude', 'description', 'reported_at', 'severity']
-    
-    def create(self, validated_data):
-        # If reported_at is not provided, set it to current time
-        if 'reported_at' not in validated_data:
-            validated_data['reported_at'] = timezone.now()
-        return super().create(validated_data) 
\ No newline at end of file
+        # Set by the server when the report arrives
+        read_only_fields = ['reported_at']
+
+class CrimeIncidentImportSerializer(CrimeIncidentSerializer):
+    """For imported logs, which carry the time each incident was reported."""
+    class Meta(CrimeIncidentSerializer.Meta):
+        read_only_fields = []
@@ -0,0 +1,133 @@
+import math
+from itertools import count
+from .utils import calculate_distance
+
+# Kilometers per degree of latitude (same sphere as calculate_distance)
+KM_PER_DEGREE = 6371 * math.pi / 180
+
+
+class GridIndex:
+    """
+    In-memory spatial index for risk areas.
+
+    Areas are bucketed by the grid cell their center falls in, so a bounding
+    box query only has to look at the handful of cells that overlap the
+    viewport instead of every area that has ever been reported.
+    Each stored area gets an integer 'id' that can be used to remove it.
+    """
+
+    def __init__(self, cell_size_deg=0.01):
+        # 0.01 degrees is roughly 1.1 km of latitude
+        self.cell_size = cell_size_deg
+        self._cells = {}
+        self._areas = {}
+        self._ids = count(1)
+        # Largest area radius seen, so radius queries know how far to look
+        self._max_radius = 0.0
+
+    def __len__(self):
+        return len(self._areas)
+
+    def __iter__(self):
+        return iter(list(self._areas.values()))
+
+    def _cell_for(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def get(self, area_id):
+        return self._areas.get(area_id)
+
+    def insert(self, area):
+        """Add an area dict (with a 'center') to the index and return its id."""
+        area_id = area.get('id')
+        if area_id is None:
+            area_id = next(self._ids)
+            area['id'] = area_id
+        elif area_id in self._areas:
+            self.remove(area_id)
+
+        center = area['center']
+        cell = self._cell_for(center['latitude'], center['longitude'])
+        self._cells.setdefault(cell, {})[area_id] = area
+        self._areas[area_id] = area
+        self._max_radius = max(self._max_radius, area.get('radius', 0.0))
+        return area_id
+
+    def remove(self, area_id):
+        """Remove an area by id. Returns the removed area or None."""
+        area = self._areas.pop(area_id, None)
+        if area is None:
+            return None
+
+        center = area['center']
+        cell = self._cell_for(center['latitude'], center['longitude'])
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(area_id, None)
+            if not bucket:
+                del self._cells[cell]
+        return area
+
+    def clear(self):
+        self._cells.clear()
+        self._areas.clear()
+        self._max_radius = 0.0
+
+    def _candidate_cells(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        min_row, min_col = self._cell_for(sw_lat, sw_lng)
+        max_row, max_col = self._cell_for(ne_lat, ne_lng)
+        cell_count = (max_row - min_row + 1) * (max_col - min_col + 1)
+
+        # Zoomed far out the box can cover more cells than are occupied,
+        # in which case walking the occupied cells is cheaper.
+        if cell_count > len(self._cells):
+            for (row, col), bucket in self._cells.items():
+                if min_row <= row <= max_row and min_col <= col <= max_col:
+                    yield bucket
+        else:
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    bucket = self._cells.get((row, col))
+                    if bucket:
+                        yield bucket
+
+    def query_bbox(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        """
+        Return the areas whose center lies inside the bounding box,
+        in the order they were inserted.
+        """
+        if sw_lat > ne_lat or sw_lng > ne_lng:
+            return []
+
+        matches = []
+        for bucket in self._candidate_cells(sw_lat, sw_lng, ne_lat, ne_lng):
+            for area_id, area in bucket.items():
+                center = area['center']
+                if (sw_lat <= center['latitude'] <= ne_lat and
+                        sw_lng <= center['longitude'] <= ne_lng):
+                    matches.append((area_id, area))
+
+        matches.sort(key=lambda item: item[0])
+        return [area for _, area in matches]
+
+    def query_radius(self, lat, lng, radius_km):
+        """
+        Return (distance_km, area) pairs for every area whose circle comes
+        within radius_km of the point, nearest center first.
+        """
+        reach_km = radius_km + self._max_radius
+        lat_pad = reach_km / KM_PER_DEGREE
+        # Within the band, distance >= 2R * cos(max_lat) * sin(dlng / 2)
+        ratio = reach_km / (2 * 6371 * max(math.cos(math.radians(min(abs(lat) + lat_pad, 90.0))), 1e-12))
+        lng_pad = math.degrees(2 * math.asin(ratio)) if ratio < 1 else 180.0
+
+        matches = []
+        for bucket in self._candidate_cells(lat - lat_pad, lng - lng_pad, lat + lat_pad, lng + lng_pad):
+            for area_id, area in bucket.items():
+                center = area['center']
+                distance = calculate_distance(lat, lng, center['latitude'], center['longitude'])
+                if distance <= radius_km + area.get('radius', 0.0):
+                    matches.append((distance, area_id, area))
+
+        matches.sort(key=lambda item: (item[0], item[1]))
+        return [(distance, area) for distance, _, area in matches]
@@ -0,0 +1,157 @@
+"""
+Server-Sent Events stream of risk area changes for a bounding box.
+
+A subscriber first gets a snapshot of the areas in its box, then "add" and
+"remove" events whenever the set changes. Changes made by this process
+wake subscribers immediately through a risk_areas listener; changes made
+by other workers are picked up by re-checking the shared version every
+RISK_STREAM_POLL_SECONDS. Either way the subscriber's box is re-queried
+from the cached index and diffed against the ids it already has, so
+events are always consistent with what the client holds.
+
+A client reconnecting with Last-Event-ID gets the changes since that
+version instead of a new snapshot, as long as the changelog still covers
+them (see risk_areas.changes_since).
+
+Streaming needs an ASGI server (e.g. `uvicorn safeRoute.asgi:application`).
+Under WSGI or runserver a stream would hold a worker thread for up to
+RISK_STREAM_MAX_SECONDS, so the view answers with just the opening events
+and closes; EventSource then reconnects with Last-Event-ID after the retry
+delay, which turns the stream into polling for changes.
+"""
+import asyncio
+import json
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import risk_areas
+
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+
+
+class Subscriber:
+    """Wake-up flag for one stream, settable from any thread."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def wake(self, version=None):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+
+
+def _wake_all(version):
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.wake(version)
+        except RuntimeError:
+            # The subscriber's event loop has closed
+            pass
+
+
+risk_areas.add_listener(_wake_all)
+
+
+def subscriber_count():
+    with _subscribers_lock:
+        return len(_subscribers)
+
+
+def format_event(event, data, event_id=None):
+    """One SSE message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _bbox_state(bbox):
+    """(version, {id: area}) for the box, from the cached index."""
+    version, areas = risk_areas.versioned_bbox(*bbox)
+    return version, {area['id']: area for area in areas}
+
+
+def _change_events(version, added, removed, serialize):
+    events = []
+    if added:
+        events.append(format_event('add', {'version': version, 'areas': [serialize(area) for area in added]}, version))
+    if removed:
+        events.append(format_event('remove', {'version': version, 'ids': removed}, version))
+    return events
+
+
+def opening_events(bbox, serialize=None, last_event_id=None):
+    """
+    (version, {id: area}, messages) a stream starts with: a retry delay,
+    then the changes since last_event_id when the client is reconnecting
+    and the changelog still covers them, otherwise a snapshot.
+    """
+    serialize = serialize or (lambda area: area)
+    poll_seconds = getattr(settings, 'RISK_STREAM_POLL_SECONDS', 2.0)
+    version, known = _bbox_state(bbox)
+    # Tell EventSource how long to wait before reconnecting
+    messages = [f"retry: {int(poll_seconds * 1000)}\n\n"]
+    if last_event_id is not None:
+        delta = risk_areas.changes_since(last_event_id, *bbox)
+        # A change landing between the two reads makes them disagree; start over then
+        if not delta['reset'] and delta['version'] == version:
+            added = [known[area['id']] for area in delta['added'] if area['id'] in known]
+            messages.extend(_change_events(version, added, delta['removed'], serialize))
+            return version, known, messages
+    messages.append(format_event('snapshot', {'version': version, 'areas': [serialize(area) for area in known.values()]},
+                                 version))
+    return version, known, messages
+
+
+async def risk_area_events(bbox, serialize=None, last_event_id=None):
+    """
+    Async generator of SSE messages for a (sw_lat, sw_lng, ne_lat, ne_lng)
+    box. serialize turns an area dict into its event payload. Runs until
+    the client disconnects or RISK_STREAM_MAX_SECONDS pass.
+    """
+    serialize = serialize or (lambda area: area)
+    poll_seconds = getattr(settings, 'RISK_STREAM_POLL_SECONDS', 2.0)
+    heartbeat_seconds = getattr(settings, 'RISK_STREAM_HEARTBEAT_SECONDS', 15.0)
+    max_seconds = getattr(settings, 'RISK_STREAM_MAX_SECONDS', 3600)
+
+    subscriber = Subscriber()
+    with _subscribers_lock:
+        _subscribers.add(subscriber)
+    try:
+        version, known, messages = await sync_to_async(opening_events)(bbox, serialize, last_event_id)
+        for message in messages:
+            yield message
+
+        get_state = sync_to_async(_bbox_state)
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        while loop.time() - started < max_seconds:
+            await subscriber.wait(poll_seconds)
+            new_version, current = await get_state(bbox)
+            if new_version != version:
+                added = [area for area_id, area in current.items() if area_id not in known]
+                removed = [area_id for area_id in known if area_id not in current]
+                version, known = new_version, current
+                for message in _change_events(version, added, removed, serialize):
+                    yield message
+                    last_sent = loop.time()
+
+            if loop.time() - last_sent >= heartbeat_seconds:
+                # Comment line, keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+                last_sent = loop.time()
+    finally:
+        with _subscribers_lock:
+            _subscribers.discard(subscriber)
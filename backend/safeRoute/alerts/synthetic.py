@@ -0,0 +1,200 @@
+"""
+Synthetic incidents, risk areas and devices for capacity planning.
+
+Locations come from a mixture of hotspots around a city center: hotspot
+weights follow a Pareto distribution, so a few hotspots hold most of the
+incidents, each spreads out with its own Gaussian radius, and
+BACKGROUND_FRACTION of the incidents are spread uniformly over the city.
+Report ages are exponential (recent days are busiest) and hours follow
+HOUR_WEIGHTS, which peak in the evening. Descriptions are built from the
+severity keywords, so classify_incident gives them realistic crime types
+and severities.
+
+Everything is generated with numpy in chunks, so scales up to millions of
+rows only need memory for one chunk at a time.
+"""
+import math
+from datetime import timedelta
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from . import incident_buckets, incident_stats, risk_areas
+from .models import CrimeIncident, Device, IncidentBucket, IncidentStat, RiskTile
+from .spatial_index import KM_PER_DEGREE
+from .utils import classify_incident, risk_level_from_severity
+
+# Monroe, LA
+DEFAULT_CENTER = (32.5093, -92.1193)
+BACKGROUND_FRACTION = 0.2
+# Relative frequency of reports per hour of the day, 0-23
+HOUR_WEIGHTS = np.array([6, 5, 4, 3, 2, 2, 2, 3, 4, 4, 5, 5, 6, 6, 6, 6, 7, 8, 9, 10, 11, 11, 10, 8], dtype=float)
+# (description template, relative frequency)
+DESCRIPTIONS = (
+    ("Theft of a bicycle near {place}", 30),
+    ("Car theft reported at {place}", 12),
+    ("Burglary at a residence near {place}", 10),
+    ("Suspicious person loitering around {place}", 20),
+    ("Noise disturbance at {place}", 12),
+    ("Assault reported outside {place}", 8),
+    ("Armed robbery near {place}", 6),
+    ("Vandalism of a parked car at {place}", 8),
+    ("Rape reported near {place}", 1),
+)
+PLACES = ("the library", "the student center", "a parking lot", "the bus stop", "a gas station",
+          "the park", "a convenience store", "the dorms", "a restaurant", "the stadium")
+PLATFORMS = ('ios', 'android')
+
+
+class SyntheticCity:
+    """
+    Reproducible generator of clustered incidents around one city center.
+    seed fixes the hotspots; sample_seed, if given, draws different rows
+    from the same city (e.g. query points for a benchmark).
+    """
+
+    def __init__(self, center=DEFAULT_CENTER, span_km=20.0, hotspots=50, days=365, seed=42, sample_seed=None):
+        self.center = center
+        self.span_km = span_km
+        self.days = max(int(days), 1)
+        self.seed = seed
+        self.km_per_lon_degree = KM_PER_DEGREE * math.cos(math.radians(center[0]))
+
+        rng = np.random.default_rng(seed)
+        hotspots = max(int(hotspots), 1)
+        # Hotspots cluster toward the middle of the city
+        self.hotspot_offsets = rng.normal(0, span_km / 4, size=(hotspots, 2)).clip(-span_km / 2, span_km / 2)
+        self.hotspot_spreads = rng.lognormal(math.log(0.3), 0.6, size=hotspots).clip(0.05, 2.0)
+        weights = rng.pareto(1.2, size=hotspots) + 1
+        self.hotspot_weights = weights / weights.sum()
+        self.rng = rng if sample_seed is None else np.random.default_rng(sample_seed)
+
+        frequencies = np.array([frequency for _, frequency in DESCRIPTIONS], dtype=float)
+        self.description_weights = frequencies / frequencies.sum()
+        self.classified = {}
+
+    def _to_degrees(self, offsets_km):
+        return (self.center[0] + offsets_km[:, 0] / KM_PER_DEGREE,
+                self.center[1] + offsets_km[:, 1] / self.km_per_lon_degree)
+
+    def points(self, count):
+        """(latitudes, longitudes) of count incident locations."""
+        offsets = np.empty((count, 2))
+        background = self.rng.random(count) < BACKGROUND_FRACTION
+        offsets[background] = self.rng.uniform(-self.span_km / 2, self.span_km / 2, size=(background.sum(), 2))
+        clustered = ~background
+        chosen = self.rng.choice(len(self.hotspot_weights), size=clustered.sum(), p=self.hotspot_weights)
+        offsets[clustered] = self.hotspot_offsets[chosen] + self.rng.normal(size=(len(chosen), 2)) * self.hotspot_spreads[chosen, None]
+        return self._to_degrees(offsets)
+
+    def report_times(self, count, now=None):
+        """Report times for count incidents, most of them recent and in the evening."""
+        now = now or timezone.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_offsets = np.minimum(self.rng.exponential(self.days / 4, size=count).astype(int), self.days - 1)
+        seconds = (self.rng.choice(24, size=count, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum()) * 3600
+                   + self.rng.integers(0, 3600, size=count))
+        ages = (now - midnight).total_seconds() - seconds + day_offsets * 86400.0
+        # Times later today than now move to the same hour yesterday
+        ages = np.where(ages < 0, ages + 86400, ages)
+        return [now - timedelta(seconds=float(age)) for age in ages]
+
+    def descriptions(self, count):
+        templates = self.rng.choice(len(DESCRIPTIONS), size=count, p=self.description_weights)
+        places = self.rng.choice(len(PLACES), size=count)
+        return [DESCRIPTIONS[t][0].format(place=PLACES[p]) for t, p in zip(templates, places)]
+
+    def _classify(self, description):
+        # Few distinct descriptions, so classify each once
+        if description not in self.classified:
+            self.classified[description] = classify_incident(description)
+        return self.classified[description]
+
+    def incidents(self, count, now=None):
+        """count unsaved, classified CrimeIncidents."""
+        latitudes, longitudes = self.points(count)
+        incidents = []
+        for lat, lon, reported_at, description in zip(latitudes, longitudes, self.report_times(count, now),
+                                                      self.descriptions(count)):
+            severity, crime_type = self._classify(description)
+            incidents.append(CrimeIncident(latitude=float(lat), longitude=float(lon), description=description,
+                                           reported_at=reported_at, severity=severity, crime_type=crime_type))
+        return incidents
+
+    def risk_areas(self, count):
+        """Dicts for risk_areas.add_areas, placed like incidents."""
+        latitudes, longitudes = self.points(count)
+        areas = []
+        for lat, lon, description in zip(latitudes, longitudes, self.descriptions(count)):
+            severity, crime_type = self._classify(description)
+            areas.append({'latitude': float(lat), 'longitude': float(lon), 'crime_type': crime_type,
+                          'risk_category': risk_level_from_severity(severity)})
+        return areas
+
+    def push_token(self, number):
+        return f"ExponentPushToken[synthetic-{self.seed}-{number}]"
+
+    def devices(self, count, start=0):
+        """count unsaved Devices, each last seen somewhere in the city."""
+        latitudes, longitudes = self.points(count)
+        devices = []
+        for number, (lat, lon) in enumerate(zip(latitudes, longitudes), start):
+            device = Device(push_token=self.push_token(number),
+                            device_id=f"synthetic-{number}", platform=PLATFORMS[number % 2])
+            device.set_location(float(lat), float(lon))
+            devices.append(device)
+        return devices
+
+
+def clear():
+    """Delete every incident, risk area, device and derived row."""
+    with transaction.atomic():
+        CrimeIncident.objects.all().delete()
+        IncidentBucket.objects.all().delete()
+        IncidentStat.objects.all().delete()
+        RiskTile.objects.all().delete()
+        Device.objects.all().delete()
+    # Bumps the version, so cached indexes and responses are dropped too
+    risk_areas.clear_areas()
+    incident_stats.rebuild()
+
+
+def next_device_number(city):
+    """The first device number whose push token no earlier run with the city's seed has used."""
+    prefix = city.push_token('')[:-1]
+    tokens = Device.objects.filter(push_token__startswith=prefix).values_list('push_token', flat=True)
+    numbers = [int(token[len(prefix):-1]) for token in tokens if token[len(prefix):-1].isdigit()]
+    return max(numbers) + 1 if numbers else 0
+
+
+def populate(city, incidents=0, areas=0, devices=0, chunk_size=10000, derived=True, progress=None):
+    """
+    Insert synthetic rows in chunks. derived rebuilds the incident buckets
+    and statistics afterwards (heatmap tiles are left to build_risk_tiles).
+    progress(kind, done, total) is called after every chunk. Devices are
+    numbered after those of earlier runs, so populating twice without
+    clear() adds more instead of clashing on push_token.
+    """
+    # Decided before anything is inserted
+    first_device = next_device_number(city) if devices else 0
+    for kind, total, insert in (
+        ('incidents', incidents, lambda n: CrimeIncident.objects.bulk_create(city.incidents(n), batch_size=n)),
+        ('risk areas', areas, lambda n: risk_areas.add_areas(city.risk_areas(n))),
+        ('devices', devices, None),
+    ):
+        done = 0
+        while done < total:
+            size = min(chunk_size, total - done)
+            with transaction.atomic():
+                if insert is None:
+                    Device.objects.bulk_create(city.devices(size, start=first_device + done), batch_size=size)
+                else:
+                    insert(size)
+            done += size
+            if progress:
+                progress(kind, done, total)
+
+    if derived and incidents:
+        incident_buckets.rebuild()
+        incident_stats.rebuild()
+        if progress:
+            progress('summaries', 1, 1)
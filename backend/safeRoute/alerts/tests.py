@@ -1,3 +1,1158 @@
-from django.test import TestCase
+import asyncio
+import logging
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import transaction
+from django.test import AsyncClient, LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.utils import timezone
 
-# Create your tests here.
+from . import (chatgpt_cleaner, devices, extraction_cache, geohash, heatmap, incident_buckets, incident_stats,
+               ingest, loadtest, metrics, notifications, risk_areas, routes, synthetic, views)
+from .geometry import GEOMETRY_ENCODINGS, decode_polyline, encode_polyline
+from .management.commands import process_crime
+from .management.commands.bench_push import FakeExpoHandler, start_fake_expo_server
+from .management.commands.extraction_stub_server import StubHandler
+from .middleware import MetricsMiddleware
+from .models import CrimeIncident, Device, IncidentBucket, IncidentStat, RiskArea, RiskTile
+from .risk_engine import RiskEngine
+from .spatial_index import KM_PER_DEGREE
+from .synthetic import SyntheticCity
+from .utils import calculate_distance, compute_risk_score
+
+
+class RiskEngineTests(TestCase):
+    def setUp(self):
+        # Small city so most points have incidents within a kilometre
+        self.city = SyntheticCity(span_km=3.0, hotspots=5, days=60, seed=7)
+        self.incidents = self.city.incidents(2000)
+        self.engine = RiskEngine.from_incidents(self.incidents)
+
+    def test_matches_compute_risk_score(self):
+        latitudes, longitudes = self.city.points(50)
+        scores = self.engine.score_many(latitudes, longitudes)
+        for lat, lon, score in zip(latitudes, longitudes, scores):
+            expected = compute_risk_score(self.incidents, float(lat), float(lon))
+            self.assertAlmostEqual(float(score), expected, places=5)
+        self.assertTrue(any(score > 0 for score in scores))
+
+    def test_severe_crime_type_is_maximum_risk(self):
+        lat, lon = self.city.center
+        self.assertEqual(self.engine.score(lat, lon, current_crime_type='robbery'),
+                         compute_risk_score(self.incidents, lat, lon, current_crime_type='robbery'))
+
+    def test_empty_engine_scores_zero(self):
+        self.assertEqual(RiskEngine([], [], [], []).score(32.5, -92.1), 0.0)
+
+
+REPORT = "At 2024-04-12 14:30 a robbery was reported at 32.5293, -92.0745 near the campus."
+
+
+class OfflineExtractionTests(TestCase):
+    def setUp(self):
+        # Nothing written to the on-disk extraction cache
+        patcher = mock.patch.object(chatgpt_cleaner, 'EXTRACTION_CACHE_PATH', '')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_backend(self, backend):
+        patcher = mock.patch.object(chatgpt_cleaner, '_extractor', chatgpt_cleaner.create_extractor(backend))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rules_backend_never_connects(self):
+        self.use_backend('rules')
+        with mock.patch('socket.socket.connect', side_effect=OSError("network disabled")):
+            data = chatgpt_cleaner.extract(REPORT, use_local=False)
+        self.assertEqual(data['extraction_path'], 'local')
+        self.assertEqual((data['latitude'], data['longitude']), (32.5293, -92.0745))
+        self.assertEqual(data['crime_type'], 'robbery')
+        self.assertEqual(data['date'], '2024-04-12T14:30:00')
+
+    def test_rules_backend_needs_no_api_key(self):
+        with mock.patch.dict(os.environ, {'GEMINI_API_KEY': ''}):
+            self.assertFalse(chatgpt_cleaner.create_extractor('rules').remote)
+            with self.assertRaises(ValueError):
+                chatgpt_cleaner.create_extractor('gemini')
+
+    def test_stub_backend_answers_like_gemini(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with self.settings(EXTRACTION_STUB_URL=f"http://127.0.0.1:{server.server_address[1]}/"):
+            self.use_backend('stub')
+        data = chatgpt_cleaner.extract(REPORT, use_local=False)
+        self.assertEqual(data['extraction_path'], 'remote')
+        local = chatgpt_cleaner.extract_locally(REPORT)
+        for key in ('latitude', 'longitude', 'crime_type', 'date'):
+            self.assertEqual(data[key], local[key])
+
+
+class ProcessCrimeTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(chatgpt_cleaner, 'EXTRACTION_CACHE_PATH', '')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(chatgpt_cleaner, '_extractor', chatgpt_cleaner.create_extractor('rules'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_expand_sources(self):
+        first = self.write('a.txt', REPORT)
+        second = self.write('b.txt', REPORT)
+        os.mkdir(os.path.join(self.directory, 'nested'))
+        # The directory, a glob and another spelling of a.txt all name the same files
+        sources = process_crime.expand_sources([
+            self.directory, os.path.join(self.directory, '*.txt'), os.path.join(self.directory, '.', 'a.txt'),
+            'https://example.com/report', 'https://example.com/report',
+        ])
+        self.assertEqual(sources, [('file', first), ('file', second), ('url', 'https://example.com/report')])
+        self.assertEqual(process_crime.expand_sources(['report.txt'], force_url=True), [('url', 'report.txt')])
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = process_crime.RateLimiter(50)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 50 - 0.005)
+
+        unlimited = process_crime.RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(100):
+            unlimited.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_output_and_save(self):
+        now = timezone.localtime()
+        self.write('dated.txt', f"At {now:%Y-%m-%d %H:%M} a robbery was reported at 32.5293, -92.0745 near the campus.")
+        self.write('undated.txt', "A robbery was reported at 32.5101, -92.0801 near the mall.")
+        self.write('nowhere.txt', "Nothing happened today.")
+        output = os.path.join(self.directory, 'results.ndjson')
+
+        with mock.patch.object(notifications, 'notify_incidents', return_value=0) as notify:
+            call_command('process_crime', os.path.join(self.directory, '*.txt'), '--output', output, '--save',
+                         stdout=StringIO(), stderr=StringIO())
+
+        with open(output) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(sorted(os.path.basename(result['source']) for result in results),
+                         ['dated.txt', 'nowhere.txt', 'undated.txt'])
+        self.assertEqual(CrimeIncident.objects.count(), 2)
+        dated = CrimeIncident.objects.get(latitude=32.5293)
+        self.assertEqual((dated.crime_type, dated.severity), ('robbery', 4))
+        self.assertEqual(dated.reported_at, now.replace(second=0, microsecond=0))
+        # Only the dated report can alert; the undated one is history of unknown age
+        notify.assert_called_once()
+        self.assertEqual([incident.id for incident in notify.call_args[0][0]], [dated.id])
+
+
+class RiskAreaTestCase(TestCase):
+    """
+    Starts every test with empty response and index caches. Rolled back
+    tests reuse version numbers, and on_commit never runs inside a test,
+    so the index re-checks the version on every read.
+    """
+    BOUNDS = {'sw_lat': 32.4, 'sw_lng': -92.2, 'ne_lat': 32.6, 'ne_lng': -92.0}
+
+    def setUp(self):
+        cache.clear()
+        risk_areas._cache.update(index=None, version=None, checked_at=0.0)
+        override = self.settings(RISK_AREA_VERSION_CHECK_SECONDS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_map(self, **params):
+        headers = {}
+        if 'etag' in params:
+            headers['HTTP_IF_NONE_MATCH'] = params.pop('etag')
+        return self.client.get('/api/map-risk-areas/', {**self.BOUNDS, 'geometry': 'none', **params}, **headers)
+
+
+class RiskAreaDeltaTests(RiskAreaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = risk_areas.add_area(32.5, -92.1, 'B', 'theft')
+        self.version = self.get_map().json()['version']
+
+    def test_since_returns_only_changes(self):
+        second = risk_areas.add_area(32.51, -92.11, 'A', 'robbery')
+        risk_areas.remove_area(self.first['id'])
+        # Outside the bounds
+        risk_areas.add_area(35.0, -90.0, 'C')
+
+        response = self.get_map(since=self.version)
+        self.assertEqual(response.status_code, 200)
+        delta = response.json()
+        self.assertFalse(delta['reset'])
+        self.assertEqual(delta['version'], self.version + 3)
+        self.assertEqual([area['id'] for area in delta['added']], [second['id']])
+        self.assertEqual(delta['removed'], [self.first['id']])
+
+    def test_since_current_version_is_empty(self):
+        delta = self.get_map(since=self.version).json()
+        self.assertEqual((delta['added'], delta['removed'], delta['reset']), ([], [], False))
+
+    def test_radius_delta(self):
+        second = risk_areas.add_area(32.501, -92.1, 'A')
+        delta = self.client.get('/api/risk/', {'lat': 32.5, 'lon': -92.1, 'radius': 1, 'since': self.version}).json()
+        self.assertEqual([area['id'] for area in delta['added']], [second['id']])
+
+    def test_etag_not_modified(self):
+        response = self.get_map()
+        etag = response['ETag']
+        self.assertEqual(self.get_map(etag=etag).status_code, 304)
+        self.assertEqual(self.get_map(since=self.version, etag=etag).status_code, 304)
+
+        risk_areas.add_area(32.52, -92.12, 'C')
+        response = self.get_map(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_reset_after_clear(self):
+        risk_areas.clear_areas()
+        second = risk_areas.add_area(32.51, -92.11, 'A')
+        data = self.get_map(since=self.version).json()
+        self.assertTrue(data['reset'])
+        self.assertEqual([area['id'] for area in data['areas']], [second['id']])
+
+    def test_reset_for_unknown_version(self):
+        data = self.get_map(since=self.version + 10).json()
+        self.assertTrue(data['reset'])
+        self.assertEqual([area['id'] for area in data['areas']], [self.first['id']])
+
+    def test_malformed_since(self):
+        self.assertEqual(self.get_map(since='yesterday').status_code, 400)
+
+
+class RiskAreaVersionTests(RiskAreaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = risk_areas.add_area(32.5, -92.1, 'B', 'theft')
+        self.bbox = (32.4, -92.2, 32.6, -92.0)
+
+    def ids(self):
+        return [area['id'] for area in risk_areas.query_bbox(*self.bbox)]
+
+    def change_elsewhere(self):
+        """Add an area the way another worker would: this process's index is not told."""
+        with transaction.atomic():
+            area = RiskArea.objects.create(latitude=32.51, longitude=-92.11, radius=0.2, risk_category='A')
+            risk_areas._bump_version()
+        return area
+
+    def test_change_by_another_worker_reloads(self):
+        self.assertEqual(self.ids(), [self.first['id']])
+        other = self.change_elsewhere()
+        self.assertEqual(self.ids(), [self.first['id'], other.id])
+        self.assertEqual(risk_areas.get_versioned_index()[1], risk_areas.current_version())
+
+    def test_version_rechecked_after_interval(self):
+        clock = [1000.0]
+        with self.settings(RISK_AREA_VERSION_CHECK_SECONDS=60), \
+                mock.patch.object(risk_areas.time, 'monotonic', lambda: clock[0]):
+            self.assertEqual(self.ids(), [self.first['id']])
+            other = self.change_elsewhere()
+            clock[0] += 59
+            self.assertEqual(self.ids(), [self.first['id']])
+            clock[0] += 2
+            self.assertEqual(self.ids(), [self.first['id'], other.id])
+
+    def test_own_change_updates_index_in_place(self):
+        self.ids()
+        versions = []
+        risk_areas.add_listener(versions.append)
+        self.addCleanup(risk_areas.remove_listener, versions.append)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = risk_areas.add_area(32.52, -92.12, 'A')
+        with mock.patch.object(risk_areas, '_load_index', side_effect=AssertionError("reloaded")):
+            self.assertEqual(self.ids(), [self.first['id'], second['id']])
+            with self.captureOnCommitCallbacks(execute=True):
+                risk_areas.remove_area(self.first['id'])
+            self.assertEqual(self.ids(), [second['id']])
+        self.assertEqual(versions, [risk_areas.current_version() - 1, risk_areas.current_version()])
+
+    def test_own_change_after_missed_one_drops_index(self):
+        self.ids()
+        other = self.change_elsewhere()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = risk_areas.add_area(32.52, -92.12, 'A')
+        self.assertIsNone(risk_areas._cache['index'])
+        self.assertEqual(self.ids(), [self.first['id'], other.id, second['id']])
+
+
+class RiskAreaStreamTests(RiskAreaTestCase):
+    URL = '/api/map-risk-areas/stream/'
+
+    def setUp(self):
+        super().setUp()
+        self.first = risk_areas.add_area(32.5, -92.1, 'B', 'theft')
+        self.version = risk_areas.current_version()
+
+    def get_stream(self, **headers):
+        return self.client.get(self.URL, self.BOUNDS, **headers)
+
+    def test_wsgi_sends_snapshot_and_closes(self):
+        response = self.get_stream()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertIn(f'id: {self.version}\nevent: snapshot\n', body)
+        self.assertIn(f'"id":{self.first["id"]}', body)
+
+    def test_last_event_id_sends_changes(self):
+        second = risk_areas.add_area(32.51, -92.11, 'A', 'robbery')
+        risk_areas.remove_area(self.first['id'])
+        body = self.get_stream(HTTP_LAST_EVENT_ID=str(self.version)).content.decode()
+        self.assertNotIn('event: snapshot', body)
+        self.assertIn('event: add', body)
+        self.assertIn(f'"id":{second["id"]}', body)
+        self.assertIn(f'event: remove\ndata: {{"version":{self.version + 2},"ids":[{self.first["id"]}]}}', body)
+
+    def test_current_last_event_id_sends_nothing(self):
+        body = self.get_stream(HTTP_LAST_EVENT_ID=str(self.version)).content.decode()
+        self.assertNotIn('event:', body)
+
+    def test_unusable_last_event_id_sends_snapshot(self):
+        for last_event_id in (str(self.version + 10), 'abc'):
+            body = self.get_stream(HTTP_LAST_EVENT_ID=last_event_id).content.decode()
+            self.assertIn('event: snapshot', body)
+
+    def test_rejects_bad_bounds(self):
+        self.assertEqual(self.client.get(self.URL, {'sw_lat': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {**self.BOUNDS, 'geometry': 'svg'}).status_code, 400)
+
+    async def test_asgi_streams_changes(self):
+        with self.settings(RISK_STREAM_POLL_SECONDS=0.05):
+            response = await AsyncClient().get(self.URL, self.BOUNDS)
+            self.assertTrue(response.streaming)
+            events = aiter(response.streaming_content)
+            try:
+                self.assertTrue((await anext(events)).startswith(b'retry: '))
+                self.assertIn(b'event: snapshot', await anext(events))
+
+                second = await sync_to_async(risk_areas.add_area)(32.51, -92.11, 'A', 'robbery')
+                message = (await asyncio.wait_for(anext(events), 5)).decode()
+                self.assertIn('event: add', message)
+                self.assertIn(f'"id":{second["id"]}', message)
+
+                await sync_to_async(risk_areas.remove_area)(self.first['id'])
+                message = (await asyncio.wait_for(anext(events), 5)).decode()
+                self.assertIn(f'"ids":[{self.first["id"]}]', message)
+            finally:
+                await events.aclose()
+
+
+class GeometryEncodingTests(RiskAreaTestCase):
+    def test_polyline_round_trip(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        # Google's reference example
+        self.assertEqual(encode_polyline(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), points)
+        self.assertEqual(decode_polyline(encode_polyline([(0.0, 0.0), (-0.00001, 179.99999)])),
+                         [(0.0, 0.0), (-0.00001, 179.99999)])
+        self.assertEqual(decode_polyline(''), [])
+        for malformed in ('_p~iF', '_p~iF~ps|U_', ' '):
+            with self.assertRaises(ValueError):
+                decode_polyline(malformed)
+
+    def test_encodings_describe_the_same_circle(self):
+        risk_areas.add_area(32.5, -92.1, 'B', 'theft', radius=0.3)
+        areas = {encoding: self.get_map(geometry=encoding).json()['areas'][0] for encoding in GEOMETRY_ENCODINGS}
+        points = [(point['latitude'], point['longitude']) for point in areas['points']['coordinates']]
+        self.assertEqual(len(points), 36)
+
+        decoded = decode_polyline(areas['polyline']['coordinates'])
+        flat = areas['flat']['coordinates']
+        self.assertEqual(len(decoded), len(points))
+        self.assertEqual(len(flat), 2 * len(points))
+        for (lat, lng), (poly_lat, poly_lng), flat_lat, flat_lng in zip(points, decoded, flat[::2], flat[1::2]):
+            self.assertAlmostEqual(poly_lat, lat, delta=1e-5)
+            self.assertAlmostEqual(poly_lng, lng, delta=1e-5)
+            self.assertAlmostEqual(flat_lat, lat, places=6)
+            self.assertAlmostEqual(flat_lng, lng, places=6)
+        self.assertNotIn('coordinates', areas['none'])
+        for area in areas.values():
+            self.assertEqual((area['center'], area['radius']), (areas['points']['center'], 0.3))
+
+    def test_rejects_unknown_encoding(self):
+        self.assertEqual(self.get_map(geometry='svg').status_code, 400)
+
+
+class ResponseCacheTests(RiskAreaTestCase):
+    def setUp(self):
+        super().setUp()
+        city = SyntheticCity(center=(32.5, -92.1), span_km=15.0, hotspots=5, seed=3)
+        risk_areas.add_areas(city.risk_areas(300))
+
+    def test_map_hit_matches_uncached(self):
+        viewports = [
+            {'sw_lat': 32.45, 'sw_lng': -92.15, 'ne_lat': 32.55, 'ne_lng': -92.05},
+            {'sw_lat': 32.451, 'sw_lng': -92.149, 'ne_lat': 32.549, 'ne_lng': -92.051},
+        ]
+        miss = self.get_map(**viewports[0], geometry='polyline')
+        self.assertEqual(miss['X-Cache'], 'MISS')
+        hit = self.get_map(**viewports[1], geometry='polyline')
+        self.assertEqual(hit['X-Cache'], 'HIT')
+
+        cache.clear()
+        uncached = self.get_map(**viewports[1], geometry='polyline')
+        self.assertEqual(uncached['X-Cache'], 'MISS')
+        self.assertEqual(hit.json(), uncached.json())
+        self.assertTrue(hit.json()['areas'])
+
+    def test_radius_hit_matches_uncached(self):
+        params = {'lat': 32.5003, 'lon': -92.1004, 'radius': 1}
+        self.assertEqual(self.client.get('/api/risk/', {**params, 'lat': 32.5001})['X-Cache'], 'MISS')
+        hit = self.client.get('/api/risk/', params)
+        self.assertEqual(hit['X-Cache'], 'HIT')
+
+        expected = [area for _, area in risk_areas.query_radius(32.5003, -92.1004, 1)]
+        self.assertEqual(hit.json()['risk_areas'], expected)
+        self.assertTrue(expected)
+
+    def test_write_invalidates(self):
+        self.get_map()
+        self.assertEqual(self.get_map()['X-Cache'], 'HIT')
+
+        area = risk_areas.add_area(32.5, -92.1, 'A')
+        response = self.get_map()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(area['id'], [item['id'] for item in response.json()['areas']])
+
+        risk_areas.remove_area(area['id'])
+        response = self.get_map()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotIn(area['id'], [item['id'] for item in response.json()['areas']])
+
+
+class IncidentBucketTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = SyntheticCity(span_km=5.0, hotspots=5, days=90, seed=11)
+        synthetic.populate(cls.city, incidents=3000)
+
+    def score_differences(self, count=100):
+        latitudes, longitudes = SyntheticCity(span_km=5.0, hotspots=5, days=90, seed=11, sample_seed=1).points(count)
+        return [
+            abs(incident_buckets.risk_score(lat, lon, exact=True) - incident_buckets.risk_score(lat, lon, exact=False))
+            for lat, lon in zip(latitudes.tolist(), longitudes.tolist())
+        ]
+
+    def test_buckets_are_the_default(self):
+        self.assertFalse(incident_buckets._exact_default())
+
+    def test_bucket_scores_close_to_exact(self):
+        differences = self.score_differences()
+        self.assertLess(max(differences), 0.01)
+        self.assertLess(sum(differences) / len(differences), 0.001)
+
+    def test_route_scores_close_to_exact(self):
+        latitudes, longitudes = SyntheticCity(span_km=5.0, hotspots=5, days=90, seed=11, sample_seed=2).points(10)
+        points = list(zip(latitudes.tolist(), longitudes.tolist()))
+        now = timezone.now()
+        exact, buckets = (routes.score_routes([('a', points)], exact=mode, now=now)['routes'][0] for mode in (True, False))
+        self.assertAlmostEqual(exact['peakRisk'], buckets['peakRisk'], delta=0.01)
+        self.assertAlmostEqual(exact['meanRisk'], buckets['meanRisk'], delta=0.001)
+
+    def test_repeated_addresses_keep_bucket_count_flat(self):
+        CrimeIncident.objects.all().delete()
+        addresses = list(zip(*(values.tolist() for values in self.city.points(30))))
+        now = timezone.now()
+        for days in range(0, 365, 5):
+            ingest.ingest_incidents([
+                CrimeIncident(latitude=lat, longitude=lon, description="Theft: x", reported_at=now - timedelta(days=days))
+                for lat, lon in addresses
+            ])
+        incident_buckets.compact()
+        # One archive bucket per address plus the days not archived yet
+        self.assertLessEqual(IncidentBucket.objects.count(), len(addresses) * (incident_buckets.DECAY_DAYS // 5 + 2))
+        for lat, lon in addresses[:10]:
+            self.assertAlmostEqual(incident_buckets.risk_score(lat, lon, exact=True),
+                                   incident_buckets.risk_score(lat, lon, exact=False), places=3)
+
+    def test_one_incident_per_bucket_is_exact(self):
+        CrimeIncident.objects.all().delete()
+        now = timezone.now()
+        for index in range(20):
+            CrimeIncident.objects.create(latitude=32.5 + index * 0.001, longitude=-92.1, description="Theft: x",
+                                         reported_at=now - timedelta(days=index * 3))
+        for index in range(20):
+            lat = 32.5 + index * 0.001 + 0.0002
+            self.assertAlmostEqual(incident_buckets.risk_score(lat, -92.1, exact=True),
+                                   incident_buckets.risk_score(lat, -92.1, exact=False), places=6)
+
+    def summaries(self):
+        buckets = sorted(
+            (b.cell_lat, b.cell_lon, b.day, b.count, round(b.latitude_sum, 6), round(b.longitude_sum, 6),
+             b.severity_sum, round(b.severity_time_sum))
+            for b in IncidentBucket.objects.all()
+        )
+        stats = sorted(IncidentStat.objects.values_list('cell_lat', 'cell_lon', 'day', 'crime_type', 'severity', 'count'))
+        return buckets, stats
+
+    def test_edits_and_deletes_keep_summaries_in_step(self):
+        incident_buckets.compact()
+        ids = list(CrimeIncident.objects.order_by('id').values_list('id', flat=True)[:40])
+
+        moved = CrimeIncident.objects.get(id=ids[0])
+        moved.latitude += 0.01
+        moved.save()
+        upgraded = CrimeIncident.objects.get(id=ids[1])
+        upgraded.severity = 5
+        upgraded.crime_type = 'assault'
+        upgraded.save(update_fields=['severity', 'crime_type'])
+        CrimeIncident.objects.get(id=ids[2]).delete()
+        CrimeIncident.objects.filter(id__in=ids[3:40]).delete()
+        incremental = self.summaries()
+
+        incident_buckets.rebuild()
+        incident_stats.rebuild()
+        incident_buckets.compact()
+        self.assertEqual(incremental, self.summaries())
+
+    def test_deleting_everything_empties_summaries(self):
+        CrimeIncident.objects.all().delete()
+        self.assertFalse(IncidentBucket.objects.exists())
+        self.assertFalse(IncidentStat.objects.exists())
+
+
+class BulkReportTests(TestCase):
+    URL = '/api/report-crime/bulk/'
+
+    def post(self, data, content_type='application/json'):
+        return self.client.post(self.URL, data, content_type=content_type)
+
+    def test_mixed_batch_reports_each_item(self):
+        response = self.post([
+            {'latitude': 32.5, 'longitude': -92.1, 'description': 'Robbery: at the station'},
+            {'latitude': 'north', 'longitude': -92.1, 'description': 'Theft: bike'},
+            {'longitude': -92.1, 'description': 'Theft: bike'},
+            {'latitude': 32.51, 'longitude': -92.11, 'description': 'Theft: bike', 'severity': 2,
+             'reported_at': '2024-01-02T03:04:05Z'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 2))
+        self.assertEqual([item['status'] for item in data['results']], ['created', 'invalid', 'invalid', 'created'])
+        self.assertIn('latitude', data['results'][1]['errors'])
+        self.assertIn('latitude', data['results'][2]['errors'])
+
+        robbery = CrimeIncident.objects.get(id=data['results'][0]['id'])
+        self.assertEqual((robbery.severity, robbery.crime_type), (4, 'robbery'))
+        self.assertEqual(data['results'][0]['risk_level'], 'A')
+        # Imported logs keep their report times
+        theft = CrimeIncident.objects.get(id=data['results'][3]['id'])
+        self.assertEqual(theft.reported_at.isoformat(), '2024-01-02T03:04:05+00:00')
+
+    def test_ndjson(self):
+        body = '{"latitude": 32.5, "longitude": -92.1, "description": "Theft: a"}\n\n' \
+               '{"latitude": 32.6, "longitude": -92.2, "description": "Theft: b"}\n'
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+
+    def test_malformed_ndjson(self):
+        response = self.post('{"latitude": 32.5}\n{not json\n', 'application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 2', response.json()['error'])
+        self.assertFalse(CrimeIncident.objects.exists())
+
+    def test_rejects_non_list(self):
+        response = self.post({'latitude': 32.5, 'longitude': -92.1, 'description': 'Theft: a'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_oversized_batch(self):
+        with mock.patch.object(views.BulkReportCrimeAPIView, 'MAX_ITEMS', 2):
+            response = self.post([{'latitude': 32.5, 'longitude': -92.1, 'description': 'Theft: a'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CrimeIncident.objects.exists())
+
+    def test_all_invalid(self):
+        response = self.post([{'description': 'Theft: a'}, {}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.json()['created'], response.json()['failed']), (0, 2))
+        self.assertFalse(CrimeIncident.objects.exists())
+
+
+class RouteSafetyValidationTests(TestCase):
+    URL = '/api/route-safety/'
+    ROUTE = {'id': 'a', 'points': [[32.5, -92.1], [32.51, -92.1]]}
+
+    def post(self, data):
+        return self.client.post(self.URL, data, content_type='application/json')
+
+    def assertRejected(self, data, message=None):
+        response = self.post(data)
+        self.assertEqual(response.status_code, 400, response.content)
+        if message:
+            self.assertIn(message, response.json()['error'])
+
+    def test_valid_request(self):
+        CrimeIncident.objects.create(latitude=32.505, longitude=-92.1, description="Robbery: x")
+        response = self.post({'routes': [self.ROUTE, {'id': 'b', 'points': [[32.5, -92.12], [32.51, -92.12]]}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ranking'], ['b', 'a'])
+
+    def test_rejects_malformed_bodies(self):
+        self.assertRejected([self.ROUTE], "'routes' list")
+        self.assertRejected({'routes': self.ROUTE}, "'routes' list")
+        self.assertRejected({'routes': []}, "No routes")
+        response = self.client.post(self.URL, '{"routes": [', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_bad_points(self):
+        self.assertRejected({'routes': [{'id': 'a'}]}, "'polyline' string or a 'points' list")
+        self.assertRejected({'routes': [{'points': [[32.5, -92.1]]}]}, "at least two points")
+        self.assertRejected({'routes': [{'points': [[32.5, -92.1], [32.5]]}]}, "[lat, lng]")
+        self.assertRejected({'routes': [{'points': [[32.5, -92.1], ['x', -92.1]]}]}, "numeric")
+        self.assertRejected({'routes': [{'points': [[32.5, -92.1], [95, -92.1]]}]}, "out of range")
+        self.assertRejected({'routes': [{'points': [[32.5, -92.1], ['nan', -92.1]]}]}, "out of range")
+
+    def test_rejects_bad_options(self):
+        self.assertRejected({'routes': [self.ROUTE], 'rankBy': 'shortest'}, "rank_by")
+        self.assertRejected({'routes': [self.ROUTE], 'radius': 10}, "radius")
+        self.assertRejected({'routes': [self.ROUTE], 'radius': 'far'})
+        self.assertRejected({'routes': [self.ROUTE], 'spacing': 'wide'})
+        self.assertRejected({'routes': [self.ROUTE], 'spacing': 'nan'}, "spacing")
+        self.assertRejected({'routes': [self.ROUTE], 'spacing': 'inf'}, "spacing")
+
+    def test_rejects_oversized_requests(self):
+        with self.settings(ROUTE_MAX_ALTERNATIVES=1):
+            self.assertRejected({'routes': [self.ROUTE, self.ROUTE]}, "At most 1 routes")
+        with self.settings(ROUTE_MAX_SAMPLES=10):
+            self.assertRejected({'routes': [self.ROUTE]}, "samples")
+
+
+class MetricsTests(TestCase):
+    def test_render(self):
+        counter = metrics.Counter('test_render_total', "Test counter.", ('kind',))
+        histogram = metrics.Histogram('test_render_seconds', "Test histogram.", ('kind',), buckets=(0.1, 1.0))
+        try:
+            counter.inc('a "quoted"\nvalue', amount=2)
+            histogram.observe(0.5, 'a')
+            histogram.observe(5, 'a')
+            text = metrics.render()
+        finally:
+            metrics._registry.remove(counter)
+            metrics._registry.remove(histogram)
+        self.assertIn('# TYPE test_render_total counter', text)
+        self.assertIn('test_render_total{kind="a \\"quoted\\"\\nvalue"} 2', text)
+        self.assertIn('test_render_seconds_bucket{kind="a",le="0.1"} 0', text)
+        self.assertIn('test_render_seconds_bucket{kind="a",le="1"} 1', text)
+        self.assertIn('test_render_seconds_bucket{kind="a",le="+Inf"} 2', text)
+        self.assertIn('test_render_seconds_sum{kind="a"} 5.5', text)
+        self.assertIn('test_render_seconds_count{kind="a"} 2', text)
+
+    def test_timed(self):
+        @metrics.timed('tests.fails_on_negative')
+        def fails_on_negative(value):
+            if value < 0:
+                raise ValueError(value)
+            return value
+
+        self.assertEqual(fails_on_negative(1), 1)
+        with self.assertRaises(ValueError):
+            fails_on_negative(-1)
+        self.assertEqual(metrics.FUNCTION_DURATION.count('tests.fails_on_negative'), 2)
+        self.assertEqual(metrics.FUNCTION_ERRORS.value('tests.fails_on_negative'), 1)
+
+    def test_query_timer_counts_request_queries(self):
+        selects = metrics.QUERY_DURATION.count('SELECT')
+        CrimeIncident.objects.count()
+        token = metrics.start_request()
+        CrimeIncident.objects.count()
+        list(CrimeIncident.objects.all())
+        self.assertEqual(metrics.end_request(token), 2)
+        self.assertEqual(metrics.QUERY_DURATION.count('SELECT'), selects + 3)
+        # Outside a request nothing is counted
+        self.assertIsNone(metrics._request_queries.get())
+
+    def test_sampled_filter(self):
+        def record(level):
+            return logging.LogRecord('alerts', level, __file__, 1, "message", None, None)
+
+        dropping = metrics.SampledFilter(rate=0)
+        self.assertFalse(dropping.filter(record(logging.INFO)))
+        self.assertFalse(dropping.filter(record(logging.DEBUG)))
+        self.assertTrue(dropping.filter(record(logging.WARNING)))
+        self.assertTrue(dropping.filter(record(logging.ERROR)))
+        self.assertTrue(metrics.SampledFilter(rate=1).filter(record(logging.INFO)))
+
+    def test_middleware_records_requests(self):
+        ok = metrics.REQUESTS.value('metrics', 'GET', '200')
+        unmatched = metrics.REQUESTS.value('unmatched', 'GET', '404')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('saferoute_http_requests_total', response.content.decode())
+        self.client.get('/api/no-such-endpoint/')
+        self.assertEqual(metrics.REQUESTS.value('metrics', 'GET', '200'), ok + 1)
+        self.assertEqual(metrics.REQUESTS.value('unmatched', 'GET', '404'), unmatched + 1)
+
+    def test_middleware_records_exceptions(self):
+        def get_response(request):
+            raise RuntimeError
+
+        errors = metrics.REQUEST_ERRORS.value('unmatched')
+        with self.assertRaises(RuntimeError):
+            MetricsMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertEqual(metrics.REQUEST_ERRORS.value('unmatched'), errors + 1)
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse(b'x' * 10)
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        sizes = metrics.RESPONSE_SIZE.count('unmatched')
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'x' * 10)
+        self.assertEqual(metrics.RESPONSE_SIZE.count('unmatched'), sizes + 1)
+        self.assertFalse(iscoroutinefunction(MetricsMiddleware(lambda request: HttpResponse())))
+
+    async def test_asgi_request(self):
+        ok = metrics.REQUESTS.value('metrics', 'GET', '200')
+        response = await AsyncClient().get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.REQUESTS.value('metrics', 'GET', '200'), ok + 1)
+
+
+class DeviceTests(TestCase):
+    def register(self, **data):
+        body = {'push_token': 'ExponentPushToken[a]', 'device_id': 'phone-a', 'platform': 'ios', **data}
+        return self.client.post('/api/register-device/', body, content_type='application/json')
+
+    def test_covering_cells_are_fine_and_complete(self):
+        lat, lon = 32.5, -92.1
+        for radius_km in (0.1, 1.0, 2.0, 10.0):
+            cells = geohash.covering_cells(lat, lon, radius_km)
+            self.assertLessEqual(len(cells), geohash.MAX_COVERING_CELLS)
+            height, width = geohash.cell_size(len(cells[0]))
+            # Cells are smaller than the circle, not a ring of radius-sized ones
+            self.assertLess(height * KM_PER_DEGREE, 2 * radius_km)
+            for bearing in range(0, 360, 15):
+                point_lat = lat + radius_km * 0.999 / KM_PER_DEGREE * math.cos(math.radians(bearing))
+                point_lon = lon + radius_km * 0.999 / KM_PER_DEGREE * math.sin(math.radians(bearing)) \
+                    / math.cos(math.radians(lat))
+                self.assertIn(geohash.encode(point_lat, point_lon)[:len(cells[0])], cells)
+        self.assertEqual(len(geohash.covering_cells(lat, lon, 1.0)[0]), 6)
+
+    def test_devices_near(self):
+        near = Device.objects.create(push_token='near', device_id='near', platform='ios')
+        far = Device.objects.create(push_token='far', device_id='far', platform='ios')
+        devices.update_location(near, 32.505, -92.1)
+        devices.update_location(far, 32.52, -92.1)
+        self.assertEqual([device.id for _, device in devices.devices_near(32.5, -92.1, 1.0)], [near.id])
+
+    def test_register_with_location(self):
+        response = self.register(latitude=32.5, longitude=-92.1)
+        self.assertEqual(response.status_code, 200)
+        device = Device.objects.get(device_id='phone-a')
+        self.assertEqual((device.latitude, device.longitude), (32.5, -92.1))
+        self.assertEqual(device.geohash, geohash.encode(32.5, -92.1))
+
+    def test_register_rejects_bad_location_before_writing(self):
+        for latitude, longitude in (('north', -92.1), (95, -92.1), (32.5, -200), ('nan', -92.1)):
+            response = self.register(latitude=latitude, longitude=longitude)
+            self.assertEqual(response.status_code, 400, (latitude, longitude))
+        self.assertFalse(Device.objects.exists())
+
+    def test_unregistered_tokens_are_removed(self):
+        gone = Device.objects.create(push_token='ExponentPushToken[invalid]', device_id='gone', platform='ios')
+        kept = Device.objects.create(push_token='ExponentPushToken[ok]', device_id='kept', platform='ios')
+        server, url = start_fake_expo_server()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        dispatcher = notifications.PushDispatcher(url=url, workers=1).start()
+        dispatcher.submit([notifications.build_message(device.push_token, "t", "b") for device in (gone, kept)])
+        dispatcher.stop()
+        self.assertEqual(dispatcher.stats()['invalid_tokens'], 1)
+
+        with mock.patch.object(notifications, '_dispatcher', dispatcher):
+            self.assertEqual(notifications.remove_invalid_devices(), 1)
+            self.assertEqual(notifications.remove_invalid_devices(), 0)
+        self.assertEqual(list(Device.objects.values_list('id', flat=True)), [kept.id])
+
+
+class ClassificationTests(TestCase):
+    def unclassified(self, description, severity=None, crime_type='unknown', **fields):
+        """An incident stored as it was before save() classified reports."""
+        incident = CrimeIncident.objects.create(latitude=32.5, longitude=-92.1, description=description, **fields)
+        CrimeIncident.objects.filter(id=incident.id).update(severity=severity, crime_type=crime_type)
+        return incident
+
+    def backfill(self, *args):
+        call_command('backfill_incident_classification', *args, stdout=StringIO())
+
+    def test_classify(self):
+        incident = CrimeIncident(description="Robbery: wallet taken at gunpoint").classify()
+        self.assertEqual((incident.severity, incident.crime_type), (4, 'robbery'))
+        # Explicit values are kept
+        incident = CrimeIncident(description="Robbery: wallet", severity=2, crime_type='theft').classify()
+        self.assertEqual((incident.severity, incident.crime_type), (2, 'theft'))
+        incident = CrimeIncident(description="Someone was shouting").classify()
+        self.assertEqual((incident.severity, incident.crime_type), (1, 'unknown'))
+
+    def test_backfill_keeps_explicit_ones(self):
+        unset = self.unclassified("Robbery: at the station")
+        one = self.unclassified("Robbery: at the bank", severity=1)
+        typed = self.unclassified("Robbery: at the mall", severity=1, crime_type='theft')
+        self.backfill()
+        self.assertEqual(CrimeIncident.objects.get(id=unset.id).severity, 4)
+        one = CrimeIncident.objects.get(id=one.id)
+        self.assertEqual((one.severity, one.crime_type), (1, 'robbery'))
+        typed = CrimeIncident.objects.get(id=typed.id)
+        self.assertEqual((typed.severity, typed.crime_type), (1, 'theft'))
+
+        self.backfill('--reclassify-ones')
+        self.assertEqual(CrimeIncident.objects.get(id=one.id).severity, 4)
+        self.assertEqual(CrimeIncident.objects.get(id=typed.id).crime_type, 'theft')
+        self.backfill('--all')
+        self.assertEqual(CrimeIncident.objects.get(id=typed.id).crime_type, 'robbery')
+
+    def test_backfill_updates_summaries_and_tiles(self):
+        incident = self.unclassified("Robbery: at the station", reported_at=timezone.now())
+        incident_stats.rebuild()
+        incident_buckets.rebuild()
+        heatmap.build_tiles(32.49, -92.11, 32.51, -92.09)
+        x, y = (int(value) for value in heatmap.lat_lon_to_tile(32.5, -92.1, heatmap.TILE_ZOOM))
+        before = heatmap.get_tile_scores(heatmap.TILE_ZOOM, x, y).max()
+
+        self.backfill()
+        self.assertEqual(IncidentStat.objects.get().severity, 4)
+        self.assertEqual(IncidentBucket.objects.get().severity_max, 4)
+        self.assertGreater(heatmap.get_tile_scores(heatmap.TILE_ZOOM, x, y).max(), before)
+        self.assertEqual(CrimeIncident.objects.get(id=incident.id).severity, 4)
+
+
+class RiskTileTests(TestCase):
+    def setUp(self):
+        city = SyntheticCity(span_km=2.0, hotspots=3, days=30, seed=5)
+        CrimeIncident.objects.bulk_create(city.incidents(300))
+        incident_buckets.rebuild()
+        self.lat, self.lon = city.center
+        self.box = (self.lat - 0.01, self.lon - 0.01, self.lat + 0.01, self.lon + 0.01)
+        heatmap.build_tiles(*self.box)
+        self.tile = tuple(int(value) for value in heatmap.lat_lon_to_tile(self.lat, self.lon, heatmap.TILE_ZOOM))
+
+    def stored(self):
+        return {(tile.x, tile.y): heatmap._decode(tile) for tile in RiskTile.objects.filter(z=heatmap.TILE_ZOOM)}
+
+    def test_endpoint_encoding(self):
+        x, y = self.tile
+        response = self.client.get(f'/api/risk-tiles/{heatmap.TILE_ZOOM}/{x}/{y}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['z'], data['x'], data['y'], data['size']), (heatmap.TILE_ZOOM, x, y, heatmap.TILE_CELLS))
+        # Row-major from the north-west corner, rounded to 3 places
+        expected = heatmap.get_tile_scores(heatmap.TILE_ZOOM, x, y)
+        self.assertEqual(len(data['scores']), heatmap.TILE_CELLS ** 2)
+        self.assertEqual(data['scores'], [round(float(score), 3) for score in expected.ravel()])
+        self.assertTrue(any(data['scores']))
+
+        # Coarser tiles are max-pooled from their children
+        parent = self.client.get(f'/api/risk-tiles/{heatmap.TILE_ZOOM - 1}/{x // 2}/{y // 2}/').json()
+        self.assertGreaterEqual(max(parent['scores']), max(data['scores']))
+        self.assertEqual(self.client.get(f'/api/risk-tiles/{heatmap.MIN_TILE_ZOOM - 1}/0/0/').status_code, 400)
+        self.assertFalse(any(self.client.get(f'/api/risk-tiles/{heatmap.TILE_ZOOM}/0/0/').json()['scores']))
+
+    def test_incremental_update_matches_rebuild(self):
+        new = [CrimeIncident.objects.create(latitude=lat, longitude=lon, description="Robbery: x")
+               for lat, lon in ((self.lat, self.lon), (self.lat + 0.003, self.lon + 0.003))]
+        recomputed = heatmap.update_for_incidents(new)
+        self.assertGreater(recomputed, 0)
+        self.assertLess(recomputed, len(self.stored()) * heatmap.TILE_CELLS ** 2)
+        incremental = self.stored()
+
+        heatmap.build_tiles(*self.box)
+        for key, scores in self.stored().items():
+            np.testing.assert_allclose(incremental[key], scores, atol=1e-4)
+
+
+class ExtractionCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000000.0
+        patcher = mock.patch.object(extraction_cache.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = extraction_cache.ExtractionCache(':memory:', ttl_seconds=100, max_entries=2, touch_seconds=10)
+
+    def accessed_at(self, key):
+        return self.cache._conn.execute("SELECT accessed_at FROM extraction_cache WHERE key = ?", (key,)).fetchone()[0]
+
+    def test_keys_ignore_whitespace(self):
+        self.assertEqual(extraction_cache.cache_key("a  robbery\n", 'v1'), extraction_cache.cache_key("a robbery", 'v1'))
+        self.assertNotEqual(extraction_cache.cache_key("a robbery", 'v1'), extraction_cache.cache_key("a robbery", 'v2'))
+
+    def test_ttl_expiry(self):
+        self.cache.set('a', {'crime_type': 'robbery'})
+        self.now += 100
+        self.assertEqual(self.cache.get('a'), {'crime_type': 'robbery'})
+        self.now += 1
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.cache.set('b', {})
+        self.now += 101
+        self.assertEqual(self.cache.purge_expired(), 1)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', {})
+        self.now += 20
+        self.cache.set('b', {})
+        self.now += 20
+        self.cache.get('a')
+        self.cache.set('c', {})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_hits_touch_only_after_slack(self):
+        self.cache.set('a', {})
+        self.now += 5
+        self.cache.get('a')
+        self.assertEqual(self.accessed_at('a'), 1000000.0)
+        self.now += 10
+        self.cache.get('a')
+        self.assertEqual(self.accessed_at('a'), self.now)
+
+
+
+class FlakyExpoHandler(FakeExpoHandler):
+    """Fake Expo endpoint answering the first `failures` requests with a 503."""
+    failures = 0
+
+    def do_POST(self):
+        with self.lock:
+            fail = type(self).failures > 0
+            type(self).failures -= fail
+        if not fail:
+            return super().do_POST()
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send(503, {'errors': [{'code': 'UNAVAILABLE'}]})
+
+
+class PushDispatcherTests(TestCase):
+    def start_server(self, failures=0):
+        handler = type('Handler', (FlakyExpoHandler,), {'failures': failures, 'lock': threading.Lock()})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}/--/api/v2/push/send"
+
+    def messages(self, count):
+        return [notifications.build_message(f"ExponentPushToken[{number}]", "t", "b") for number in range(count)]
+
+    def dispatcher(self, url, **options):
+        dispatcher = notifications.PushDispatcher(url=url, backoff=0.001, **options)
+        # Batches are sent on this thread; the workers are tested separately
+        dispatcher._session = dispatcher._get_session()
+        return dispatcher
+
+    def test_batches_at_most_batch_size(self):
+        dispatcher = notifications.PushDispatcher(url=self.start_server(), batch_size=40, workers=2, linger=0.2)
+        with mock.patch.object(dispatcher, 'send_batch', wraps=dispatcher.send_batch) as send_batch:
+            dispatcher.start()
+            self.assertEqual(dispatcher.submit(self.messages(250)), 250)
+            dispatcher.flush()
+            dispatcher.stop()
+        sizes = [len(call.args[0]) for call in send_batch.call_args_list]
+        self.assertEqual(sum(sizes), 250)
+        self.assertLessEqual(max(sizes), 40)
+        # Batches fill up while the workers linger
+        self.assertLessEqual(len(sizes), 10)
+        stats = dispatcher.stats()
+        self.assertEqual((stats['queued'], stats['sent'], stats['failed'], stats['pending']), (250, 250, 0, 0))
+        self.assertEqual(stats['batches'], len(sizes))
+        # Expo's own limit caps the batch size
+        self.assertEqual(notifications.PushDispatcher(url='http://unused', batch_size=500).batch_size, 100)
+
+    def test_retries_failed_batches(self):
+        dispatcher = self.dispatcher(self.start_server(failures=2), max_retries=3)
+        self.assertTrue(dispatcher.send_batch(self.messages(5)))
+        stats = dispatcher.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['retries'], stats['batches']), (5, 0, 2, 1))
+
+    def test_gives_up_after_max_retries(self):
+        dispatcher = self.dispatcher(self.start_server(failures=5), max_retries=2)
+        with self.assertLogs('alerts.notifications', 'ERROR'):
+            self.assertFalse(dispatcher.send_batch(self.messages(5)))
+        stats = dispatcher.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['retries']), (0, 5, 2))
+
+    def test_retries_connection_errors(self):
+        url = self.start_server()
+        # Nothing listens on the port once the server is closed
+        closed = ThreadingHTTPServer(('127.0.0.1', 0), FlakyExpoHandler)
+        port = closed.server_address[1]
+        closed.server_close()
+        dispatcher = self.dispatcher(f"http://127.0.0.1:{port}/", max_retries=1, timeout=1)
+        with self.assertLogs('alerts.notifications', 'ERROR'):
+            self.assertFalse(dispatcher.send_batch(self.messages(3)))
+        self.assertEqual((dispatcher.stats()['failed'], dispatcher.stats()['retries']), (3, 1))
+        self.assertTrue(self.dispatcher(url).send_batch(self.messages(3)))
+
+    def test_full_queue_drops_messages(self):
+        dispatcher = notifications.PushDispatcher(url='http://unused', max_queue=3)
+        with self.assertLogs('alerts.notifications', 'WARNING'):
+            self.assertEqual(dispatcher.submit(self.messages(5)), 3)
+        self.assertEqual(dispatcher.stats()['dropped'], 2)
+
+
+class IncidentQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = SyntheticCity(span_km=3.0, hotspots=5, days=60, seed=3)
+        CrimeIncident.objects.bulk_create(cls.city.incidents(1500))
+
+    def test_in_bbox_is_inclusive(self):
+        incident = CrimeIncident.objects.create(latitude=32.5, longitude=-92.1, description="Theft: x")
+        self.assertIn(incident, CrimeIncident.objects.in_bbox(32.5, -92.1, 32.5, -92.1))
+        self.assertNotIn(incident, CrimeIncident.objects.in_bbox(32.50001, -92.1, 32.6, -92.0))
+
+    def test_near_matches_brute_force(self):
+        incidents = list(CrimeIncident.objects.all())
+        since = timezone.now() - timedelta(days=20)
+        latitudes, longitudes = self.city.points(20)
+        for lat, lon in zip(latitudes.tolist(), longitudes.tolist()):
+            for radius_km, cutoff in ((0.3, None), (1.0, None), (1.0, since)):
+                expected = sorted(
+                    (calculate_distance(lat, lon, incident.latitude, incident.longitude), incident.id)
+                    for incident in incidents if cutoff is None or incident.reported_at >= cutoff
+                )
+                expected = [incident_id for distance, incident_id in expected if distance <= radius_km]
+                near = CrimeIncident.objects.near(lat, lon, radius_km, since=cutoff)
+                self.assertEqual([incident.id for _, incident in near], expected)
+                distances = [distance for distance, _ in near]
+                self.assertEqual(distances, sorted(distances))
+                # around() is the cheap superset near() checks exactly
+                around = set(CrimeIncident.objects.around(lat, lon, radius_km, cutoff).values_list('id', flat=True))
+                self.assertLessEqual(set(expected), around)
+
+    def test_around_uses_the_location_index(self):
+        lat, lon = self.city.center
+        plan = CrimeIncident.objects.around(lat, lon, 0.5, timezone.now() - timedelta(days=7)).explain()
+        self.assertIn('incident_lat_lon_time_idx', plan)
+
+
+class StatisticsTests(TestCase):
+    URL = '/api/statistics/'
+
+    def setUp(self):
+        cache.clear()
+        self.lat, self.lon = incident_stats.CITIES['Monroe']
+        now = timezone.now()
+        for days, description in ((0, "Robbery: a"), (3, "Theft: b"), (10, "Theft: c"), (100, "Assault: d"),
+                                  (400, "Theft: e")):
+            CrimeIncident.objects.create(latitude=self.lat, longitude=self.lon, description=description,
+                                         reported_at=now - timedelta(days=days))
+
+    def test_windows(self):
+        response = self.client.get(self.URL, {'city': 'monroe'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['area']['city'], 'Monroe')
+        self.assertEqual(data['totals'], {'day': 1, 'week': 2, 'month': 3, 'year': 4, 'all': 5})
+        self.assertEqual(data['byCrimeType']['theft'], {'day': 0, 'week': 1, 'month': 2, 'year': 2, 'all': 3})
+        self.assertEqual(data['byCrimeType']['robbery']['day'], 1)
+        self.assertEqual(sum(counts['all'] for counts in data['bySeverity'].values()), 5)
+        self.assertEqual(len(data['daily']), incident_stats.DAILY_DAYS)
+        self.assertEqual(data['daily'][-1], {'date': data['date'], 'count': 1})
+        self.assertEqual(sum(day['count'] for day in data['daily']), 3)
+
+        # A point query far from every incident
+        far = self.client.get(self.URL, {'lat': self.lat + 1, 'lon': self.lon, 'radius': 5}).json()
+        self.assertEqual(far['totals']['all'], 0)
+
+    def test_etag(self):
+        first = self.client.get(self.URL, {'city': 'Monroe'})
+        etag = first['ETag']
+        self.assertEqual(self.client.get(self.URL, {'city': 'Monroe'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A new incident changes the version
+        CrimeIncident.objects.create(latitude=self.lat, longitude=self.lon, description="Theft: f")
+        changed = self.client.get(self.URL, {'city': 'Monroe'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(changed.json()['totals']['all'], 6)
+
+        # So does the day rolling over, which moves every window
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch.object(incident_stats.timezone, 'now', return_value=tomorrow):
+            rolled = self.client.get(self.URL, {'city': 'Monroe'}, HTTP_IF_NONE_MATCH=changed['ETag'])
+        self.assertEqual(rolled.status_code, 200)
+        self.assertNotEqual(rolled['ETag'], changed['ETag'])
+        self.assertEqual(rolled.json()['totals']['day'], 0)
+
+    def test_rejects_bad_areas(self):
+        response = self.client.get(self.URL, {'city': 'Atlantis'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Monroe', response.json()['cities'])
+        self.assertEqual(self.client.get(self.URL, {'lat': 'x', 'lon': 1}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {'lat': 32.5, 'lon': -92.1, 'radius': 500}).status_code, 400)
+
+
+@override_settings(RISK_TILE_BACKGROUND=False)
+class LoadTestTests(LiveServerTestCase):
+    """
+    The live server's threads share the test database's one in-memory
+    SQLite connection, so users are run one at a time.
+    """
+    def setUp(self):
+        self.city = SyntheticCity(span_km=2.0, hotspots=3, days=30, seed=9)
+        synthetic.populate(self.city, incidents=300, areas=50)
+        self.base_url = f"{self.live_server_url}/api"
+
+    def test_run_load(self):
+        # A fast clock and frequent reports, so every endpoint is hit within a second
+        summary = loadtest.run_load(self.base_url, [self.city.center], 1.0, time_scale=300, pan_interval=30,
+                                    reports_per_hour=600)
+        self.assertEqual(summary['errors'], 0)
+        for name in loadtest.ENDPOINTS:
+            endpoint = summary['endpoints'][name]
+            self.assertGreater(endpoint['count'], 0, name)
+            self.assertGreater(endpoint['p95'], 0)
+            self.assertGreater(endpoint['meanBytes'], 0)
+        self.assertEqual(summary['requests'], sum(endpoint['count'] for endpoint in summary['endpoints'].values()))
+        self.assertTrue(CrimeIncident.objects.filter(description__in=[text for text, _ in loadtest.REPORTS]).exists())
+
+    def test_command_against_running_server(self):
+        output = os.path.join(tempfile.mkdtemp(), 'load.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        stdout = StringIO()
+        call_command('load_test', '--url', self.base_url, '--users', '1', '--seconds', '0.5',
+                     '--time-scale', '100', '--slo-ms', '10000', '--output', output, stdout=stdout)
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(results['url'], self.base_url)
+        step, = results['steps']
+        self.assertEqual((step['users'], step['errors'], step['sustained']), (1, 0, True))
+        self.assertGreater(step['requests'], 0)
+        self.assertIn("Sustained up to 1 users", stdout.getvalue())
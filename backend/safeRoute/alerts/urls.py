@@ -5,5 +5,14 @@ urlpatterns = [
     path('risk/', views.RiskAreaAPIView.as_view(), name='risk-area'),
     path('map-risk-areas/', views.MapRiskAreasAPIView.as_view(), name='map-risk-areas'),
     path('report-crime/', views.ReportCrimeAPIView.as_view(), name='report-crime'),
+    path('report-crime/bulk/', views.BulkReportCrimeAPIView.as_view(), name='report-crime-bulk'),
+    path('map-risk-areas/stream/', views.risk_area_stream, name='map-risk-areas-stream'),
     path('manage-risk-areas/', views.MapRiskAreasAPIView.as_view(), name='manage-risk-areas'),
+    path('risk-tiles/<int:z>/<int:x>/<int:y>/', views.RiskTileAPIView.as_view(), name='risk-tiles'),
+    path('route-safety/', views.RouteSafetyAPIView.as_view(), name='route-safety'),
+    path('statistics/', views.StatisticsAPIView.as_view(), name='statistics'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('cache-stats/', views.CacheStatsAPIView.as_view(), name='cache-stats'),
+    path('register-device/', views.register_device, name='register-device'),
+    path('device-location/', views.DeviceLocationAPIView.as_view(), name='device-location'),
 ]
\ No newline at end of file
@@ -1,6 +1,27 @@
+import re
 from math import radians, sin, cos, atan2, sqrt
 from datetime import datetime
 from django.utils import timezone
+from .metrics import timed
+
+# Crime types that are always treated as maximum risk
+SEVERE_CRIME_TYPES = ['sexual_harassment', 'assault', 'robbery']
+
+# Keywords that identify a crime type, with their severity (higher is worse)
+SEVERITY_KEYWORDS = {
+    'rape': 5,
+    'assault': 4,
+    'robbery': 4,
+    'burglary': 3,
+    'theft': 2,
+    'suspicious': 1,
+    'disturbance': 1
+}
+# One pass over the text finds every keyword
+SEVERITY_KEYWORDS_RE = re.compile(
+    '|'.join(re.escape(keyword) for keyword in sorted(SEVERITY_KEYWORDS, key=len, reverse=True)),
+    re.IGNORECASE
+)
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two points in kilometers."""
@@ -32,29 +53,45 @@ def time_decay(reported_at):
         # Linear decay between 24 hours and 30 days
         return 1.0 - (0.9 * (delta_hours - 24) / (720 - 24))
 
+def most_severe_keyword(text):
+    """The most severe crime keyword in the text, or None."""
+    found = {match.group(0).lower() for match in SEVERITY_KEYWORDS_RE.finditer(text or '')}
+    return max(found, key=SEVERITY_KEYWORDS.get) if found else None
+
 def determine_severity_from_data(text):
     """
     Map keywords in the text to a severity score.
     Higher numbers indicate more severe incidents.
     """ 
-    mapping = {
-        'rape': 5,
-        'assault': 4,
-        'robbery': 4,
-        'burglary': 3,
-        'theft': 2,
-        'suspicious': 1,
-        'disturbance': 1
-    }
-    text_lower = text.lower()
-    severity = None
-    for keyword, score in mapping.items():
-        if keyword in text_lower:
-            if severity is None or score > severity:
-                severity = score
-                
-    return severity if severity is not None else 1
+    keyword = most_severe_keyword(text)
+    return SEVERITY_KEYWORDS[keyword] if keyword else 1
+
+def normalize_crime_type(name):
+    """Crime type code: lowercase words joined by underscores, e.g. 'Sexual Harassment' -> 'sexual_harassment'."""
+    code = re.sub(r'[^a-z0-9]+', '_', (name or '').lower()).strip('_')
+    return code[:50] or 'unknown'
+
+def classify_incident(description):
+    """
+    (severity, crime type code) for a report description. The type comes
+    from the '<Crime type>: <details>' prefix when there is one, otherwise
+    from the most severe keyword.
+    """
+    keyword = most_severe_keyword(description)
+    severity = SEVERITY_KEYWORDS[keyword] if keyword else 1
+    if description and ':' in description:
+        return severity, normalize_crime_type(crime_type_from_description(description))
+    return severity, keyword or 'unknown'
+
+def crime_type_from_description(description):
+    """Reports are described as '<Crime type>: <details>'."""
+    return description.split(":")[0] if ":" in description else "unknown"
+
+def risk_level_from_severity(severity):
+    """Map a 1-5 severity to a risk category A (high) to D (safe)."""
+    return 'A' if severity >= 4 else 'B' if severity >= 3 else 'C' if severity >= 2 else 'D'
 
+@timed('compute_risk_score')
 def compute_risk_score(incidents, user_lat, user_lon, radius_km=1.0, current_crime_type=None):
     """
     Compute risk score based on:
@@ -66,7 +103,7 @@ def compute_risk_score(incidents, user_lat, user_lon, radius_km=1.0, current_cri
     Risk score is normalized to be between 0 and 10
     """
     # Base score for severe crimes
-    if current_crime_type and current_crime_type.lower() in ['sexual_harassment', 'assault', 'robbery']:
+    if current_crime_type and current_crime_type.lower() in SEVERE_CRIME_TYPES:
         return 10.0  # Maximum risk for severe crimes
     
     total_score = 0.0
@@ -84,8 +121,8 @@ def compute_risk_score(incidents, user_lat, user_lon, radius_km=1.0, current_cri
             time_factor = time_decay(incident.reported_at)
             
             # Severity: normalized to 0-1 range (assuming max severity is 5)
-            severity = incident.severity if incident.severity else determine_severity_from_data(incident.description)
-            severity_factor = severity / 5.0
+            # Classified when the incident was saved (CrimeIncident.classify)
+            severity_factor = (incident.severity or 1) / 5.0
             
             # Combine factors
             incident_score = distance_factor * time_factor * severity_factor
@@ -116,7 +153,7 @@ def ai_predict_risk(features):
     crime_type = features.get("crime_type", "").lower()
     
     # Automatically set highest risk for severe crimes
-    if crime_type in ['sexual_harassment', 'assault', 'robbery']:
+    if crime_type in SEVERE_CRIME_TYPES:
         return "A"
     
     # Otherwise use risk score
@@ -1,55 +1,60 @@
-from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import CrimeIncident, RiskArea
+from .models import CrimeIncident
 from .models import Device
-from .utils import compute_risk_score, ai_predict_risk, calculate_distance
-from django.utils import timezone
-from .serializers import CrimeIncidentSerializer
+from .utils import crime_type_from_description, risk_level_from_severity
+from django.conf import settings
+from .serializers import CrimeIncidentImportSerializer, CrimeIncidentSerializer
+from .parsers import NDJSONParser
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ParseError, ValidationError
+from .ingest import ingest_incidents
+from . import devices, heatmap, incident_stats, metrics, notifications, response_cache, risk_areas, routes, streams
+from .geometry import GEOMETRY_ENCODINGS, encoded_circle
 import logging
-import math
-import requests
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 
 logger = logging.getLogger(__name__)
 
-# Initialize risk areas list with dummy data
-risk_areas = [
-    {
-        'center': {'latitude': 32.505, 'longitude': -92.1239},  # Current location (High Risk)
-        'radius': 0.2,  # 200 meters
-        'riskLevel': 'A',
-        'crimeType': 'unknown'
-    },
-    {
-        'center': {'latitude': 32.505224, 'longitude': -92.1239},  # 25 meters north of current location
-        'radius': 0.025,  # 25 meters radius
-        'riskLevel': 'A',
-        'crimeType': 'test_area'
-    },
-    {
-        'center': {'latitude': 32.5293, 'longitude': -92.0745},  # ULM Library (High Risk)
-        'radius': 0.2,  # 200 meters
-        'riskLevel': 'A',
-        'crimeType': 'unknown'
-    },
-    {
-        'center': {'latitude': 32.5285, 'longitude': -92.0739},  # Schulze Dining (Low Risk)
-        'radius': 0.2,  # 200 meters
-        'riskLevel': 'C',
-        'crimeType': 'unknown'
-    }
-]
+def version_etag(version):
+    """ETag for a response that depends only on the risk area version."""
+    return f'"risk-areas-{version}"'
+
+def not_modified(request, etag, max_age=None):
+    """304 response if the client already has this ETag, else None."""
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        return cacheable(Response(status=status.HTTP_304_NOT_MODIFIED), etag, max_age=max_age)
+    return None
+
+def cacheable(response, etag, hit=None, max_age=None):
+    """Add the ETag, Cache-Control and X-Cache headers to a cacheable response."""
+    response['ETag'] = etag
+    if max_age is None:
+        max_age = getattr(settings, 'RISK_RESPONSE_MAX_AGE', 15)
+    patch_cache_control(response, public=True, max_age=max_age)
+    if hit is not None:
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+def parse_since(request):
+    """The 'since' version parameter as an int, or None. Raises ValueError if malformed."""
+    since = request.query_params.get('since')
+    return int(since) if since not in (None, '') else None
 
 class RiskAreaAPIView(APIView):
     def get(self, request, format=None):
         try:
             # Log incoming request
-            logger.info(f"Received risk area request with params: {request.query_params}")
+            logger.info("Received risk area request with params: %s", request.query_params)
             
             lat = request.query_params.get('lat')
             lon = request.query_params.get('lon')
@@ -69,64 +74,125 @@ class RiskAreaAPIView(APIView):
                     "error": "'lat', 'lon', and 'radius' must be numeric."
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # For now, just return the dummy risk areas
+            try:
+                since = parse_since(request)
+            except ValueError:
+                return Response({
+                    "error": "'since' must be an integer version."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            check = request.query_params.get('mode') == 'check'
+            
+            if since is not None and not check:
+                # Only the areas added/removed around the point since the client's version
+                delta = risk_areas.changes_since(since, point=(user_lat, user_lon, radius_km))
+                etag = version_etag(delta['version'])
+                cached = not_modified(request, etag)
+                if cached is not None:
+                    return cached
+                if not delta['reset']:
+                    response = cacheable(Response({"since": since, **delta}, status=status.HTTP_200_OK), etag)
+                    logger.info("Returning risk area delta since %s: %s added, %s removed", since, len(delta['added']), len(delta['removed']))
+                    return response
+            
+            version, matches, hit = response_cache.radius_matches(user_lat, user_lon, radius_km)
+            etag = version_etag(version)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+            
+            if check:
+                # Compact answer for the moving client: only the area the
+                # user is in (if any) and the nearest one
+                response_data = self.check_location(matches)
+                logger.info("Risk check: inside=%s riskLevel=%s", response_data['inside'], response_data['riskLevel'])
+                return cacheable(Response(response_data, status=status.HTTP_200_OK), etag, hit)
+            
             response_data = {
-                "risk_areas": risk_areas,
-                "message": "Using dummy data for risk areas"
+                "version": version,
+                "risk_areas": [area for _, area in matches]
             }
+            if since is not None:
+                # The client's version is too old (or the set was cleared): full reload
+                response_data["reset"] = True
             
-            logger.info(f"Returning dummy risk areas")
-            return Response(response_data, status=status.HTTP_200_OK)
+            logger.info("Returning %s risk areas", len(matches))
+            return cacheable(Response(response_data, status=status.HTTP_200_OK), etag, hit)
             
         except Exception as e:
-            logger.error(f"Error processing risk area request: {str(e)}", exc_info=True)
+            logger.error("Error processing risk area request: %s", e, exc_info=True)
             return Response({
                 "error": f"An error occurred while processing your request: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def check_location(matches):
+        """
+        Summarize (distance_km, area) matches into whether the user is inside
+        a risk area (the most severe one wins) and the nearest area.
+        """
+        containing = [(distance, area) for distance, area in matches if distance <= area['radius']]
+        nearest = None
+        if matches:
+            distance, area = matches[0]
+            nearest = {'area': area, 'distance': round(distance * 1000, 1)}
+        
+        if not containing:
+            return {'inside': False, 'riskLevel': 'D', 'area': None, 'distance': None, 'nearest': nearest}
+        
+        # Risk levels sort alphabetically from most (A) to least (D) severe
+        distance, area = min(containing, key=lambda item: (item[1]['riskLevel'], item[0]))
+        return {
+            'inside': True,
+            'riskLevel': area['riskLevel'],
+            'area': area,
+            'distance': round(distance * 1000, 1),
+            'nearest': nearest
+        }
+
 class ReportCrimeAPIView(APIView):
     def post(self, request, format=None):
         try:
-            logger.info(f"Received crime report: {request.data}")
+            logger.info("Received crime report: %s", request.data)
             
             # Prepare the data for the serializer
             data = request.data.copy()
-            logger.info(f"Data before processing: {data}")
-            
-            if 'reported_at' not in data:
-                data['reported_at'] = timezone.now()
+            logger.info("Data before processing: %s", data)
             
             serializer = CrimeIncidentSerializer(data=data)
             if serializer.is_valid():
                 incident = serializer.save()
-                logger.info(f"Saved crime incident: {incident.id}")
+                logger.info("Saved crime incident: %s", incident.id)
+                
+                # Refresh the precomputed heatmap cells around the incident in the background
+                heatmap.schedule_update([incident])
                 
                 try:
                     user_lat = float(data.get("latitude"))
                     user_lon = float(data.get("longitude"))
                     # Extract crime type from description
                     description = data.get("description", "")
-                    crime_type = description.split(":")[0] if ":" in description else "unknown"
-                    # Get risk level based on severity
-                    severity = data.get("severity", 1)
-                    risk_level = 'A' if severity >= 4 else 'B' if severity >= 3 else 'C' if severity >= 2 else 'D'
+                    crime_type = crime_type_from_description(description)
+                    # Get risk level based on severity (classified from the description if not sent)
+                    risk_level = risk_level_from_severity(incident.severity)
                 except (ValueError, TypeError) as e:
-                    logger.error(f"Invalid coordinates: {e}")
+                    logger.error("Invalid coordinates: %s", e)
                     return Response({
                         "error": "Invalid latitude or longitude"
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
-                # Update the risk areas list with the new report
-                risk_areas.append({
-                    'center': {'latitude': user_lat, 'longitude': user_lon},
-                    'radius': 0.2,  # 200 meters
-                    'riskLevel': risk_level,
-                    'crimeType': crime_type
-                })
+                # Store a risk area for the new report
+                area = risk_areas.add_area(user_lat, user_lon, risk_level, crime_type)
+                
+                # Alert devices near a severe incident
+                try:
+                    notifications.notify_incidents([incident])
+                except Exception as e:
+                    logger.error("Error queueing alerts: %s", e, exc_info=True)
                 
                 response_data = {
                     "crime_report": serializer.data,
                     "risk_area": {
+                        "id": area['id'],
                         "risk_category": risk_level,
                         "risk_level": risk_level,  # Include both for backward compatibility
                         "crime_type": crime_type,
@@ -134,20 +200,116 @@ class ReportCrimeAPIView(APIView):
                     }
                 }
                 
-                logger.info(f"Successfully processed report: {response_data}")
+                logger.info("Successfully processed report: %s", response_data)
                 return Response(response_data, status=status.HTTP_201_CREATED)
                 
             else:
-                logger.error(f"Serializer errors: {serializer.errors}")
+                logger.error("Serializer errors: %s", serializer.errors)
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
                 
         except Exception as e:
-            logger.error(f"Error processing crime report: {str(e)}", exc_info=True)
+            logger.error("Error processing crime report: %s", e, exc_info=True)
             return Response({
                 "error": f"An error occurred while processing the report: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class BulkReportCrimeAPIView(APIView):
+    """
+    Ingest many crime reports at once, as a JSON array or NDJSON
+    (one report per line). Valid reports are written in chunks inside a
+    single transaction and risk areas / heatmap tiles are updated once for
+    the whole batch. Each report gets its own status in the response.
+    """
+    parser_classes = [JSONParser, NDJSONParser]
+    MAX_ITEMS = 50000
+    CHUNK_SIZE = 1000
+
+    def post(self, request, format=None):
+        try:
+            items = request.data
+            if not isinstance(items, list):
+                return Response({
+                    "error": "Expected a JSON array or NDJSON of crime reports."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if len(items) > self.MAX_ITEMS:
+                return Response({
+                    "error": f"A batch can contain at most {self.MAX_ITEMS} reports."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            logger.info("Received bulk crime report with %s items", len(items))
+            
+            # Validate through the list serializer's child so one bad report
+            # doesn't hide the validated data of the others
+            child = CrimeIncidentImportSerializer(data=items, many=True).child
+            valid = []
+            incidents = []
+            results = []
+            for index, item in enumerate(items):
+                try:
+                    validated_data = child.run_validation(item)
+                except ValidationError as e:
+                    results.append({"index": index, "status": "invalid", "errors": e.detail})
+                    continue
+                results.append(None)
+                valid.append(index)
+                incidents.append(CrimeIncident(**validated_data))
+            
+            if not incidents:
+                return Response({
+                    "created": 0,
+                    "failed": len(items),
+                    "results": results
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            created, areas = ingest_incidents(incidents, self.CHUNK_SIZE)
+            
+            for index, incident, area in zip(valid, created, areas):
+                results[index] = {
+                    "index": index,
+                    "status": "created",
+                    "id": incident.id,
+                    "risk_area_id": area['id'],
+                    "risk_level": area['riskLevel']
+                }
+            
+            logger.info("Bulk report created %s incidents, %s invalid", len(created), len(items) - len(created))
+            return Response({
+                "created": len(created),
+                "failed": len(items) - len(created),
+                "results": results
+            }, status=status.HTTP_201_CREATED)
+            
+        except ParseError as e:
+            return Response({
+                "error": str(e.detail)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error("Error processing bulk crime report: %s", e, exc_info=True)
+            return Response({
+                "error": f"An error occurred while processing the reports: {str(e)}"
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class MapRiskAreasAPIView(APIView):
+    @staticmethod
+    def map_area(area, encoding='points'):
+        """Area in the map response format, with its circle in the requested encoding."""
+        center = area['center']
+        radius_km = area['radius']
+        
+        response_area = {
+            'id': area['id'],
+            'riskLevel': area['riskLevel'],
+            'center': center,
+            'radius': radius_km,
+            'crimeType': area.get('crimeType', 'unknown')
+        }
+        if encoding != 'none':
+            # Circle points are cached per center/radius
+            response_area['coordinates'] = encoded_circle(
+                center['latitude'], center['longitude'], radius_km, encoding
+            )
+        return response_area
+
     def get(self, request, format=None):
         try:
             # Get map bounds from query parameters
@@ -156,55 +318,257 @@ class MapRiskAreasAPIView(APIView):
             sw_lat = float(request.query_params.get('sw_lat', 0))
             sw_lng = float(request.query_params.get('sw_lng', 0))
             
-            # Convert to response format with circles
-            areas = []
-            for area in risk_areas:
-                lat = area['center']['latitude']
-                lng = area['center']['longitude']
-                radius_km = area['radius']
-                
-                # Convert radius from kilometers to degrees
-                radius_deg = radius_km / 111.32
-                
-                # Only include areas that are within the map bounds
-                if (sw_lat <= lat <= ne_lat and sw_lng <= lng <= ne_lng):
-                    # Generate points for a circle
-                    points = []
-                    for i in range(0, 360, 10):  # Create points every 10 degrees
-                        angle = i * (3.14159 / 180)  # Convert to radians
-                        point_lat = lat + (radius_deg * math.cos(angle))
-                        point_lng = lng + (radius_deg * math.sin(angle))
-                        points.append({'latitude': point_lat, 'longitude': point_lng})
-                    
-                    areas.append({
-                        'coordinates': points,
-                        'riskLevel': area['riskLevel'],
-                        'center': area['center'],
-                        'radius': radius_km,
-                        'crimeType': area.get('crimeType', 'unknown')
-                    })
-            
-            return Response({'areas': areas}, status=status.HTTP_200_OK)
+            # Circle geometry encoding: points (default), polyline, flat or none
+            encoding = request.query_params.get('geometry', 'points')
+            if encoding not in GEOMETRY_ENCODINGS:
+                return Response({
+                    'error': f"'geometry' must be one of: {', '.join(GEOMETRY_ENCODINGS)}"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                since = parse_since(request)
+            except ValueError:
+                return Response({
+                    'error': "'since' must be an integer version."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            if since is not None:
+                # Only the areas added/removed in the bounds since the client's version
+                delta = risk_areas.changes_since(since, sw_lat, sw_lng, ne_lat, ne_lng)
+                etag = version_etag(delta['version'])
+                cached = not_modified(request, etag)
+                if cached is not None:
+                    return cached
+                if not delta['reset']:
+                    delta['added'] = [self.map_area(area, encoding) for area in delta['added']]
+                    return cacheable(Response({'since': since, **delta}, status=status.HTTP_200_OK), etag)
+            
+            # Only include areas that are within the map bounds
+            version, areas, hit = response_cache.bbox_areas(
+                sw_lat, sw_lng, ne_lat, ne_lng, lambda area: self.map_area(area, encoding), encoding
+            )
+            etag = version_etag(version)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+            
+            response_data = {'version': version, 'areas': areas}
+            if since is not None:
+                # The client's version is too old (or the set was cleared): full reload
+                response_data['reset'] = True
+            return cacheable(Response(response_data, status=status.HTTP_200_OK), etag, hit)
             
         except Exception as e:
-            logger.error(f"Error getting map risk areas: {str(e)}")
+            logger.error("Error getting map risk areas: %s", e)
             return Response({
                 'error': 'An error occurred while fetching risk areas'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def delete(self, request, format=None):
         try:
+            area_id = request.query_params.get('id')
+            if area_id is not None:
+                # Remove a single risk area
+                try:
+                    removed = risk_areas.remove_area(int(area_id))
+                except ValueError:
+                    return Response({
+                        "error": "'id' must be an integer."
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                if not removed:
+                    return Response({
+                        "error": f"Risk area {area_id} not found"
+                    }, status=status.HTTP_404_NOT_FOUND)
+                return Response({
+                    "message": f"Successfully removed risk area {area_id}"
+                }, status=status.HTTP_200_OK)
+
             # Clear all risk areas
-            risk_areas.clear()
+            risk_areas.clear_areas()
             return Response({
                 "message": "Successfully cleared all risk areas"
             }, status=status.HTTP_200_OK)
         except Exception as e:
-            logger.error(f"Error deleting risk areas: {str(e)}")
+            logger.error("Error deleting risk areas: %s", e)
             return Response({
                 "error": "An error occurred while deleting risk areas"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class RiskTileAPIView(APIView):
+    def get(self, request, z, x, y, format=None):
+        try:
+            scores = heatmap.get_tile_scores(z, x, y)
+            if scores is None:
+                return Response({
+                    "error": f"Zoom level must be at least {heatmap.MIN_TILE_ZOOM}"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            return Response({
+                'z': z,
+                'x': x,
+                'y': y,
+                'size': heatmap.TILE_CELLS,
+                # Row-major from the north-west corner of the tile
+                'scores': [round(float(score), 3) for score in scores.ravel()]
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error("Error getting risk tile: %s", e)
+            return Response({
+                'error': 'An error occurred while fetching the risk tile'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class RouteSafetyAPIView(APIView):
+    """
+    Score one or more alternative routes in one call:
+    {"routes": [{"id": "a", "polyline": "<encoded>"}, {"id": "b", "points": [[lat, lng], ...]}],
+     "spacing": 25, "radius": 1.0, "rankBy": "integrated", "segments": true}
+    Returns per-segment risk, the peak and the integrated risk of each
+    route, and the route ids ranked safest first.
+    """
+    def post(self, request, format=None):
+        try:
+            data = request.data
+            if not isinstance(data, dict) or not isinstance(data.get('routes'), list):
+                return Response({
+                    "error": "Expected a JSON object with a 'routes' list."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                parsed = []
+                for index, route in enumerate(data['routes']):
+                    route_id = route.get('id', index) if isinstance(route, dict) else index
+                    parsed.append((route_id, routes.parse_points(route)))
+                result = routes.score_routes(
+                    parsed,
+                    spacing_m=float(data.get('spacing', routes.DEFAULT_SPACING_M)),
+                    radius_km=float(data.get('radius', 1.0)),
+                    rank_by=data.get('rankBy', 'integrated'),
+                    include_segments=bool(data.get('segments', True)),
+                    exact={'exact': True, 'buckets': False}.get(data.get('mode')),
+                )
+            except (TypeError, ValueError) as e:
+                return Response({
+                    "error": str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            logger.info("Scored %s routes, ranking %s", len(parsed), result['ranking'])
+            return Response(result, status=status.HTTP_200_OK)
+            
+        except ParseError as e:
+            return Response({
+                "error": str(e.detail)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error("Error scoring routes: %s", e, exc_info=True)
+            return Response({
+                "error": f"An error occurred while scoring the routes: {str(e)}"
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class StatisticsAPIView(APIView):
+    """
+    Crime counts for an area by crime type, severity and time window, from
+    the incremental summary counts. The area is ?city=<name> or
+    ?lat=&lon=[&radius=] (km). Responses carry an ETag that changes only
+    when an incident is added or the day rolls over.
+    """
+    def get(self, request, format=None):
+        try:
+            city = request.query_params.get('city')
+            if city:
+                found = incident_stats.find_city(city)
+                if found is None:
+                    return Response({
+                        "error": f"Unknown city '{city}'.",
+                        "cities": list(incident_stats.CITIES)
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                city, (lat, lon) = found
+                radius_km = incident_stats.city_radius_km()
+            else:
+                try:
+                    lat = float(request.query_params['lat'])
+                    lon = float(request.query_params['lon'])
+                    radius_km = float(request.query_params.get('radius', incident_stats.city_radius_km()))
+                except (KeyError, ValueError):
+                    return Response({
+                        "error": "Provide 'city', or numeric 'lat' and 'lon' (and optionally 'radius' in km)."
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                if not 0 < radius_km <= 100:
+                    return Response({
+                        "error": "'radius' must be between 0 and 100 km."
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            
+            cells = incident_stats.area_cells(lat, lon, radius_km)
+            version, stats, hit = incident_stats.cached_summary(cells)
+            max_age = getattr(settings, 'STATISTICS_MAX_AGE', 300)
+            etag = f'"statistics-{version}-{stats["date"]}"'
+            cached = not_modified(request, etag, max_age)
+            if cached is not None:
+                return cached
+            
+            response_data = {
+                "area": {"city": city, "latitude": lat, "longitude": lon, "radius": radius_km},
+                "version": version,
+                **stats
+            }
+            return cacheable(Response(response_data, status=status.HTTP_200_OK), etag, hit, max_age)
+            
+        except Exception as e:
+            logger.error("Error computing statistics: %s", e, exc_info=True)
+            return Response({
+                "error": f"An error occurred while computing statistics: {str(e)}"
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class CacheStatsAPIView(APIView):
+    """Hit rate of the risk area response cache in this worker process."""
+    def get(self, request, format=None):
+        return Response({'response_cache': response_cache.cache_stats()}, status=status.HTTP_200_OK)
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Request, function and query metrics of this worker process, for Prometheus to scrape."""
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@require_http_methods(["GET"])
+async def risk_area_stream(request):
+    """
+    Server-Sent Events stream of the risk areas in a bounding box: a
+    snapshot, then add/remove events as reports come in or areas are
+    deleted. Takes the same parameters as map-risk-areas; reconnecting
+    clients get the changes since their Last-Event-ID. Only streams under
+    ASGI (see alerts/streams.py).
+    """
+    try:
+        ne_lat = float(request.GET['ne_lat'])
+        ne_lng = float(request.GET['ne_lng'])
+        sw_lat = float(request.GET['sw_lat'])
+        sw_lng = float(request.GET['sw_lng'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': "Please provide numeric 'sw_lat', 'sw_lng', 'ne_lat' and 'ne_lng'."}, status=400)
+    encoding = request.GET.get('geometry', 'none')
+    if encoding not in GEOMETRY_ENCODINGS:
+        return JsonResponse({'error': f"'geometry' must be one of: {', '.join(GEOMETRY_ENCODINGS)}"}, status=400)
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+
+    bbox = (sw_lat, sw_lng, ne_lat, ne_lng)
+    serialize = lambda area: MapRiskAreasAPIView.map_area(area, encoding)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(streams.risk_area_events(bbox, serialize, last_event_id),
+                                         content_type='text/event-stream')
+    else:
+        # A WSGI worker would be pinned for the whole stream: send the
+        # opening events and close, and let EventSource reconnect
+        _, _, messages = await sync_to_async(streams.opening_events)(bbox, serialize, last_event_id)
+        response = HttpResponse(''.join(messages), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def register_device(request):
@@ -217,6 +581,13 @@ def register_device(request):
         if not all([push_token, device_id, platform]):
             return JsonResponse({'error': 'Missing required fields'}, status=400)
 
+        # The last known location is optional at registration; check it before writing anything
+        location = None
+        if data.get('latitude') is not None and data.get('longitude') is not None:
+            location = (float(data['latitude']), float(data['longitude']))
+            if not (-90 <= location[0] <= 90 and -180 <= location[1] <= 180):
+                return JsonResponse({'error': 'Invalid latitude or longitude'}, status=400)
+
         # Update or create device
         device, created = Device.objects.update_or_create(
             device_id=device_id,
@@ -226,6 +597,9 @@ def register_device(request):
             }
         )
 
+        if location is not None:
+            devices.update_location(device, *location)
+
         return JsonResponse({
             'status': 'success',
             'message': 'Device registered successfully',
@@ -234,36 +608,50 @@ def register_device(request):
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid latitude or longitude'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-def send_push_notification(device_token, title, body):
-    """
-    Send a push notification to a specific device
-    """
-    try:
-        message = {
-            'to': device_token,
-            'sound': 'default',
-            'title': title,
-            'body': body,
-            'data': {'someData': 'goes here'},
-        }
-
-        headers = {
-            'Accept': 'application/json',
-            'Accept-encoding': 'gzip, deflate',
-            'Content-Type': 'application/json',
-        }
-
-        response = requests.post(
-            'https://exp.host/--/api/v2/push/send',
-            headers=headers,
-            json=message
-        )
-
-        return response.status_code == 200
-
-    except Exception as e:
-        print(f"Error sending push notification: {str(e)}")
-        return False 
\ No newline at end of file
+class DeviceLocationAPIView(APIView):
+    """Devices report their location so alerts can be sent to those near an incident."""
+    def post(self, request, format=None):
+        try:
+            device_id = request.data.get('device_id')
+            push_token = request.data.get('push_token')
+            if not device_id and not push_token:
+                return Response({
+                    'error': "Please provide 'device_id' or 'push_token'."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                latitude = float(request.data.get('latitude'))
+                longitude = float(request.data.get('longitude'))
+            except (TypeError, ValueError):
+                return Response({
+                    'error': 'Invalid latitude or longitude'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                return Response({
+                    'error': 'Invalid latitude or longitude'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            lookup = {'push_token': push_token} if push_token else {'device_id': device_id}
+            device = Device.objects.filter(**lookup).first()
+            if device is None:
+                return Response({
+                    'error': 'Device is not registered'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
+            devices.update_location(device, latitude, longitude)
+            return Response({
+                'status': 'success',
+                'device_id': device.id,
+                'geohash': device.geohash
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error("Error updating device location: %s", e)
+            return Response({
+                'error': 'An error occurred while updating the device location'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
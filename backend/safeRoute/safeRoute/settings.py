@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'alerts.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,7 +82,11 @@ WSGI_APPLICATION = 'safeRoute.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # SAFEROUTE_DB_PATH points a run (e.g. a benchmark) at another database file
+        'NAME': os.getenv('SAFEROUTE_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        # Background writers (heatmap tiles) run alongside requests; wait this
+        # many seconds for the write lock
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -157,3 +163,104 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [],
 }
+
+# Risk areas are cached per process; workers check the shared version
+# at most this often. Set RISK_AREA_CACHE = False to always query the DB.
+RISK_AREA_CACHE = True
+RISK_AREA_VERSION_CHECK_SECONDS = 1.0
+# Versions of risk area changes kept for ?since= delta requests; clients
+# further behind get a full reload
+RISK_AREA_CHANGELOG_VERSIONS = 10000
+
+# Crime report extraction backend: 'gemini' (needs GEMINI_API_KEY), 'rules'
+# (offline regular expressions) or 'stub' (a local stand-in for the Gemini
+# API, started with `python manage.py extraction_stub_server`).
+EXTRACTION_BACKEND = os.getenv('EXTRACTION_BACKEND', 'gemini')
+EXTRACTION_STUB_URL = os.getenv('EXTRACTION_STUB_URL', 'http://127.0.0.1:8765/')
+
+# Expo push notifications are sent in batches by background workers
+# (see alerts/notifications.py). Point EXPO_PUSH_URL at a fake server to test.
+EXPO_PUSH_URL = os.getenv('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+PUSH_WORKERS = 2
+
+# Devices last seen within ALERT_RADIUS_KM of a new incident of at least
+# ALERT_MIN_SEVERITY get a push alert. Incidents reported more than
+# ALERT_MAX_AGE_HOURS ago (bulk imports, backfills) never alert (0 = any
+# age). Locations older than DEVICE_LOCATION_MAX_AGE_HOURS are ignored
+# (0 = never expire).
+ALERT_RADIUS_KM = 1.0
+ALERT_MIN_SEVERITY = 3
+ALERT_MAX_AGE_HOURS = 24
+DEVICE_LOCATION_MAX_AGE_HOURS = 24
+
+# Server-Sent Events stream of risk area changes (alerts/streams.py).
+# Subscribers re-check for changes made by other workers this often.
+RISK_STREAM_POLL_SECONDS = 2.0
+RISK_STREAM_HEARTBEAT_SECONDS = 15.0
+RISK_STREAM_MAX_SECONDS = 3600
+
+# Response cache for the risk area endpoints (alerts/response_cache.py).
+# Local memory needs no extra service; FileBasedCache or DatabaseCache can
+# be swapped in to share entries between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'saferoute',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 300
+# Requests within the same grid cell of this size share cache entries
+RESPONSE_CACHE_QUANTUM_DEG = 0.01
+# Cache-Control max-age for clients; they revalidate with the ETag after
+RISK_RESPONSE_MAX_AGE = 15
+
+# Heatmap tiles around new incidents (alerts/heatmap.py) are recomputed on a
+# background thread after the report is saved; False does it on the request.
+RISK_TILE_BACKGROUND = True
+
+# Risk scoring reads per-cell, per-day incident buckets (alerts/incident_buckets.py)
+# of INCIDENT_BUCKET_DEG degrees (~3 m, so only reports from the same spot
+# share one and scores stay within 0.01 of the exact formula). 'exact'
+# scores the raw incidents. Run `python manage.py compact_incident_buckets`
+# daily to archive old days, and with --rebuild after changing the cell size.
+INCIDENT_SCORING = 'buckets'
+INCIDENT_BUCKET_DEG = 0.00003
+
+# Route safety scoring (alerts/routes.py): limits per request
+ROUTE_MAX_ALTERNATIVES = 10
+ROUTE_MAX_SAMPLES = 20000
+
+# Crime statistics (alerts/incident_stats.py) are counted per cell of
+# STATISTICS_CELL_DEG degrees; a city is the area within
+# STATISTICS_CITY_RADIUS_KM of its center. Clients may reuse a response
+# for STATISTICS_MAX_AGE seconds, then revalidate with its ETag.
+STATISTICS_CELL_DEG = 0.01
+STATISTICS_CITY_RADIUS_KM = 15.0
+STATISTICS_CACHE_TIMEOUT = 3600
+STATISTICS_MAX_AGE = 300
+
+# Request, function and query metrics (alerts/metrics.py), served in the
+# Prometheus text format at /api/metrics/. Each worker keeps its own.
+METRICS_ENABLED = True
+
+# Warnings and errors from the alerts app are always logged; only
+# LOG_SAMPLE_RATE of the info records are, so per-request logging stays cheap.
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {'()': 'alerts.metrics.SampledFilter', 'rate': LOG_SAMPLE_RATE},
+    },
+    'handlers': {
+        'alerts_console': {'class': 'logging.StreamHandler', 'filters': ['sampled']},
+    },
+    'loggers': {
+        'alerts': {
+            'handlers': ['alerts_console'],
+            'level': os.getenv('ALERTS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -243,40 +243,25 @@ export default function MapScreen() {
 
   const fetchRiskAreas = async (region: Region) => {
     try {
+      // Only ask for the areas inside the visible region
+      const neLat = region.latitude + region.latitudeDelta / 2;
+      const neLng = region.longitude + region.longitudeDelta / 2;
+      const swLat = region.latitude - region.latitudeDelta / 2;
+      const swLng = region.longitude - region.longitudeDelta / 2;
       const response = await fetch(
-        `${API_BASE_URL}/risk/?lat=${region.latitude}&lon=${region.longitude}&radius=0.2`
+        `${API_BASE_URL}/map-risk-areas/?ne_lat=${neLat}&ne_lng=${neLng}&sw_lat=${swLat}&sw_lng=${swLng}`
       );
       
       if (!response.ok) throw new Error('Failed to fetch risk areas');
       
       const data = await response.json();
-      const riskAreas = data.risk_areas || [];
+      const areas = data.areas || [];
       
-      // Transform the risk areas into circle coordinates
-      const transformedAreas = riskAreas.map((area: any) => {
-        const points = [];
-        const center = area.center;
-        const radius = area.radius; // 0.2 km = 200 meters
-        
-        // Convert radius from kilometers to degrees
-        const radiusDeg = radius / 111.32; // 111.32 km per degree at equator
-        
-        // Generate points for a circle
-        for (let i = 0; i < 360; i += 10) {
-          const angle = i * (Math.PI / 180);
-          const lat = center.latitude + (radiusDeg * Math.cos(angle));
-          const lng = center.longitude + (radiusDeg * Math.sin(angle));
-          points.push({ latitude: lat, longitude: lng });
-        }
-        
-        return {
-          coordinates: points,
-          riskLevel: area.riskLevel,
-          radius: radius
-        };
-      });
-      
-      setRiskAreas(transformedAreas);
+      setRiskAreas(areas.map((area: any) => ({
+        coordinates: area.coordinates,
+        riskLevel: area.riskLevel,
+        radius: area.radius
+      })));
     } catch (error) {
       console.error('Error fetching risk areas:', error);
       setErrorMsg('Failed to fetch risk areas');
@@ -300,7 +285,8 @@ export default function MapScreen() {
       try {
         setIsSending(true);
         console.log('Checking risk area for location:', currentLocation.coords);
-        const url = `${API_BASE_URL}/risk/?lat=${currentLocation.coords.latitude}&lon=${currentLocation.coords.longitude}&radius=0.2`;
+        // The server does the point-in-area check and only returns the result
+        const url = `${API_BASE_URL}/risk/?lat=${currentLocation.coords.latitude}&lon=${currentLocation.coords.longitude}&radius=0.2&mode=check`;
         console.log('Making API request to:', url);
         
         const response = await fetch(url);
@@ -310,33 +296,12 @@ export default function MapScreen() {
 
         const data = await response.json();
         console.log('Received risk data:', data);
-        const riskAreas = data.risk_areas || [];
-        
-        let currentRiskLevel = "D"; // Default to safe
-        let currentRiskScore = 0;
-        let closestDistance = Infinity;
         
-        for (const area of riskAreas) {
-          const distance = calculateDistance(
-            currentLocation.coords.latitude,
-            currentLocation.coords.longitude,
-            area.center.latitude,
-            area.center.longitude
-          );
-          
-          console.log(`Distance to risk area (${area.riskLevel}):`, distance, 'meters');
-          console.log('Risk area radius:', area.radius * 1000, 'meters');
-          
-          if (distance <= area.radius * 1000) {
-            console.log('Inside risk area! Distance:', distance, 'meters');
-            currentRiskLevel = area.riskLevel;
-            currentRiskScore = area.riskLevel === 'A' ? 0.8 : 
-                             area.riskLevel === 'B' ? 0.5 : 
-                             area.riskLevel === 'C' ? 0.2 : 0;
-            closestDistance = distance;
-            break;
-          }
-        }
+        const currentRiskLevel = data.inside ? data.riskLevel : "D"; // Default to safe
+        const currentRiskScore = currentRiskLevel === 'A' ? 0.8 : 
+                                 currentRiskLevel === 'B' ? 0.5 : 
+                                 currentRiskLevel === 'C' ? 0.2 : 0;
+        const closestDistance = data.inside ? data.distance : Infinity;
         
         console.log('Current risk level:', currentRiskLevel, 'Previous risk level:', riskLevel);
         if (currentRiskLevel !== riskLevel) {
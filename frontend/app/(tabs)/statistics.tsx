@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState } from 'react';
 import {
   StyleSheet,
   View,
@@ -13,7 +13,7 @@ import { ThemedView } from '@/components/ThemedView';
 import { StatusBar } from 'expo-status-bar';
 import { Picker } from '@react-native-picker/picker';
 import { FontAwesome } from '@expo/vector-icons';
-import { GEMINI_API_KEY } from '@/config/env';
+import { API_BASE_URL } from '@/constants/config';
 
 // List of major Louisiana cities
 const LOUISIANA_CITIES = [
@@ -31,58 +31,50 @@ const LOUISIANA_CITIES = [
 
 type LouisianaCity = typeof LOUISIANA_CITIES[number];
 
+type WindowCounts = {
+  day: number;
+  week: number;
+  month: number;
+  year: number;
+  all: number;
+};
+
+type CrimeStatistics = {
+  date: string;
+  totals: WindowCounts;
+  byCrimeType: Record<string, WindowCounts>;
+  bySeverity: Record<string, WindowCounts>;
+  daily: { date: string; count: number }[];
+};
+
+const WINDOW_LABELS: [keyof WindowCounts, string][] = [
+  ['day', 'Today'],
+  ['week', 'Last 7 days'],
+  ['month', 'Last 30 days'],
+  ['year', 'Last 12 months'],
+  ['all', 'All time'],
+];
+
+const formatCrimeType = (crimeType: string) =>
+  crimeType.replace(/_/g, ' ').replace(/\b\w/g, (letter) => letter.toUpperCase());
+
 export default function StatisticsScreen() {
   const [selectedCity, setSelectedCity] = useState<LouisianaCity | ''>('');
-  const [crimeData, setCrimeData] = useState<string | null>(null);
+  const [crimeData, setCrimeData] = useState<CrimeStatistics | null>(null);
   const [loading, setLoading] = useState(false);
   const [showPicker, setShowPicker] = useState(false);
 
-  useEffect(() => {
-    // Basic environment check without exposing sensitive information
-    console.log('Gemini API Key is configured:', !!GEMINI_API_KEY);
-  }, []);
-
   const fetchCityData = async (city: LouisianaCity) => {
     setLoading(true);
     try {
-      if (!GEMINI_API_KEY) {
-        console.error('API key is undefined');
-        throw new Error('Gemini API key is not configured');
-      }
-
-      const prompt = `You are a knowledgeable assistant providing up-to-date, accurate crime statistics and safety information for cities in Louisiana. Organize your response clearly under headings. Focus on recent official data where possible. Keep the tone factual, concise, and easy to understand for the general public.
-
-Provide recent crime statistics and safety information for ${city}, Louisiana. Structure the information as follows:
-
-1. **Crime Statistics**: Summarize recent crime rates (violent crime, property crime, etc.). Use specific numbers or trends if possible.
-2. **Crime Breakdown**: List common types of crimes (e.g., assault, theft, burglary) with brief notes if any are rising or falling.
-3. **Safety Tips**: Provide 3–5 safety recommendations tailored for people living in or visiting ${city}.
-4. **General Safety Level**: Briefly describe the overall safety situation (e.g., "Generally safe downtown but caution needed in certain areas").
-
-Keep the information clear, structured, and factual. Avoid speculation or opinions.`;
-
+      // Counts come from the SafeRoute backend; responses are cacheable
       const response = await fetch(
-        `https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key=${GEMINI_API_KEY}`,
-        {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            contents: [
-              {
-                parts: [{ text: prompt }],
-              },
-            ],
-          }),
-        }
+        `${API_BASE_URL}/statistics/?city=${encodeURIComponent(city)}`
       );
-
-      const json = await response.json();
-      if (json.error) {
-        throw new Error(json.error.message || 'Gemini API error');
+      if (!response.ok) {
+        throw new Error(`Server returned ${response.status}`);
       }
-      const data = json.candidates[0].content.parts[0].text;
+      const data: CrimeStatistics = await response.json();
       setCrimeData(data);
     } catch (error) {
       console.error('Error fetching city data:', error);
@@ -138,31 +130,37 @@ Keep the information clear, structured, and factual. Avoid speculation or opinio
                 showsVerticalScrollIndicator={false}
                 contentContainerStyle={styles.scrollContent}
               >
-                <ThemedText style={styles.crimeDataText}>
-                  {crimeData.split('\n').map((line, index) => {
-                    // Check if line contains bold text
-                    const boldMatch = line.match(/\*\*(.*?)\*\*/);
-                    if (boldMatch) {
-                      const parts = line.split(/\*\*(.*?)\*\*/);
-                      return (
-                        <ThemedText key={index} style={styles.crimeDataText}>
-                          {parts.map((part, i) => {
-                            if (i % 2 === 1) {
-                              return (
-                                <ThemedText key={i} style={[styles.crimeDataText, styles.boldText]}>
-                                  {part}
-                                </ThemedText>
-                              );
-                            }
-                            return part;
-                          })}
-                          {'\n'}
-                        </ThemedText>
-                      );
-                    }
-                    return <ThemedText key={index} style={styles.crimeDataText}>{line}{'\n'}</ThemedText>;
-                  })}
-                </ThemedText>
+                <ThemedText style={styles.sectionTitle}>Reported Incidents</ThemedText>
+                {WINDOW_LABELS.map(([window, label]) => (
+                  <View key={window} style={styles.statRow}>
+                    <ThemedText style={styles.crimeDataText}>{label}</ThemedText>
+                    <ThemedText style={[styles.crimeDataText, styles.boldText]}>
+                      {crimeData.totals[window]}
+                    </ThemedText>
+                  </View>
+                ))}
+
+                <ThemedText style={styles.sectionTitle}>Crime Breakdown (last 30 days)</ThemedText>
+                {Object.entries(crimeData.byCrimeType).length === 0 ? (
+                  <ThemedText style={styles.crimeDataText}>No incidents reported.</ThemedText>
+                ) : (
+                  Object.entries(crimeData.byCrimeType).map(([crimeType, counts]) => (
+                    <View key={crimeType} style={styles.statRow}>
+                      <ThemedText style={styles.crimeDataText}>{formatCrimeType(crimeType)}</ThemedText>
+                      <ThemedText style={[styles.crimeDataText, styles.boldText]}>
+                        {counts.month} ({counts.all} total)
+                      </ThemedText>
+                    </View>
+                  ))
+                )}
+
+                <ThemedText style={styles.sectionTitle}>By Severity (last 30 days)</ThemedText>
+                {Object.entries(crimeData.bySeverity).map(([severity, counts]) => (
+                  <View key={severity} style={styles.statRow}>
+                    <ThemedText style={styles.crimeDataText}>Severity {severity}</ThemedText>
+                    <ThemedText style={[styles.crimeDataText, styles.boldText]}>{counts.month}</ThemedText>
+                  </View>
+                ))}
               </ScrollView>
             )
           )}
@@ -275,6 +273,20 @@ const styles = StyleSheet.create({
     fontWeight: 'bold',
     color: '#1A237E',
   },
+  sectionTitle: {
+    fontSize: 18,
+    fontWeight: 'bold',
+    color: '#1A237E',
+    marginTop: 16,
+    marginBottom: 8,
+  },
+  statRow: {
+    flexDirection: 'row',
+    justifyContent: 'space-between',
+    paddingVertical: 6,
+    borderBottomWidth: 1,
+    borderBottomColor: '#E0E0E0',
+  },
   modalOverlay: {
     flex: 1,
     backgroundColor: 'rgba(0, 0, 0, 0.5)',